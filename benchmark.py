@@ -0,0 +1,839 @@
+# Benchmarks for the encrypted trie
+#
+# Usage: python benchmark.py ciphers [--words N]
+#        python benchmark.py memory [--words N]
+#        python benchmark.py radix [--words N] [--queries N]
+#        python benchmark.py snapshot [--words N] [--path FILE]
+#        python benchmark.py journal [--words N] [--selections N] [--path DIR]
+#        python benchmark.py ingest [--words N] [--backend NAME] [--workers N]
+#        python benchmark.py concurrency [--readers N] [--writers N] [--seconds S] [--engine NAME]
+#        python benchmark.py sharded [--words N] [--shards N] [--backend NAME]
+#        python benchmark.py cache [--words N] [--queries N] [--update-ratio R] [-k N] [--max-kib N]
+#        python benchmark.py substring [--words N] [--queries N] [-k N]
+#        python benchmark.py fuzzy [--words N] [--queries N] [-k N] [--length N] [--max-ratio R ...]
+#        python benchmark.py suite [--engines NAME|MODULE:CLASS ...] [--sizes N ...]
+#                                  [--backend aes-gcm|rsa-oaep|none] [--output FILE]
+import argparse
+import heapq
+import importlib
+import inspect
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import string
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from ciphers import AESGCMBackend, RSAOAEPBackend
+from concurrent_trie import ConcurrentEncryptedTrie
+from corpus import read_corpus
+from journal import open_journaled
+from keys import KeyManager, default_keys as keys
+from radix import RadixTrie
+from search import EncryptedTrie, Trie, client_decrypt_suggestions, predefined_words
+from sharded import ShardedEncryptedTrie
+
+
+def synthetic_words(count, seed=0):
+    # Distinct lowercase words of 3 to 12 letters
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 12))))
+    return sorted(words)
+
+
+class LegacyTrieNode:
+    # Node layout before TrieNode used __slots__, for the memory comparison
+    def __init__(self):
+        self.children = {}
+        self.is_end_of_word = False
+        self.encrypted_word = None
+        self.frequency = 0
+        self.top_k = ()
+
+
+class LegacyTrie(Trie):
+    node_class = LegacyTrieNode
+
+
+class LegacyEncryptedTrie(EncryptedTrie):
+    node_class = LegacyTrieNode
+
+
+def count_nodes(trie):
+    count = 0
+    stack = [trie.root]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(node.children.values())
+    return count
+
+
+def bench_ciphers(args):
+    # Insert and client-side decrypt throughput for each cipher backend
+    words = synthetic_words(args.words)
+    print(f"{'backend':<10} {'insert words/s':>15} {'decrypt words/s':>16} {'bytes/word':>11}")
+    for backend in (RSAOAEPBackend(keys.public_key), AESGCMBackend(keys.public_key)):
+        trie = EncryptedTrie(keys.public_key, keys.decipher, backend=backend)
+        start = time.perf_counter()
+        for word in words:
+            trie.insert_encrypted(word)
+        insert_time = time.perf_counter() - start
+
+        encrypted_suggestions = trie.autocomplete_encrypted("")
+        client_decipher = backend.client_decipher(keys.decipher)
+        start = time.perf_counter()
+        decrypted_suggestions = client_decrypt_suggestions(encrypted_suggestions, client_decipher)
+        decrypt_time = time.perf_counter() - start
+        assert sorted(decrypted_suggestions) == words
+
+        size = sum(len(encrypted_word) for encrypted_word in encrypted_suggestions) / len(words)
+        print(f"{backend.name:<10} {len(words) / insert_time:>15.0f} {len(words) / decrypt_time:>16.0f} {size:>11.1f}")
+
+
+def bench_memory(args):
+    # Heap bytes used to build the trie, per node and per inserted character,
+    # for the slotted TrieNode against the previous __dict__-based layout
+    words = synthetic_words(args.words)
+    characters = sum(len(word) for word in words)
+    backend = AESGCMBackend(keys.public_key)
+    print(f"{'layout':<28} {'nodes':>9} {'MiB':>9} {'bytes/node':>11} {'bytes/char':>11}")
+    layouts = [
+        ("Trie, __dict__ nodes", lambda: LegacyTrie(), "insert"),
+        ("Trie, slotted nodes", lambda: Trie(), "insert"),
+        ("RadixTrie, slotted nodes", lambda: RadixTrie(), "insert"),
+        ("EncryptedTrie, __dict__", lambda: LegacyEncryptedTrie(keys.public_key, keys.decipher, backend=backend), "insert_encrypted"),
+        ("EncryptedTrie, slotted", lambda: EncryptedTrie(keys.public_key, keys.decipher, backend=backend), "insert_encrypted"),
+    ]
+    for name, make_trie, insert in layouts:
+        tracemalloc.start()
+        trie = make_trie()
+        for word in words:
+            getattr(trie, insert)(word)
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        nodes = count_nodes(trie)
+        print(f"{name:<28} {nodes:>9} {used / 2**20:>9.1f} {used / nodes:>11.1f} {used / characters:>11.1f}")
+        del trie
+
+
+def bench_radix(args):
+    # Node count, build time and prefix lookup latency of the character trie
+    # against the radix trie, on the same vocabulary
+    words = sorted(set(synthetic_words(args.words) + predefined_words))
+    rng = random.Random(1)
+    sample = [rng.choice(words) for _ in range(args.queries)]
+    print(f"{'engine':<8} {'nodes':>9} {'build s':>8}  lookup us by prefix length (locate / autocomplete)")
+    for name, trie_class in (("trie", Trie), ("radix", RadixTrie)):
+        trie = trie_class()
+        start = time.perf_counter()
+        for word in words:
+            trie.insert(word)
+        build_time = time.perf_counter() - start
+
+        timings = []
+        for length in (1, 2, 3, 4):
+            prefixes = [word[:length] for word in sample]
+            start = time.perf_counter()
+            for prefix in prefixes:
+                trie._locate(prefix)
+            locate_time = time.perf_counter() - start
+            start = time.perf_counter()
+            for prefix in prefixes:
+                trie.autocomplete(prefix)
+            autocomplete_time = time.perf_counter() - start
+            timings.append(f"{length}: {locate_time / len(prefixes) * 1e6:.2f} / {autocomplete_time / len(prefixes) * 1e6:.0f}")
+        print(f"{name:<8} {count_nodes(trie):>9} {build_time:>8.2f}  " + "  ".join(timings))
+
+
+def bench_snapshot(args):
+    # Snapshot size, save time and open time, against rebuilding the trie
+    words = synthetic_words(args.words)
+    path = args.path or os.path.join(tempfile.mkdtemp(), "trie.snapshot")
+    trie = EncryptedTrie(keys.public_key, keys.decipher, backend=AESGCMBackend(keys.public_key))
+    start = time.perf_counter()
+    trie.insert_many_encrypted(words, workers=os.cpu_count())
+    print(f"rebuild and encrypt  {time.perf_counter() - start:9.3f} s")
+
+    start = time.perf_counter()
+    trie.save(path)
+    print(f"save                 {time.perf_counter() - start:9.3f} s  {os.path.getsize(path) / 2**20:.1f} MiB")
+
+    start = time.perf_counter()
+    loaded = EncryptedTrie.load(path)
+    print(f"load, in memory      {time.perf_counter() - start:9.3f} s")
+    del loaded
+
+    start = time.perf_counter()
+    mapped = EncryptedTrie.load(path, mmap=True)
+    print(f"load, memory-mapped  {time.perf_counter() - start:9.3f} s")
+    start = time.perf_counter()
+    mapped.autocomplete_encrypted(words[len(words) // 2][:2], k=10)
+    print(f"first mapped query   {time.perf_counter() - start:9.3f} s")
+    mapped.close()
+
+
+def bench_journal(args):
+    # Cost of journaling frequency increments, against the bare trie and
+    # against saving a snapshot per selection; then replay and compaction
+    words = synthetic_words(args.words)
+    directory = args.path or tempfile.mkdtemp()
+
+    def build():
+        trie = EncryptedTrie(keys.public_key, keys.decipher, backend=AESGCMBackend(keys.public_key))
+        trie.insert_many_encrypted(words, workers=os.cpu_count())
+        return trie
+
+    trie, journal = open_journaled(directory, build, EncryptedTrie, keys.decipher)
+    selections = random.Random(1).choices(words, k=args.selections)
+    start = time.perf_counter()
+    for word in selections:
+        EncryptedTrie.increase_word_frequency(trie, word)
+    bare = time.perf_counter() - start
+    start = time.perf_counter()
+    for word in selections:
+        trie.increase_word_frequency(word)
+    journal.commit()
+    journaled = time.perf_counter() - start
+    print(f"increments, bare        {len(selections) / bare:12.0f} /s")
+    print(f"increments, journaled   {len(selections) / journaled:12.0f} /s  "
+          f"{journal.commits} group commits, {journal.journal_bytes / 2**10:.0f} KiB")
+    start = time.perf_counter()
+    trie.save(os.path.join(directory, "per-selection.tmp"))
+    print(f"one snapshot per select {1 / (time.perf_counter() - start):12.0f} /s")
+    journal.close()
+
+    start = time.perf_counter()
+    trie, journal = open_journaled(directory, build, EncryptedTrie, keys.decipher)
+    print(f"open and replay         {time.perf_counter() - start:12.3f} s")
+    start = time.perf_counter()
+    journal.compact(wait=True)
+    print(f"compaction              {time.perf_counter() - start:12.3f} s  (background)")
+    journal.close()
+
+
+def bench_ingest(args):
+    # Loading a word<TAB>count corpus: word by word (insert_many_encrypted,
+    # then one increase_word_frequency per word) against insert_corpus
+    # streaming the file, sorted and shuffled
+    words, weights = zipf_vocabulary(args.words)
+    counts = [max(1, int(weight * 10 ** 6)) for weight in weights]
+    directory = tempfile.mkdtemp()
+    sorted_path = os.path.join(directory, "sorted.tsv")
+    shuffled_path = os.path.join(directory, "shuffled.tsv")
+    with open(shuffled_path, "w") as corpus_file:
+        corpus_file.writelines(f"{word}\t{count}\n" for word, count in zip(words, counts))
+    with open(sorted_path, "w") as corpus_file:
+        corpus_file.writelines(f"{word}\t{count}\n" for word, count in sorted(zip(words, counts)))
+    backend = BACKENDS[args.backend](keys.public_key)
+
+    # The reader's own memory does not grow with the file
+    tracemalloc.start()
+    for _ in read_corpus(sorted_path):
+        pass
+    print(f"read_corpus peak memory      {tracemalloc.get_traced_memory()[1] / 2**10:8.0f} KiB")
+    tracemalloc.stop()
+
+    def timed(label, load):
+        trie = EncryptedTrie(keys.public_key, keys.decipher, backend=backend)
+        start = time.perf_counter()
+        load(trie)
+        seconds = time.perf_counter() - start
+        print(f"{label:28} {seconds:8.2f} s  {args.words / seconds:9.0f} words/s")
+        return trie
+
+    def word_by_word(trie):
+        pairs = list(read_corpus(sorted_path))
+        trie.insert_many_encrypted((word for word, _ in pairs), workers=args.workers)
+        for word, count in pairs:
+            trie.increase_word_frequency(word, count)
+
+    expected = timed("word by word", word_by_word)
+    streamed = timed("insert_corpus, sorted", lambda trie: trie.insert_corpus(read_corpus(sorted_path),
+                                                                             workers=args.workers))
+    timed("insert_corpus, shuffled", lambda trie: trie.insert_corpus(read_corpus(shuffled_path),
+                                                                    workers=args.workers))
+    if sorted(streamed.autocomplete("")) != sorted(expected.autocomplete("")):
+        print("FAILED: insert_corpus built a different trie")
+        return False
+
+
+def bench_concurrency(args):
+    # Stress test: reader threads query while writer threads insert new words,
+    # delete every other one again and bump frequencies. Fails on any reader
+    # or writer exception, on a lost insert or delete and on any ranking left
+    # inconsistent once the increments are merged
+    engine = {"concurrent": ConcurrentEncryptedTrie, "plain": EncryptedTrie}[args.engine]
+    words = synthetic_words(args.words + args.writers * args.inserts)
+    initial, fresh = words[:args.words], words[args.words:]
+    trie = engine(keys.public_key, keys.decipher, backend=PlainBackend())
+    trie.insert_many_encrypted(initial)
+    if hasattr(trie, "start_flusher"):
+        trie.start_flusher()
+
+    stop = threading.Event()
+    errors = []
+    reads = Counter()
+    increments = Counter()  # word -> increments made by the writers
+    deleted = set()
+
+    def reader(seed):
+        rng = random.Random(seed)
+        count = 0
+        try:
+            while not stop.is_set():
+                word = rng.choice(initial)
+                operation = count % 4
+                if operation == 0:
+                    trie.autocomplete_encrypted(word[:2], k=10)
+                elif operation == 1:
+                    trie.autocomplete_encrypted(word[:3])
+                elif operation == 2:
+                    trie.top_k(20)
+                else:
+                    trie.autocomplete_fuzzy(word[:4], 1, k=5)
+                count += 1
+        except Exception as error:
+            errors.append(f"reader: {error!r}")
+        reads[seed] = count
+
+    def writer(index):
+        rng = random.Random(1000 + index)
+        mine = fresh[index * args.inserts:(index + 1) * args.inserts]
+        counts = Counter()
+        try:
+            for position in range(len(mine)):
+                if stop.is_set():
+                    break
+                trie.insert_encrypted(mine[position])
+                if position % 2:
+                    trie.delete(mine[position - 1])
+                    with lock:
+                        deleted.add(mine[position - 1])
+                for _ in range(10):
+                    word = rng.choice(initial)
+                    trie.increase_word_frequency(word)
+                    counts[word] += 1
+        except Exception as error:
+            errors.append(f"writer: {error!r}")
+        with lock:
+            increments.update(counts)
+
+    lock = threading.Lock()
+    threads = [threading.Thread(target=reader, args=(seed,)) for seed in range(args.readers)]
+    threads += [threading.Thread(target=writer, args=(index,)) for index in range(args.writers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads[args.readers:]:
+        thread.join()
+    time.sleep(max(0.0, args.seconds - (time.perf_counter() - start)))
+    stop.set()
+    for thread in threads[:args.readers]:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if hasattr(trie, "stop_flusher"):
+        trie.stop_flusher()
+
+    # Every increment arrived, and every cached ranking matches its subtree
+    for word, count in increments.items():
+        if trie._path(word)[-1].frequency != count:
+            errors.append(f"frequency of {word!r} is {trie._path(word)[-1].frequency}, expected {count}")
+            break
+    for node in trie._walk(trie.root):
+        expected = heapq.nlargest(trie.top_k_size, (n for n in trie._walk(node) if n.is_end_of_word),
+                                  key=lambda n: n.frequency)
+        if [n.frequency for n in node.top_k] != [n.frequency for n in expected]:
+            errors.append("a cached top-k list does not match its subtree")
+            break
+    missing = sum(1 for word in fresh if trie._contains(word) == (word in deleted))
+    if len(trie.frequency_index) != sum(1 for node in trie._walk(trie.root) if node.is_end_of_word):
+        errors.append("the frequency index does not match the stored words")
+
+    print(f"{args.engine}: {sum(reads.values()) / elapsed:.0f} reads/s over {args.readers} readers, "
+          f"{sum(increments.values())} increments, {len(fresh)} inserts and {len(deleted)} deletes "
+          f"by {args.writers} writers")
+    for error in errors[:10]:
+        print("  error:", error)
+    print("ok" if not errors and not missing else f"FAILED ({len(errors)} errors, {missing} inserts or deletes lost)")
+    return not errors and not missing
+
+
+# Engines the suite knows by name; any other MODULE:CLASS with the
+# EncryptedTrie(public_key, decipher, backend=...) constructor can be given
+ENGINES = {
+    "dsa": "dsa:EncryptedTrie",
+    "sample": "sample:EncryptedTrie",
+    "search": "search:EncryptedTrie",
+    "radix": "radix:EncryptedRadixTrie",
+    "array": "sorted_array:SortedArrayEncryptedTrie",
+}
+
+
+class PlainBackend:
+    # Stores words unencrypted, so the suite can time the data structure alone
+    name = "none"
+    wrapped_key = None
+
+    def __init__(self, public_key=None):
+        self.public_key = public_key
+
+    def encrypt(self, plaintext):
+        return plaintext
+
+    def client_decipher(self, decipher):
+        return self
+
+
+BACKENDS = {"aes-gcm": AESGCMBackend, "rsa-oaep": RSAOAEPBackend, "none": PlainBackend}
+
+
+def bench_sharded(args):
+    # One EncryptedTrie against ShardedEncryptedTrie: bulk insert, frequency
+    # updates and top-10 latency by prefix length, then a skewed insert and
+    # the shard sizes before and after rebalancing. Answers must agree
+    words, weights = zipf_vocabulary(args.words)
+    rng = random.Random(2)
+    selections = rng.choices(words, weights, k=args.updates)
+    prefixes = {length: [word[:length] for word in rng.choices(words, weights, k=args.queries)]
+                for length in (1, 2, 3, 4)}
+    skewed = ["zq" + word for word in words[:args.words // 2]]
+    backend = BACKENDS[args.backend](keys.public_key)
+    print(f"{args.words} words, {args.backend}, {args.shards or os.cpu_count()} shards, {os.cpu_count()} CPUs")
+    print(f"{'engine':<8} {'insert s':>9} {'updates/s':>10}  top-10 us by prefix length  (batch us/prefix)")
+
+    def run(name, trie):
+        start = time.perf_counter()
+        trie.insert_many_encrypted(words)
+        insert_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for word in selections:
+            trie.increase_word_frequency(word)
+        trie.top_k(1)  # Waits for the shards to apply the updates
+        update_time = time.perf_counter() - start
+        timings = []
+        for length, sample in prefixes.items():
+            start = time.perf_counter()
+            for prefix in sample:
+                trie.autocomplete_encrypted(prefix, 10)
+            timings.append(f"{length}: {(time.perf_counter() - start) / len(sample) * 1e6:.0f}")
+        batch = getattr(trie, "autocomplete_encrypted_batch", None)
+        if batch is not None:
+            start = time.perf_counter()
+            batch(prefixes[2], 10)
+            timings.append(f"({(time.perf_counter() - start) / len(prefixes[2]) * 1e6:.0f})")
+        print(f"{name:<8} {insert_time:>9.2f} {len(selections) / update_time:>10.0f}  " + "  ".join(timings))
+        trie.insert_many_encrypted(skewed)
+
+    def answers(trie):
+        return [[trie.decrypt_word(encrypted_word) for encrypted_word in trie.autocomplete_encrypted(prefix, 10)]
+                for sample in prefixes.values() for prefix in sample[:50]] + [
+            [trie.decrypt_word(encrypted_word) for encrypted_word in trie.top_k(args.queries)]]
+
+    single = EncryptedTrie(keys.public_key, keys.decipher, backend=backend)
+    run("single", single)
+    frequency = dict(single.autocomplete(""))
+    # Ties may come back in another order, so the frequencies are compared
+    expected = [[frequency[word] for word in answer] for answer in answers(single)]
+    with ShardedEncryptedTrie(keys.public_key, keys.decipher, backend=backend, shards=args.shards,
+                              rebalance_interval=0) as sharded:
+        run("sharded", sharded)
+        print(f"sizes after a skewed insert: {sharded.sizes()}  bounds {sharded.bounds}")
+        start = time.perf_counter()
+        moved = sharded.rebalance()
+        print(f"rebalanced in {time.perf_counter() - start:.2f} s, {moved} words moved: "
+              f"{sharded.sizes()}  bounds {sharded.bounds}")
+        found = [[frequency[word] for word in answer] for answer in answers(sharded)]
+    if found != expected:
+        print("FAILED: the sharded trie ranked differently")
+        return False
+
+
+def bench_cache(args):
+    # A query log dominated by short prefixes, interleaved with frequency
+    # increases, run without and with the prefix result cache. The answers
+    # must agree; the cache reports its hit rate and size
+    words, weights = zipf_vocabulary(args.words)
+    rng = random.Random(3)
+    # Prefix popularity follows the words: hot words make hot short prefixes
+    log = []
+    for word in rng.choices(words, weights, k=args.queries):
+        if rng.random() < args.update_ratio:
+            log.append((None, word))
+        else:
+            log.append((word[:rng.choice((1, 1, 2, 2, 3))], args.k or None))
+    backend = PlainBackend(keys.public_key)
+    print(f"{args.words} words, {args.queries} operations, {args.update_ratio:.0%} frequency increases, k={args.k}")
+    answers = []
+    for cached in (False, True):
+        trie = EncryptedTrie(keys.public_key, keys.decipher, backend=backend)
+        trie.insert_many_encrypted(words)
+        if cached:
+            trie.enable_result_cache(max_bytes=args.max_kib * 1024)
+        results = []
+        start = time.perf_counter()
+        for prefix, value in log:
+            if prefix is None:
+                trie.increase_word_frequency(value)
+            else:
+                results.append(trie.autocomplete_encrypted(prefix, value))
+        seconds = time.perf_counter() - start
+        print(f"{'cached' if cached else 'uncached':<9} {seconds:7.2f} s  {len(results) / seconds:9.0f} queries/s")
+        answers.append(results)
+    stats = trie.result_cache.stats()
+    print(f"hit rate {stats['hit_rate']:.1%}, {stats['entries']} entries, {stats['bytes'] / 1024:.0f} of "
+          f"{stats['max_bytes'] / 1024:.0f} KiB, {stats['evictions']} evictions, "
+          f"{stats['invalidations']} entries invalidated")
+    if answers[0] != answers[1]:
+        print("FAILED: cached results differ")
+        return False
+
+
+def bench_substring(args):
+    # autocomplete_substring against a linear scan of the vocabulary: index
+    # build time and memory, and lookup latency by fragment length
+    words, weights = zipf_vocabulary(args.words)
+    rng = random.Random(4)
+    trie = EncryptedTrie(keys.public_key, keys.decipher, backend=PlainBackend(keys.public_key))
+    trie.insert_many_encrypted(words)
+    for word in rng.choices(words, weights, k=args.words):
+        trie.increase_word_frequency(word)
+    nodes = [(word, trie._path(word)[-1]) for word in words]
+    frequency = {word: node.frequency for word, node in nodes}
+
+    def ranked_frequencies(answer):
+        return [frequency[encrypted_word.decode()] for encrypted_word in answer]  # Plain backend
+
+    start = time.perf_counter()
+    trie.autocomplete_substring("", 1)  # Builds the index
+    build_time = time.perf_counter() - start
+    # Measured on a second build: tracing every allocation slows it down
+    tracemalloc.start()
+    trie.substring_index.rebuild()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    stats = trie.substring_index.stats()
+    print(f"{args.words} words, {stats['suffixes']} suffixes: built in {build_time:.2f} s, "
+          f"{stats['bytes'] / 2**20:.1f} MiB ({stats['bytes'] / stats['suffixes']:.1f} bytes per character), "
+          f"{peak / 2**20:.1f} MiB peak while building")
+
+    print(f"{'length':>6} {'matches':>8} {'index us':>9} {'scan us':>9}")
+    for length in (2, 3, 4, 6):
+        fragments = []
+        for word in rng.choices(words, weights, k=args.queries):
+            offset = rng.randrange(max(1, len(word) - length + 1))
+            fragments.append(word[offset:offset + length])
+        start = time.perf_counter()
+        found = [trie.autocomplete_substring(fragment, args.k) for fragment in fragments]
+        index_time = time.perf_counter() - start
+        start = time.perf_counter()
+        scanned = [[node.encrypted_word
+                    for node in heapq.nlargest(args.k, (node for word, node in nodes if fragment in word),
+                                               key=lambda n: n.frequency)]
+                   for fragment in fragments]
+        scan_time = time.perf_counter() - start
+        matches = sum(len(trie.substring_index.search(fragment)) for fragment in fragments) / len(fragments)
+        print(f"{length:>6} {matches:>8.0f} {index_time / len(fragments) * 1e6:>9.0f} "
+              f"{scan_time / len(fragments) * 1e6:>9.0f}")
+        # Ties may be listed in another order, so compare the frequencies
+        if [ranked_frequencies(answer) for answer in found] != [ranked_frequencies(answer) for answer in scanned]:
+            print("FAILED: the index and the scan disagree")
+            return False
+
+    # Inserts and deletes once the index is built: each costs O(log n)
+    # amortized, however many came before it
+    churn = [f"{word}{index}" for index, word in enumerate(rng.sample(words, min(len(words), 20000)))]
+    start = time.perf_counter()
+    trie.insert_many_encrypted(churn)
+    insert_time = time.perf_counter() - start
+    start = time.perf_counter()
+    trie.delete_many(churn[::2])
+    delete_time = time.perf_counter() - start
+    stats = trie.substring_index.stats()
+    print(f"{len(churn)} inserts then {len(churn[::2])} deletes: {insert_time / len(churn) * 1e6:.0f} us per insert, "
+          f"{delete_time / len(churn[::2]) * 1e6:.0f} us per delete; {stats['segments']} segments, "
+          f"{stats['merges']} merges, {stats['rebuilds'] - 2} rebuilds")
+    fragment = churn[1][-3:]
+    expected = sorted(word for word in words + churn[1::2] if fragment in word)
+    if sorted(encrypted_word.decode() for encrypted_word in trie.autocomplete_substring(fragment)) != expected:
+        print("FAILED: the index lost track of the inserts and deletes")
+        return False
+
+
+def bench_fuzzy(args):
+    # autocomplete_fuzzy against autocomplete_encrypted on the same prefixes,
+    # every other one with a typo, for each edit limit up to
+    # len(args.max_ratio); fails when fuzzy is more than max_ratio times slower
+    words, weights = zipf_vocabulary(args.words)
+    rng = random.Random(6)
+    trie = EncryptedTrie(keys.public_key, keys.decipher, backend=PlainBackend(keys.public_key))
+    trie.insert_many_encrypted(words)
+    for word in rng.choices(words, weights, k=args.words):
+        trie.increase_word_frequency(word)
+    prefixes = []
+    for index, word in enumerate(rng.choices(words, weights, k=args.queries)):
+        prefix = word[:args.length]
+        if index % 2 and prefix:
+            position = rng.randrange(len(prefix))
+            prefix = prefix[:position] + rng.choice(string.ascii_lowercase) + prefix[position + 1:]
+        prefixes.append(prefix)
+
+    def per_query(lookup):
+        start = time.perf_counter()
+        for prefix in prefixes:
+            lookup(prefix)
+        return (time.perf_counter() - start) / len(prefixes)
+
+    k = args.k or None
+    exact_time = per_query(lambda prefix: trie.autocomplete_encrypted(prefix, k))
+    print(f"{args.words} words, {len(prefixes)} prefixes of {args.length} characters, k={k}: "
+          f"exact {exact_time * 1e6:.1f} us")
+    print(f"{'edits':>5} {'fuzzy us':>9} {'ratio':>7} {'limit':>7}")
+    failed = False
+    for max_edits, limit in enumerate(args.max_ratio, 1):
+        fuzzy_time = per_query(lambda prefix: trie.autocomplete_fuzzy(prefix, max_edits, k))
+        ratio = fuzzy_time / exact_time
+        print(f"{max_edits:>5} {fuzzy_time * 1e6:>9.0f} {ratio:>7.0f} {limit:>7.0f}")
+        failed = failed or ratio > limit
+    if failed:
+        print("FAILED: fuzzy lookups are slower than the limit")
+        return False
+
+
+def zipf_vocabulary(count, exponent=1.0, seed=0):
+    # Distinct words in random rank order, with Zipf weights 1 / rank**exponent
+    words = synthetic_words(count, seed)
+    random.Random(seed).shuffle(words)
+    weights = [1 / rank ** exponent for rank in range(1, count + 1)]
+    return words, weights
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile of an already sorted list
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def load_engine(spec):
+    module_name, class_name = ENGINES.get(spec, spec).split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def run_case(spec, size, args, key_path):
+    # One engine at one vocabulary size, in a fresh process so that peak RSS
+    # and garbage collector state belong to this case alone
+    key_manager = KeyManager(key_path)
+    engine = load_engine(spec)
+    backend = BACKENDS[args["backend"]](key_manager.public_key)
+    words, weights = zipf_vocabulary(size, args["zipf"])
+    rng = random.Random(1)
+    result = {"engine": spec, "size": size, "backend": backend.name}
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    trie = engine(key_manager.public_key, key_manager.decipher, backend=backend)
+    start = time.perf_counter()
+    if hasattr(trie, "insert_many_encrypted"):
+        trie.insert_many_encrypted(words, workers=args["workers"])
+    else:
+        for word in words:
+            trie.insert_encrypted(word)
+    result["build_s"] = time.perf_counter() - start
+
+    # Steady-state inserts of words that are not in the trie yet
+    vocabulary = set(words)
+    extra = [word for word in synthetic_words(size + args["inserts"], seed=1) if word not in vocabulary][:args["inserts"]]
+    start = time.perf_counter()
+    for word in extra:
+        trie.insert_encrypted(word)
+    result["insert_encrypted_per_s"] = len(extra) / (time.perf_counter() - start)
+
+    # Zipf-distributed selections; they also give the ranking something to rank
+    if hasattr(trie, "increase_word_frequency"):
+        selections = rng.choices(words, weights, k=args["updates"])
+        start = time.perf_counter()
+        for word in selections:
+            trie.increase_word_frequency(word)
+        result["increase_word_frequency_per_s"] = len(selections) / (time.perf_counter() - start)
+    else:
+        result["increase_word_frequency_per_s"] = None
+
+    # Latency by prefix length, for prefixes of Zipf-sampled words: the full
+    # ranked list, and the top 10 where the engine can be asked for just those
+    top_k = "k" in inspect.signature(trie.autocomplete_encrypted).parameters
+    queries = rng.choices(words, weights, k=args["queries"])
+    result["autocomplete_us"] = {}
+    result["autocomplete_top10_us"] = {} if top_k else None
+    for length in args["prefix_lengths"]:
+        prefixes = [word[:length] for word in queries]
+        calls = [("autocomplete_us", {})]
+        if top_k:
+            calls.append(("autocomplete_top10_us", {"k": 10}))
+        for name, kwargs in calls:
+            timings = []
+            for prefix in prefixes:
+                start = time.perf_counter()
+                trie.autocomplete_encrypted(prefix, **kwargs)
+                timings.append((time.perf_counter() - start) * 1e6)
+            timings.sort()
+            result[name][str(length)] = {"p50": percentile(timings, 0.50), "p99": percentile(timings, 0.99)}
+
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result["peak_rss_mib"] = peak * scale / 2**20
+    result["trie_rss_mib"] = (peak - baseline) * scale / 2**20
+    return result
+
+
+def bench_suite(args):
+    # Every engine at every vocabulary size, one fresh process per case
+    key_path = args.key_file or os.path.join(tempfile.mkdtemp(), "benchmark_key.pem")
+    KeyManager(key_path).key  # Generated once and shared with every case
+    case_args = {
+        "backend": args.backend,
+        "zipf": args.zipf,
+        "workers": args.workers,
+        "inserts": args.inserts,
+        "updates": args.updates,
+        "queries": args.queries,
+        "prefix_lengths": args.prefix_lengths,
+    }
+    results = []
+    context = multiprocessing.get_context("spawn")
+    print(f"{'engine':<10} {'words':>8} {'build s':>8} {'insert/s':>9} {'freq/s':>9} {'MiB':>7}  "
+          "autocomplete p50/p99 us by prefix length (top 10 in brackets)")
+    for size in args.sizes:
+        for spec in args.engines:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                result = pool.submit(run_case, spec, size, case_args, key_path).result()
+            results.append(result)
+
+            latency = []
+            for length, timing in result["autocomplete_us"].items():
+                text = f"{length}: {timing['p50']:.0f}/{timing['p99']:.0f}"
+                if result["autocomplete_top10_us"] is not None:
+                    top = result["autocomplete_top10_us"][length]
+                    text += f" [{top['p50']:.0f}/{top['p99']:.0f}]"
+                latency.append(text)
+            frequency = result["increase_word_frequency_per_s"]
+            print(f"{spec:<10} {size:>8} {result['build_s']:>8.2f} {result['insert_encrypted_per_s']:>9.0f} "
+                  f"{'-' if frequency is None else f'{frequency:.0f}':>9} {result['trie_rss_mib']:>7.1f}  " + "  ".join(latency))
+
+    if args.output:
+        report = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "settings": dict(case_args, engines=args.engines, sizes=args.sizes),
+            "results": results,
+        }
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encrypted trie benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ciphers = commands.add_parser("ciphers", help="insert and decrypt throughput per cipher backend")
+    ciphers.add_argument("--words", type=int, default=2000)
+    ciphers.set_defaults(run=bench_ciphers)
+
+    memory = commands.add_parser("memory", help="memory per node for each TrieNode layout")
+    memory.add_argument("--words", type=int, default=20000)
+    memory.set_defaults(run=bench_memory)
+
+    radix = commands.add_parser("radix", help="character trie against radix trie")
+    radix.add_argument("--words", type=int, default=100000)
+    radix.add_argument("--queries", type=int, default=200)
+    radix.set_defaults(run=bench_radix)
+
+    snapshot = commands.add_parser("snapshot", help="snapshot save and open times")
+    snapshot.add_argument("--words", type=int, default=100000)
+    snapshot.add_argument("--path", help="snapshot file to write (default: a temporary file)")
+    snapshot.set_defaults(run=bench_snapshot)
+
+    journal = commands.add_parser("journal", help="frequency journal cost, replay and compaction")
+    journal.add_argument("--words", type=int, default=100000)
+    journal.add_argument("--selections", type=int, default=100000)
+    journal.add_argument("--path", help="data directory (default: a temporary one)")
+    journal.set_defaults(run=bench_journal)
+
+    ingest = commands.add_parser("ingest", help="streaming corpus load against word-by-word inserts")
+    ingest.add_argument("--words", type=int, default=200000)
+    ingest.add_argument("--backend", choices=["aes-gcm", "rsa-oaep", "none"], default="none")
+    ingest.add_argument("--workers", type=int, default=None)
+    ingest.set_defaults(run=bench_ingest)
+
+    concurrency = commands.add_parser("concurrency", help="stress test with parallel readers and writers")
+    concurrency.add_argument("--engine", choices=["concurrent", "plain"], default="concurrent")
+    concurrency.add_argument("--words", type=int, default=20000, help="words loaded before the test")
+    concurrency.add_argument("--readers", type=int, default=4)
+    concurrency.add_argument("--writers", type=int, default=4)
+    concurrency.add_argument("--inserts", type=int, default=2000, help="new words per writer")
+    concurrency.add_argument("--seconds", type=float, default=5, help="minimum run time")
+    concurrency.set_defaults(run=bench_concurrency)
+
+    sharded = commands.add_parser("sharded", help="one trie against a process-sharded trie")
+    sharded.add_argument("--words", type=int, default=20000)
+    sharded.add_argument("--shards", type=int, default=None, help="worker processes (default: one per CPU)")
+    sharded.add_argument("--backend", choices=sorted(BACKENDS), default="aes-gcm")
+    sharded.add_argument("--updates", type=int, default=100000, help="increase_word_frequency calls")
+    sharded.add_argument("--queries", type=int, default=200, help="queries per prefix length")
+    sharded.set_defaults(run=bench_sharded)
+
+    cache = commands.add_parser("cache", help="prefix result cache on a short-prefix query log")
+    cache.add_argument("--words", type=int, default=50000)
+    cache.add_argument("--queries", type=int, default=10000, help="operations in the log")
+    cache.add_argument("--update-ratio", type=float, default=0.1, help="share of frequency increases")
+    cache.add_argument("-k", type=int, default=50, help="suggestions per query (0 for all)")
+    cache.add_argument("--max-kib", type=int, default=16384, help="cache budget")
+    cache.set_defaults(run=bench_cache)
+
+    substring = commands.add_parser("substring", help="substring index against a linear scan")
+    substring.add_argument("--words", type=int, default=100000)
+    substring.add_argument("--queries", type=int, default=200, help="fragments per length")
+    substring.add_argument("-k", type=int, default=10, help="suggestions per query")
+    substring.set_defaults(run=bench_substring)
+
+    fuzzy = commands.add_parser("fuzzy", help="fuzzy against exact autocomplete latency")
+    fuzzy.add_argument("--words", type=int, default=100000)
+    fuzzy.add_argument("--queries", type=int, default=300)
+    fuzzy.add_argument("-k", type=int, default=5, help="suggestions per query (0 for all)")
+    fuzzy.add_argument("--length", type=int, default=4, help="prefix length")
+    fuzzy.add_argument("--max-ratio", type=float, nargs="+", default=[250, 1000],
+                       help="largest fuzzy / exact latency ratio, for max_edits 1, 2, ...")
+    fuzzy.set_defaults(run=bench_fuzzy)
+
+    suite = commands.add_parser("suite", help="build, insert, frequency and latency suite for several engines")
+    suite.add_argument("--engines", nargs="+", default=list(ENGINES),
+                       help="engine names (%s) or MODULE:CLASS" % ", ".join(ENGINES))
+    suite.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000, 100000],
+                       help="vocabulary sizes (up to 1000000 is practical)")
+    suite.add_argument("--backend", choices=sorted(BACKENDS), default="aes-gcm")
+    suite.add_argument("--zipf", type=float, default=1.0, help="Zipf exponent of word popularity")
+    suite.add_argument("--workers", type=int, help="encryption processes for bulk loads")
+    suite.add_argument("--inserts", type=int, default=1000, help="words inserted one by one after the build")
+    suite.add_argument("--updates", type=int, default=100000, help="increase_word_frequency calls")
+    suite.add_argument("--queries", type=int, default=200, help="queries per prefix length")
+    suite.add_argument("--prefix-lengths", nargs="+", type=int, default=[1, 2, 3, 4])
+    suite.add_argument("--key-file", help="RSA key to use (default: a new temporary key)")
+    suite.add_argument("--output", help="write the results as JSON to this file")
+    suite.set_defaults(run=bench_suite)
+
+    args = parser.parse_args()
+    if args.run(args) is False:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
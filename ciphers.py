@@ -0,0 +1,288 @@
+# Pluggable encryption backends for EncryptedTrie
+#
+# A backend encrypts words on the server side and hands the client an object
+# with a decrypt(encrypted_word) method, so client_decrypt_suggestions works
+# the same whichever backend produced the ciphertexts.
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+
+from Crypto.Cipher import AES, PKCS1_OAEP
+from Crypto.PublicKey import RSA
+from Crypto.Random import get_random_bytes
+
+
+class RSAOAEPBackend:
+    # Compatibility mode: every word is its own 2048-bit RSA-OAEP ciphertext
+    name = "rsa-oaep"
+    wrapped_key = None  # No data key to store alongside the ciphertexts
+
+    def __init__(self, public_key):
+        self.public_key = public_key
+        self.cipher = PKCS1_OAEP.new(public_key)
+
+    def encrypt(self, plaintext):
+        return self.cipher.encrypt(plaintext)
+
+    def client_decipher(self, decipher):
+        # The client's RSA private-key cipher decrypts the words directly
+        return decipher
+
+    def __getstate__(self):
+        # PKCS1_OAEP ciphers do not pickle; worker processes rebuild it from the key
+        return {"public_key": self.public_key.export_key("DER")}
+
+    def __setstate__(self, state):
+        self.__init__(RSA.import_key(state["public_key"]))
+
+
+class AESGCMBackend:
+    # Envelope encryption: words are encrypted with AES-GCM under a random data
+    # key, and only the data key is encrypted with the RSA public key, once
+    name = "aes-gcm"
+    KEY_SIZE = 32
+    NONCE_SIZE = 12
+    TAG_SIZE = 16
+
+    def __init__(self, public_key, data_key=None):
+        self.public_key = public_key
+        self._data_key = data_key if data_key is not None else get_random_bytes(self.KEY_SIZE)
+        self.wrapped_key = PKCS1_OAEP.new(public_key).encrypt(self._data_key)
+        self._unwrap_decipher = None
+
+    @classmethod
+    def from_wrapped_key(cls, public_key, wrapped_key, decipher):
+        # Reopen a backend from a stored wrapped key. The data key is unwrapped
+        # with the RSA private key only when it is first needed
+        backend = cls.__new__(cls)
+        backend.public_key = public_key
+        backend.wrapped_key = wrapped_key
+        backend._data_key = None
+        backend._unwrap_decipher = decipher
+        return backend
+
+    @property
+    def data_key(self):
+        if self._data_key is None:
+            self._data_key = self._unwrap_decipher.decrypt(self.wrapped_key)
+        return self._data_key
+
+    def encrypt(self, plaintext):
+        # nonce + ciphertext + tag: 28 bytes of overhead instead of a 256-byte block
+        nonce = get_random_bytes(self.NONCE_SIZE)
+        cipher = AES.new(self.data_key, AES.MODE_GCM, nonce=nonce)
+        ciphertext, tag = cipher.encrypt_and_digest(plaintext)
+        return nonce + ciphertext + tag
+
+    def client_decipher(self, decipher):
+        # The client unwraps the data key with its RSA private key, once
+        return AESGCMDecipher(decipher.decrypt(self.wrapped_key))
+
+    def __getstate__(self):
+        return {
+            "public_key": self.public_key.export_key("DER"),
+            "data_key": self.data_key,
+            "wrapped_key": self.wrapped_key,
+        }
+
+    def __setstate__(self, state):
+        # Keep the existing wrapped key so workers share one data key
+        self.public_key = RSA.import_key(state["public_key"])
+        self._data_key = state["data_key"]
+        self.wrapped_key = state["wrapped_key"]
+        self._unwrap_decipher = None
+
+
+class AESGCMDecipher:
+    # Client-side counterpart of AESGCMBackend
+    def __init__(self, data_key):
+        self.data_key = data_key
+
+    def decrypt(self, encrypted_word):
+        nonce = encrypted_word[:AESGCMBackend.NONCE_SIZE]
+        ciphertext = encrypted_word[AESGCMBackend.NONCE_SIZE:-AESGCMBackend.TAG_SIZE]
+        tag = encrypted_word[-AESGCMBackend.TAG_SIZE:]
+        cipher = AES.new(self.data_key, AES.MODE_GCM, nonce=nonce)
+        return cipher.decrypt_and_verify(ciphertext, tag)
+
+
+def open_backend(name, public_key, wrapped_key, decipher):
+    # Rebuild a backend from what a snapshot stores about it
+    if name == RSAOAEPBackend.name:
+        return RSAOAEPBackend(public_key)
+    if name == AESGCMBackend.name:
+        return AESGCMBackend.from_wrapped_key(public_key, wrapped_key, decipher)
+    raise ValueError(f"unknown cipher backend {name!r}")
+
+
+# Decrypted words remembered by a ClientDecryptor
+DECRYPT_CACHE_SIZE = 1024
+
+# Smallest number of cache misses worth handing to the decryption pool
+DECRYPT_POOL_THRESHOLD = 32
+
+
+class ClientDecryptor:
+    # Client-side decryption layer around a decipher: a bounded LRU cache keyed
+    # by ciphertext bytes, lazy decryption of only the items that are used, and
+    # an optional thread pool for large batches. hits and misses count cache
+    # lookups so cache_size can be tuned
+    def __init__(self, decipher, cache_size=DECRYPT_CACHE_SIZE, workers=None):
+        self.decipher = decipher
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # encrypted word -> plaintext, oldest first
+        self.hits = 0
+        self.misses = 0
+        self.pool = ThreadPoolExecutor(max_workers=workers) if workers and workers > 1 else None
+
+    def decrypt(self, encrypted_word):
+        word = self.cache.get(encrypted_word)
+        if word is not None:
+            self.hits += 1
+            self.cache.move_to_end(encrypted_word)
+            return word
+        self.misses += 1
+        word = self.decipher.decrypt(encrypted_word).decode()
+        self._remember(encrypted_word, word)
+        return word
+
+    def iter_decrypt(self, suggestions):
+        # Generator: a suggestion is decrypted only when the caller asks for it
+        for encrypted_word in suggestions:
+            yield self.decrypt(encrypted_word)
+
+    def lazy(self, suggestions):
+        # Sequence view that decrypts an item the first time it is indexed
+        return DecryptedSuggestions(suggestions, self)
+
+    def paged(self, suggestions):
+        # Like lazy(), for an iterator of ciphertexts that is only read as far
+        # as the caller loads it
+        return PagedSuggestions(suggestions, self)
+
+    def decrypt_many(self, suggestions):
+        # Decrypt a whole batch; cache misses go to the pool when there are enough
+        suggestions = list(suggestions)
+        if self.pool is None:
+            return [self.decrypt(encrypted_word) for encrypted_word in suggestions]
+
+        decrypted = {}
+        missing = []
+        for encrypted_word in dict.fromkeys(suggestions):
+            word = self.cache.get(encrypted_word)
+            if word is None:
+                missing.append(encrypted_word)
+            else:
+                self.hits += 1
+                self.cache.move_to_end(encrypted_word)
+                decrypted[encrypted_word] = word
+        if len(missing) >= DECRYPT_POOL_THRESHOLD:
+            words = self.pool.map(self.decipher.decrypt, missing)
+        else:
+            words = map(self.decipher.decrypt, missing)
+        for encrypted_word, word in zip(missing, words):
+            self.misses += 1
+            decrypted[encrypted_word] = word.decode()
+            self._remember(encrypted_word, decrypted[encrypted_word])
+        return [decrypted[encrypted_word] for encrypted_word in suggestions]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self.cache),
+            "cache_size": self.cache_size,
+        }
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def _remember(self, encrypted_word, word):
+        if self.cache_size <= 0:
+            return
+        self.cache[encrypted_word] = word
+        self.cache.move_to_end(encrypted_word)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+
+class DecryptedSuggestions:
+    # Read-only list of plaintext suggestions backed by ciphertexts; items are
+    # decrypted through the ClientDecryptor on first access
+    def __init__(self, suggestions, decryptor):
+        self.suggestions = suggestions
+        self.decryptor = decryptor
+
+    def __len__(self):
+        return len(self.suggestions)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.decryptor.decrypt(encrypted_word) for encrypted_word in self.suggestions[index]]
+        return self.decryptor.decrypt(self.suggestions[index])
+
+    def __iter__(self):
+        return self.decryptor.iter_decrypt(self.suggestions)
+
+
+class PagedSuggestions(DecryptedSuggestions):
+    # DecryptedSuggestions over an iterator, e.g. EncryptedTrie.iter_ranked_encrypted.
+    # len() counts the ciphertexts loaded so far; load(count) reads more from
+    # the iterator, so a menu fetches results one page at a time as it scrolls
+    def __init__(self, suggestions, decryptor):
+        super().__init__([], decryptor)
+        self.source = iter(suggestions)
+        self.exhausted = False  # Every suggestion has been loaded
+
+    def load(self, count):
+        # Read until count suggestions are loaded or the iterator runs out
+        if not self.exhausted:
+            missing = count - len(self.suggestions)
+            if missing > 0:
+                self.suggestions.extend(islice(self.source, missing))
+                self.exhausted = len(self.suggestions) < count
+        return len(self.suggestions)
+
+    def __iter__(self):
+        index = 0
+        while index < self.load(index + 1):
+            yield self[index]
+            index += 1
+
+
+# Backend of the current worker process, set once by _init_worker
+_worker_backend = None
+
+
+def _init_worker(backend):
+    global _worker_backend
+    _worker_backend = backend
+
+
+def _encrypt_chunk(words):
+    return [_worker_backend.encrypt(word.encode()) for word in words]
+
+
+def encrypt_chunks(backend, chunks, workers=None):
+    # Yield (words, encrypted_words) for every chunk of words, in order. With
+    # workers > 1 the chunks are encrypted in a process pool; at most two
+    # chunks per worker are in flight, so memory stays bounded on long inputs
+    if workers is None or workers <= 1:
+        for words in chunks:
+            yield words, [backend.encrypt(word.encode()) for word in words]
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(backend,)) as pool:
+        pending = deque()
+        for words in chunks:
+            pending.append((words, pool.submit(_encrypt_chunk, words)))
+            if len(pending) >= 2 * workers:
+                words, future = pending.popleft()
+                yield words, future.result()
+        while pending:
+            words, future = pending.popleft()
+            yield words, future.result()
@@ -0,0 +1,212 @@
+# Thread-safe EncryptedTrie: readers never take a lock
+#
+# A reader only follows references, so the trie stays readable as long as
+# every change is published with a single reference assignment:
+#   - a node's children dict is never changed once readers can see it; an
+#     insert builds the missing tail of the word off to the side and swaps in
+#     a copy of the parent's dict that includes it (copy-on-write)
+#   - cached top-k lists are tuples and are replaced, never edited
+#   - a word node gets its ciphertext before it is marked as a word, and a
+#     deleted word node is never cleared: it is unlinked, or replaced by a
+#     copy that is not a word, so a reader holding it still sees a whole word
+# Writers (inserts, deletes and frequency merges) are serialized by one lock.
+# increase_word_frequency does not touch the trie at all: increments go into
+# sharded counters, and are merged into the trie in batches by flush(), which
+# runs when a shard fills up, from an optional background thread, or on
+# demand. Rankings therefore trail the increments by up to one batch.
+import heapq
+import threading
+from collections import Counter
+from itertools import count
+
+from search import EncryptedTrie, INSERT_CHUNK_SIZE, TOP_K_CACHE_SIZE
+from substring import SubstringIndex
+
+# Counter shards; threads take them in turn, and a thread always uses the same one
+FREQUENCY_SHARDS = 16
+
+# Increments held by one shard before they are merged into the trie
+FREQUENCY_BATCH_SIZE = 256
+
+
+class CounterShard:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.pending = 0
+
+
+class ConcurrentEncryptedTrie(EncryptedTrie):
+    def __init__(self, public_key, decipher, top_k_size=TOP_K_CACHE_SIZE, backend=None,
+                 shards=FREQUENCY_SHARDS, batch_size=FREQUENCY_BATCH_SIZE):
+        super().__init__(public_key, decipher, top_k_size, backend)
+        self.lock = threading.RLock()  # Held by writers only
+        self.shards = [CounterShard() for _ in range(shards)]
+        self.batch_size = batch_size
+        # A thread's shard, handed out round-robin on its first increment.
+        # Thread idents are aligned addresses, so ident % shards would put
+        # every thread on the same shard
+        self._thread_shard = threading.local()
+        self._next_shard = count()
+        self._flusher = None
+        self._flusher_stop = None
+
+    def insert_encrypted(self, word):
+        # Encrypt outside the lock, so inserting threads encrypt in parallel
+        if self._contains(word):
+            return
+        self._store_encrypted(word, self.encrypt_word(word))
+
+    def _store_encrypted(self, word, encrypted_word):
+        with self.lock:
+            node = self.root
+            path = [node]
+            for char in word:
+                child = node.children.get(char)
+                if child is None:
+                    break
+                node = child
+                path.append(node)
+            depth = len(path) - 1
+            if depth == len(word) and node.is_end_of_word:
+                return  # Another thread inserted it since insert_encrypted looked
+
+            # Build the rest of the word where readers cannot see it yet
+            tail = [self.node_class() for _ in word[depth:]]
+            for parent, char, child in zip(tail, word[depth + 1:], tail[1:]):
+                parent.children[char] = child
+            word_node = tail[-1] if tail else node
+            word_node.encrypted_word = encrypted_word
+            word_node.frequency = 0
+            word_node.is_end_of_word = True  # Last: a word node always has its ciphertext
+            for tail_node in tail:
+                tail_node.top_k = (word_node,)
+            if tail:
+                # Publish the whole tail with one assignment
+                self._publish(node, word[depth], tail[0])
+
+            self.frequency_index.update(word_node)
+            self._promote_top_k(path, word_node)
+            self.generation += 1
+            self._invalidate(word)
+            if self.substring_index is not None:
+                self.substring_index.add(word, word_node)
+
+    def _substring_index(self):
+        # Built and published under the writer lock: a word stored between the
+        # build's walk of the trie and its publication would never be indexed
+        index = self.substring_index
+        if index is None:
+            with self.lock:
+                index = self.substring_index
+                if index is None:
+                    index = self.substring_index = SubstringIndex(self)
+        return index
+
+    def insert_corpus(self, pairs, workers=None, chunk_size=INSERT_CHUNK_SIZE):
+        # Readers may be walking the trie, so the one-pass build, which fills
+        # children dicts in place, is not used: every word is published on
+        # its own and its count goes through the counter shards
+        inserted = self._insert_corpus_words(pairs, workers, chunk_size)
+        self.flush()
+        return inserted
+
+    def delete(self, word):
+        with self.lock:
+            return super().delete(word)
+
+    def delete_many(self, words):
+        with self.lock:
+            return super().delete_many(words)
+
+    def _delete_path(self, word, path):
+        # Same result as Trie._delete_path, published copy-on-write
+        node = path[-1]
+        depth = len(path) - 1
+        if depth == 0 or node.children:
+            # Still needed for the words below it: swap in a copy that is not
+            # a word. Its cached list still holds the word until it is rebuilt
+            replacement = self.node_class()
+            replacement.children = node.children  # Never changed in place, so it can be shared
+            replacement.top_k = node.top_k
+            if depth == 0:
+                self.root = replacement
+            else:
+                self._publish(path[-2], word[-1], replacement)
+            return path[:-1] + [replacement]
+        # Unlink the highest node of the chain that only this word needed
+        while depth > 1 and not path[depth - 1].is_end_of_word and len(path[depth - 1].children) == 1:
+            depth -= 1
+        self._publish(path[depth - 1], word[depth - 1], None)
+        return path[:depth]
+
+    def _publish(self, parent, char, child):
+        # Replace parent's children dict by a copy with char set to child
+        # (removed if child is None), in one assignment
+        children = dict(parent.children)
+        if child is None:
+            del children[char]
+        else:
+            children[char] = child
+        parent.children = children
+
+    def increase_word_frequency(self, word, amount=1):
+        # Lock-free for readers, and only a short shard lock for the caller:
+        # the trie sees the increment at the next merge
+        shard = getattr(self._thread_shard, "shard", None)
+        if shard is None:
+            shard = self._thread_shard.shard = self.shards[next(self._next_shard) % len(self.shards)]
+        with shard.lock:
+            shard.counts[word] += amount
+            shard.pending += 1
+            full = shard.pending >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        # Merge every shard's increments into the trie, one update per word.
+        # Returns the number of distinct words merged
+        batch = Counter()
+        with self.lock:
+            for shard in self.shards:
+                with shard.lock:
+                    counts, shard.counts, shard.pending = shard.counts, Counter(), 0
+                batch.update(counts)
+            for word, amount in batch.items():
+                super().increase_word_frequency(word, amount)
+        return len(batch)
+
+    def start_flusher(self, interval=0.1):
+        # Merge increments every interval seconds from a daemon thread, so a
+        # quiet shard does not hold them back for long
+        self.stop_flusher()
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                self.flush()
+
+        self._flusher_stop = stop
+        self._flusher = threading.Thread(target=run, name="frequency-flusher", daemon=True)
+        self._flusher.start()
+
+    def stop_flusher(self):
+        if self._flusher is not None:
+            self._flusher_stop.set()
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+
+    def save(self, path):
+        # A consistent snapshot: pending increments are merged and writers wait
+        with self.lock:
+            self.flush()
+            super().save(path)
+
+    def top_k(self, k):
+        # The root's cached list is the global ranking; past it, rank a copy
+        # of the heap instead of walking a heap that writers are moving
+        if k <= self.top_k_size:
+            return [node.encrypted_word for node in self.root.top_k[:k]]
+        nodes = list(self.frequency_index.heap)
+        return [node.encrypted_word for node in heapq.nlargest(k, nodes, key=lambda n: n.frequency)]
@@ -0,0 +1,50 @@
+# Streaming reader for word-frequency corpora
+#
+# A corpus is a word list (one word per line) or a TSV of word<TAB>count,
+# optionally gzip-compressed. It is read line by line, so a file of any size
+# is read in constant memory; EncryptedTrie.insert_corpus consumes the pairs
+# in bounded chunks. Words are normalized (Unicode NFKC, case-folded,
+# surrounding whitespace removed) and repeats next to each other are merged
+# by adding their counts, so a sorted file comes out without duplicates.
+import gzip
+import unicodedata
+
+# Environment variable naming a corpus the UI loads instead of the
+# predefined words
+CORPUS_FILE_ENV = "TRIE_CORPUS_FILE"
+
+
+def normalize_word(word):
+    return unicodedata.normalize("NFKC", word).casefold().strip()
+
+
+def read_corpus(path, normalize=normalize_word, default_count=1):
+    # Lazily yield (word, count). A line without a count counts
+    # default_count; blank lines are skipped
+    previous, total = None, 0
+    for word, count in _read_lines(path, normalize, default_count):
+        if word == previous:
+            total += count
+            continue
+        if previous is not None:
+            yield previous, total
+        previous, total = word, count
+    if previous is not None:
+        yield previous, total
+
+
+def _read_lines(path, normalize, default_count):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as corpus_file:
+        for line_number, line in enumerate(corpus_file, 1):
+            word, tab, count = line.rstrip("\r\n").partition("\t")
+            word = normalize(word) if normalize else word
+            if not word:
+                continue
+            if not tab:
+                yield word, default_count
+                continue
+            try:
+                yield word, int(count)
+            except ValueError:
+                raise ValueError(f"{path}:{line_number}: count {count!r} is not an integer") from None
@@ -1,4 +1,8 @@
 class TrieNode:
+    # Fixed slots instead of a per-node __dict__: a node is a small fixed-size
+    # object, which matters at millions of nodes
+    __slots__ = ("children", "is_end_of_word", "encrypted_word")
+
     def __init__(self):
         self.children = {}
         self.is_end_of_word = False
@@ -40,24 +44,30 @@ class Trie:
 
 
 # Import necessary cryptographic libraries
-from Crypto.PublicKey import RSA
-from Crypto.Cipher import PKCS1_OAEP
+from ciphers import AESGCMBackend, RSAOAEPBackend
+from keys import default_keys
+
+# RSA key pair for encryption and decryption. It is generated (or loaded from
+# the file named by TRIE_KEY_FILE) on first use, not at import
+keys = default_keys
 
-# Generate RSA key pair for encryption and decryption
-key = RSA.generate(2048)
-public_key = key.publickey()
-cipher = PKCS1_OAEP.new(public_key)
-decipher = PKCS1_OAEP.new(key)
+def __getattr__(name):
+    # Keep key, public_key, cipher and decipher readable as module attributes
+    if name in ("key", "public_key", "cipher", "decipher"):
+        return getattr(keys, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 class EncryptedTrie(Trie):
-    def __init__(self, public_key, decipher):
+    def __init__(self, public_key, decipher, backend=None):
         super().__init__()
         self.public_key = public_key
-        self.decipher = decipher
+        # Per-word RSA-OAEP unless another cipher backend is given
+        self.backend = backend if backend is not None else RSAOAEPBackend(public_key)
+        self.decipher = self.backend.client_decipher(decipher)
 
     def encrypt_word(self, word):
-        # Encrypt the entire word using RSA encryption
-        encrypted_word = cipher.encrypt(word.encode())
+        # Encrypt the entire word with the configured cipher backend
+        encrypted_word = self.backend.encrypt(word.encode())
         return encrypted_word
 
     def decrypt_word(self, encrypted_word):
@@ -102,8 +112,10 @@ def client_decrypt_suggestions(suggestions, decipher):
 
 # Main function to test the encrypted Trie autocomplete system
 def main():
-    # Create an encrypted trie
-    encrypted_trie = EncryptedTrie(public_key, decipher)
+    # Create an encrypted trie: words are encrypted with AES-GCM under a data
+    # key that is wrapped once by the RSA public key
+    encrypted_trie = EncryptedTrie(keys.public_key, keys.decipher, backend=AESGCMBackend(keys.public_key))
+    client_decipher = encrypted_trie.backend.client_decipher(keys.decipher)
 
     # Insert words into the Trie (plaintext words, but stored as encrypted)
     words = ['apple', 'app', 'application', 'apex', 'banana']
@@ -115,7 +127,7 @@ def main():
     encrypted_suggestions = encrypted_trie.autocomplete_encrypted(prefix)
 
     # Client decrypts the suggestions
-    decrypted_suggestions = client_decrypt_suggestions(encrypted_suggestions, decipher)
+    decrypted_suggestions = client_decrypt_suggestions(encrypted_suggestions, client_decipher)
 
     print(f"Autocomplete suggestions for '{prefix}': {decrypted_suggestions}")
 
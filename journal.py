@@ -0,0 +1,352 @@
+# Append-only journal of the changes made to an EncryptedTrie
+#
+# Learned frequencies would be lost when the process exits, and saving a
+# whole snapshot after every selection costs far too much. Instead, inserts
+# (with their ciphertext), deletes and frequency increments are appended to
+# a journal and written out in groups: records wait in memory until
+# BATCH_SIZE of them have piled up or COMMIT_INTERVAL seconds have passed,
+# and each group is one sequential write (and one fsync). Increments of the
+# same word within a group are merged into one record. A crash loses at most
+# the group in memory.
+#
+# A data directory holds:
+#   snapshot.<n>  snapshot with every journal segment up to n folded in
+#   journal.<n>   journal segments, replayed in order over the snapshot
+#   key.pem       the RSA key, unless it is kept in the TRIE_KEY_FILE file
+# Opening the directory loads the newest snapshot, replays the segments
+# after it and starts a new segment. Compaction seals the current segment
+# and, on a background thread, loads the snapshot into a separate trie,
+# replays the sealed segments into it and writes snapshot.<last sealed>;
+# the live trie is never paused. Older files are removed afterwards, and a
+# crash at any point leaves a snapshot and the segments that follow it.
+#
+# Record: crc32 of the body (4 bytes), body length (4 bytes), body. Bodies:
+#   INSERT     type, word length (4 bytes), word (UTF-8), ciphertext
+#   INCREMENT  type, amount (8 bytes, signed), word (UTF-8)
+#   DELETE     type, word (UTF-8)
+# All little-endian. Replay stops at the first torn or corrupt record of a
+# segment and cuts the segment there.
+import os
+import re
+import struct
+import threading
+import zlib
+from collections import Counter
+
+from keys import KeyManager, default_keys
+from metrics import unwrap_methods, wrap_method
+from snapshot import load_trie, write_snapshot
+
+# Environment variable naming the data directory the UI keeps its trie in;
+# without it the UI starts from the predefined words every time
+DATA_DIR_ENV = "TRIE_DATA_DIR"
+
+# Record types
+INSERT = 1
+INCREMENT = 2
+DELETE = 3
+
+# Records held in memory before they are written as one group
+BATCH_SIZE = 512
+
+# Seconds a record may wait in memory before its group is written anyway
+COMMIT_INTERVAL = 1.0
+
+# Bytes of journal written since the last compaction that trigger the next
+COMPACT_BYTES = 8 * 1024 * 1024
+
+RECORD_HEADER = struct.Struct("<II")
+INSERT_HEADER = struct.Struct("<BI")
+INCREMENT_HEADER = struct.Struct("<Bq")
+
+KEY_NAME = "key.pem"
+SNAPSHOT_NAME = "snapshot.{:08d}"
+SEGMENT_NAME = "journal.{:08d}"
+FILE_PATTERN = re.compile(r"(snapshot|journal)\.(\d{8})$")
+
+
+class FrequencyJournal:
+    # Attached to a trie by open_journaled(); records what the trie learns
+    def __init__(self, directory, trie, decipher=None, batch_size=BATCH_SIZE,
+                 interval=COMMIT_INTERVAL, compact_bytes=COMPACT_BYTES, fsync=True):
+        self.directory = directory
+        self.trie = trie
+        self.decipher = decipher
+        self.batch_size = batch_size
+        self.compact_bytes = compact_bytes
+        self.fsync = fsync
+        self.lock = threading.Lock()  # Guards the pending group and the segment
+        self.pending = []  # Encoded records, in order
+        self.increments = Counter()  # word -> amount not yet encoded
+        self.pending_count = 0
+        self.snapshot_seq, segments = _scan(directory)
+        self.segment_seq = max(segments, default=self.snapshot_seq) + 1
+        self.segment = open(self._path(SEGMENT_NAME, self.segment_seq), "ab")
+        self.journal_bytes = sum(os.path.getsize(self._path(SEGMENT_NAME, seq)) for seq in segments)
+        self.compactor = None
+        self.compactions = 0
+        self.commits = 0
+        self._stop = threading.Event()
+        self._committer = None
+        if interval:
+            self._committer = threading.Thread(target=self._commit_loop, args=(interval,),
+                                               name="journal-commit", daemon=True)
+            self._committer.start()
+
+    # Recording
+
+    def record_insert(self, word, encrypted_word):
+        encoded = word.encode()
+        self._append(INSERT_HEADER.pack(INSERT, len(encoded)) + encoded + encrypted_word)
+
+    def record_delete(self, word):
+        self._append(bytes([DELETE]) + word.encode())
+
+    def record_increment(self, word, amount=1):
+        with self.lock:
+            self.increments[word] += amount
+            self.pending_count += 1
+            full = self.pending_count >= self.batch_size
+        if full:
+            self.commit()
+
+    def _append(self, body):
+        with self.lock:
+            # Increments recorded so far go first, so replay keeps the order
+            self._encode_increments()
+            self.pending.append(body)
+            self.pending_count += 1
+            full = self.pending_count >= self.batch_size
+        if full:
+            self.commit()
+
+    def _encode_increments(self):
+        for word, amount in self.increments.items():
+            self.pending.append(INCREMENT_HEADER.pack(INCREMENT, amount) + word.encode())
+        self.increments.clear()
+
+    def commit(self):
+        # Write the pending group with one sequential write; returns its size
+        with self.lock:
+            self._encode_increments()
+            written = self._write_pending()
+            compact = self.journal_bytes >= self.compact_bytes and self.compactor is None
+        if compact:
+            self.compact()
+        return written
+
+    def _write_pending(self):
+        # The body of commit(), for callers already holding the lock
+        if not self.pending:
+            return 0
+        data = b"".join(RECORD_HEADER.pack(zlib.crc32(body), len(body)) + body for body in self.pending)
+        self.pending = []
+        self.pending_count = 0
+        self.segment.write(data)
+        self.segment.flush()
+        if self.fsync:
+            os.fsync(self.segment.fileno())
+        self.journal_bytes += len(data)
+        self.commits += 1
+        return len(data)
+
+    def _commit_loop(self, interval):
+        while not self._stop.wait(interval):
+            self.commit()
+
+    # Compaction
+
+    def compact(self, wait=False):
+        # Fold every segment written so far into a new snapshot, in the
+        # background unless wait is set. Returns False if one is already running
+        with self.lock:
+            if self.compactor is not None:
+                return False
+            # Seal the current segment; records from now on go to a new one
+            self._encode_increments()
+            sealed = self.segment_seq
+            self._write_pending()
+            self.segment.close()
+            self.segment_seq += 1
+            self.segment = open(self._path(SEGMENT_NAME, self.segment_seq), "ab")
+            self.journal_bytes = 0
+            compactor = self.compactor = threading.Thread(target=self._compact, args=(sealed,),
+                                                          name="journal-compact", daemon=True)
+            compactor.start()
+        if wait:
+            compactor.join()
+        return True
+
+    def _compact(self, sealed):
+        try:
+            trie = load_trie(type(self.trie), self._path(SNAPSHOT_NAME, self.snapshot_seq), self.decipher)
+            for seq in range(self.snapshot_seq + 1, sealed + 1):
+                path = self._path(SEGMENT_NAME, seq)
+                if os.path.exists(path):
+                    replay(trie, path)
+            write_snapshot(trie, self._path(SNAPSHOT_NAME, sealed))
+            self.snapshot_seq = sealed
+            _remove_through(self.directory, sealed)
+            self.compactions += 1
+        finally:
+            with self.lock:
+                self.compactor = None
+
+    # Lifetime
+
+    def close(self):
+        # Write what is pending and stop the background threads
+        self._stop.set()
+        if self._committer is not None:
+            self._committer.join()
+            self._committer = None
+        self.commit()
+        compactor = self.compactor
+        if compactor is not None:
+            compactor.join()
+        self.segment.close()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "snapshot": self.snapshot_seq,
+                "segment": self.segment_seq,
+                "journal_bytes": self.journal_bytes,
+                "pending_records": len(self.pending) + len(self.increments),
+                "commits": self.commits,
+                "compactions": self.compactions,
+            }
+
+    def _path(self, name, seq):
+        return os.path.join(self.directory, name.format(seq))
+
+
+def data_dir_keys(directory, keys=default_keys):
+    # The key pair to open a data directory with. Its snapshots hold the
+    # data key wrapped by the RSA key that wrote them, so a key generated
+    # afresh on every start could never read them again: without a key file
+    # of its own (TRIE_KEY_FILE), keys is replaced by one kept in the directory
+    if keys.path:
+        return keys
+    os.makedirs(directory, exist_ok=True)
+    return KeyManager(os.path.join(directory, KEY_NAME), keys.passphrase, keys.bits)
+
+
+def open_journaled(directory, build, trie_class, decipher=None, **options):
+    # Return (trie, journal) for a data directory. The newest snapshot is
+    # loaded and the journal replayed over it; a new directory is seeded by
+    # build(), which returns a trie, and saved as the first snapshot. From
+    # then on the trie's inserts and frequency increments are journaled
+    os.makedirs(directory, exist_ok=True)
+    snapshot_seq, segments = _scan(directory)
+    _remove_through(directory, snapshot_seq)
+    snapshot_path = os.path.join(directory, SNAPSHOT_NAME.format(snapshot_seq))
+    if os.path.exists(snapshot_path):
+        trie = load_trie(trie_class, snapshot_path, decipher)
+        for seq in segments:
+            replay(trie, os.path.join(directory, SEGMENT_NAME.format(seq)))
+    else:
+        trie = build()
+        write_snapshot(trie, snapshot_path)
+    journal = FrequencyJournal(directory, trie, decipher, **options)
+    attach(trie, journal)
+    return trie, journal
+
+
+def attach(trie, journal):
+    # Journal this trie's changes. Like Metrics.instrument, the wrappers are
+    # set on the instance with wrap_method, so other tries (and replay) run
+    # the plain methods, and metrics can be enabled and disabled on top
+    def journaled_store(word, encrypted_word):
+        # Recorded before it is applied, so an increment of the new word can
+        # never reach the journal ahead of its insert
+        if not trie._contains(word):
+            journal.record_insert(word, encrypted_word)
+        journaled_store._wrapped(word, encrypted_word)
+
+    def journaled_delete(word):
+        # delete_many calls this once per word
+        if trie._contains(word):
+            journal.record_delete(word)
+        return journaled_delete._wrapped(word)
+
+    def journaled_increase(word, amount=1):
+        journaled_increase._wrapped(word, amount)
+        journal.record_increment(word, amount)
+
+    wrap_method(trie, "_store_encrypted", journaled_store, journal)
+    wrap_method(trie, "increase_word_frequency", journaled_increase, journal)
+    wrap_method(trie, "delete", journaled_delete, journal)
+    trie.journal = journal
+    return trie
+
+
+def detach(trie):
+    # Stop journaling trie; the journal itself is closed separately
+    journal = getattr(trie, "journal", None)
+    if journal is not None:
+        unwrap_methods(trie, journal)
+        trie.journal = None
+    return journal
+
+
+def replay(trie, path):
+    # Apply a journal segment to trie; returns the number of records applied.
+    # A torn or corrupt tail is cut off
+    with open(path, "rb") as segment:
+        data = segment.read()
+    offset = applied = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        checksum, length = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        body = data[start:start + length]
+        if len(body) < length or zlib.crc32(body) != checksum:
+            break
+        _apply(trie, body)
+        offset = start + length
+        applied += 1
+    if offset < len(data):
+        with open(path, "r+b") as segment:
+            segment.truncate(offset)
+    flush = getattr(trie, "flush", None)
+    if flush is not None:
+        flush()  # Batched tries merge the replayed increments now
+    return applied
+
+
+def _apply(trie, body):
+    kind = body[0]
+    if kind == INSERT:
+        _, length = INSERT_HEADER.unpack_from(body)
+        start = INSERT_HEADER.size
+        word = body[start:start + length].decode()
+        if not trie._contains(word):
+            trie._store_encrypted(word, body[start + length:])
+    elif kind == INCREMENT:
+        _, amount = INCREMENT_HEADER.unpack_from(body)
+        trie.increase_word_frequency(body[INCREMENT_HEADER.size:].decode(), amount)
+    elif kind == DELETE:
+        trie.delete(body[1:].decode())
+    else:
+        raise ValueError(f"unknown journal record type {kind}")
+
+
+def _scan(directory):
+    # Newest snapshot number (0 if none) and the segments after it, in order
+    snapshots, segments = [], []
+    for name in os.listdir(directory):
+        match = FILE_PATTERN.match(name)
+        if match:
+            (snapshots if match.group(1) == "snapshot" else segments).append(int(match.group(2)))
+    snapshot_seq = max(snapshots, default=0)
+    return snapshot_seq, sorted(seq for seq in segments if seq > snapshot_seq)
+
+
+def _remove_through(directory, snapshot_seq):
+    # Drop what snapshot_seq supersedes: older snapshots, the segments folded
+    # into it and temporary files left by an interrupted write
+    for name in os.listdir(directory):
+        match = FILE_PATTERN.match(name)
+        if name.endswith(".tmp") or (match and (int(match.group(2)) < snapshot_seq or
+                                                (match.group(1) == "journal" and int(match.group(2)) <= snapshot_seq))):
+            os.remove(os.path.join(directory, name))
@@ -0,0 +1,82 @@
+# RSA key material for the encrypted trie
+#
+# Keys are created on first use instead of at import, and can be kept in a
+# PEM or DER file so ciphertexts stay readable across restarts and every
+# process (including bulk-load workers) uses the same key.
+import os
+
+from Crypto.Cipher import PKCS1_OAEP
+from Crypto.PublicKey import RSA
+
+KEY_SIZE = 2048
+
+# Environment variable naming the key file used by default_keys
+KEY_FILE_ENV = "TRIE_KEY_FILE"
+
+
+class KeyManager:
+    def __init__(self, path=None, passphrase=None, bits=KEY_SIZE):
+        self.path = path  # Key file loaded on first use, or written after generating
+        self.passphrase = passphrase
+        self.bits = bits
+        self._key = None
+        self._cipher = None
+        self._decipher = None
+
+    @property
+    def key(self):
+        if self._key is None:
+            if self.path and os.path.exists(self.path):
+                self.load(self.path)
+            else:
+                self._set_key(RSA.generate(self.bits))
+                if self.path:
+                    self.save(self.path)
+        return self._key
+
+    @property
+    def public_key(self):
+        return self.key.publickey()
+
+    @property
+    def cipher(self):
+        if self._cipher is None:
+            self._cipher = PKCS1_OAEP.new(self.public_key)
+        return self._cipher
+
+    @property
+    def decipher(self):
+        if self._decipher is None:
+            self._decipher = PKCS1_OAEP.new(self.key)
+        return self._decipher
+
+    def load(self, path):
+        # RSA.import_key tells PEM and DER apart by itself
+        with open(path, "rb") as key_file:
+            self._set_key(RSA.import_key(key_file.read(), passphrase=self.passphrase))
+        return self._key
+
+    def save(self, path, format=None):
+        # format is "PEM" or "DER"; by default it follows the file extension
+        if format is None:
+            format = "DER" if path.lower().endswith(".der") else "PEM"
+        if format == "PEM" and self.passphrase:
+            data = self.key.export_key("PEM", passphrase=self.passphrase, pkcs=8,
+                                       protection="scryptAndAES128-CBC")
+        else:
+            data = self.key.export_key(format)
+        # Private key: write owner-only, then move into place in one step
+        temp_path = path + ".tmp"
+        descriptor = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, "wb") as key_file:
+            key_file.write(data)
+        os.replace(temp_path, path)
+
+    def _set_key(self, key):
+        self._key = key
+        self._cipher = None
+        self._decipher = None
+
+
+# Shared by the trie modules; nothing is generated until a key is first needed
+default_keys = KeyManager(os.environ.get(KEY_FILE_ENV))
@@ -0,0 +1,337 @@
+# Opt-in instrumentation for the trie engines
+#
+# Metrics.instrument(trie) replaces the trie's public operations on that one
+# instance with timed wrappers, and its traversal primitives with counting
+# ones. Nothing is wrapped until then, so an uninstrumented trie runs exactly
+# the code it ran before. Recorded per operation: a latency histogram and a
+# histogram of nodes visited per call; plus encrypt and decrypt call counts
+# (RSA ones separately) and gauges such as the frequency heap size. stats()
+# returns a snapshot as a dict; dump() and start_dump() write it as JSON or
+# in the Prometheus text format.
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# Latency bucket upper bounds in seconds: 1 us to about 16 s, doubling
+LATENCY_BUCKETS = tuple(1e-6 * 2 ** i for i in range(25))
+
+# Nodes-visited bucket upper bounds: 1 to 2**24, doubling
+COUNT_BUCKETS = tuple(2 ** i for i in range(25))
+
+# Environment variable naming a file the UI dumps metrics to (".prom" for the
+# Prometheus text format, JSON otherwise); metrics are off when it is unset
+METRICS_FILE_ENV = "TRIE_METRICS_FILE"
+
+# Seconds between periodic dumps
+DUMP_INTERVAL = 60
+
+# Operations timed when the trie does not list its own
+DEFAULT_OPERATIONS = ("insert", "autocomplete", "autocomplete_fuzzy")
+
+
+class Histogram:
+    # Fixed-bucket histogram: constant memory however many values are observed
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last bucket is +Inf
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, fraction):
+        # Upper bound of the bucket holding the quantile (max for the +Inf bucket)
+        if not self.count:
+            return 0
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return self.bounds[index] if index < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0,
+            "p50": self.quantile(0.50),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self.latency = {}  # operation -> Histogram of seconds per call
+        self.nodes_visited = {}  # operation -> Histogram of nodes per call
+        self.counters = {}  # name -> count
+        self.gauges = {}  # name -> function returning the current value
+        self.lock = threading.Lock()
+        self._query = threading.local()  # Nodes visited by the call in progress
+        self._dump_thread = None
+        self._dump_stop = None
+
+    # Recording
+
+    def observe(self, operation, seconds, nodes):
+        with self.lock:
+            histogram = self.latency.get(operation)
+            if histogram is None:
+                histogram = self.latency[operation] = Histogram(LATENCY_BUCKETS)
+                self.nodes_visited[operation] = Histogram(COUNT_BUCKETS)
+            histogram.observe(seconds)
+            self.nodes_visited[operation].observe(nodes)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def gauge(self, name, function):
+        self.gauges[name] = function
+
+    def visit(self, nodes=1):
+        # Called by the traversal wrappers for the operation in progress, if any
+        visited = getattr(self._query, "nodes", None)
+        if visited is not None:
+            self._query.nodes = visited + nodes
+
+    # Attaching to objects
+
+    def instrument(self, trie):
+        # Wrap the trie's operations on this instance only. Wrappers already
+        # set on the instance (a journal's) stay in place underneath
+        for operation in getattr(trie, "timed_operations", DEFAULT_OPERATIONS):
+            if hasattr(trie, operation):
+                wrap_method(trie, operation, self._timed(operation), self)
+        for primitive in ("_walk", "_iter_ranked"):
+            if hasattr(trie, primitive):
+                wrap_method(trie, primitive, self._counted(), self)
+        if hasattr(trie, "_locate"):
+            wrap_method(trie, "_locate", self._counted_locate(), self)
+        for primitive in ("_path", "_insert_path"):
+            if hasattr(trie, primitive):
+                wrap_method(trie, primitive, self._counted_path(), self)
+        backend = getattr(trie, "backend", None)
+        if backend is not None:
+            rsa = backend.name == "rsa-oaep"
+            # Every stored word was encrypted exactly once, in this process or
+            # in a bulk-load worker, so this counts encryptions either way
+            wrap_method(trie, "_store_encrypted",
+                        self._counting("encrypt_calls", "rsa_encrypt_calls" if rsa else None), self)
+            wrap_method(trie, "decrypt_word", self._counting("decrypt_calls", "rsa_decrypt_calls" if rsa else None),
+                        self)
+            if not rsa:
+                # Envelope backends use RSA only to unwrap the data key
+                wrap_method(backend, "client_decipher", self._counting("rsa_decrypt_calls"), self)
+        if hasattr(trie, "frequency_index"):
+            self.gauge("frequency_index_size", lambda: len(trie.frequency_index))
+        if hasattr(trie, "top_k_size"):
+            self.gauge("top_k_size", lambda: trie.top_k_size)
+        if hasattr(trie, "result_cache"):
+            # Read at every dump, so a cache enabled later is reported too
+            self.gauge("result_cache_hit_rate", lambda: trie.result_cache.stats()["hit_rate"] if trie.result_cache else 0)
+            self.gauge("result_cache_bytes", lambda: trie.result_cache.bytes if trie.result_cache else 0)
+        if hasattr(trie, "substring_index"):
+            self.gauge("substring_index_bytes", lambda: trie.substring_index.nbytes() if trie.substring_index else 0)
+        trie.metrics = self
+        return trie
+
+    def instrument_decryptor(self, decryptor, backend_name):
+        # Count and time client-side decryption through a ClientDecryptor
+        decryptor.decipher = CountingDecipher(decryptor.decipher, self, backend_name)
+        for operation in ("decrypt_many",):
+            wrap_method(decryptor, operation, self._timed("client_" + operation), self)
+        self.gauge("decrypt_cache_size", lambda: len(decryptor.cache))
+        return decryptor
+
+    def uninstrument(self, obj):
+        # Take out this Metrics' wrappers; whatever each one replaced, a class
+        # method or another wrapper, is called directly again
+        unwrap_methods(obj, self)
+        if isinstance(getattr(obj, "decipher", None), CountingDecipher):
+            obj.decipher = obj.decipher.decipher
+        backend = getattr(obj, "backend", None)
+        if backend is not None:
+            unwrap_methods(backend, self)
+        if getattr(obj, "metrics", None) is self:
+            obj.metrics = None
+
+    # The wrappers below call wrapper._wrapped, set by wrap_method
+
+    def _timed(self, operation):
+        def timed(*args, **kwargs):
+            query = self._query
+            outer = getattr(query, "nodes", None)
+            query.nodes = 0
+            start = time.perf_counter()
+            try:
+                return timed._wrapped(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                nodes = query.nodes
+                # A nested operation's nodes also count for the one around it
+                query.nodes = None if outer is None else outer + nodes
+                self.observe(operation, seconds, nodes)
+        return timed
+
+    def _counted(self):
+        def counted(*args, **kwargs):
+            for node in counted._wrapped(*args, **kwargs):
+                self.visit()
+                yield node
+        return counted
+
+    def _counted_locate(self):
+        def counted(prefix):
+            self.visit(len(prefix) + 1)  # At most one node per prefix character
+            return counted._wrapped(prefix)
+        return counted
+
+    def _counted_path(self):
+        def counted(word):
+            path = counted._wrapped(word)
+            self.visit(len(path) if path else 0)
+            return path
+        return counted
+
+    def _counting(self, counter, rsa_counter=None):
+        # Count calls under counter, and under rsa_counter if each call is
+        # also one RSA operation
+        def counted(*args, **kwargs):
+            self.count(counter)
+            if rsa_counter is not None:
+                self.count(rsa_counter)
+            return counted._wrapped(*args, **kwargs)
+        return counted
+
+    # Reporting
+
+    def stats(self):
+        # Snapshot of everything recorded so far, as plain JSON-ready values
+        with self.lock:
+            return {
+                "operations": {
+                    operation: dict(histogram.summary(), nodes_visited=self.nodes_visited[operation].summary())
+                    for operation, histogram in self.latency.items()
+                },
+                "counters": dict(self.counters),
+                "gauges": {name: function() for name, function in self.gauges.items()},
+            }
+
+    def to_prometheus(self, namespace="trie"):
+        lines = []
+        with self.lock:
+            for metric, histograms, help_text in (
+                ("operation_seconds", self.latency, "Latency of trie operations"),
+                ("nodes_visited", self.nodes_visited, "Trie nodes visited per operation"),
+            ):
+                name = f"{namespace}_{metric}"
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for operation, histogram in sorted(histograms.items()):
+                    label = f'operation="{operation}"'
+                    cumulative = 0
+                    for bound, count in zip(histogram.bounds + ("+Inf",), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{label},le="{bound}"}} {cumulative}')
+                    lines.append(f"{name}_sum{{{label}}} {histogram.sum}")
+                    lines.append(f"{name}_count{{{label}}} {histogram.count}")
+            for counter, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE {namespace}_{counter}_total counter")
+                lines.append(f"{namespace}_{counter}_total {value}")
+        for gauge, function in sorted(self.gauges.items()):
+            lines.append(f"# TYPE {namespace}_{gauge} gauge")
+            lines.append(f"{namespace}_{gauge} {function()}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path, format="json"):
+        # Write the current stats to path ("json" or "prometheus"), replacing
+        # the file in one step so a reader never sees half a dump
+        if format == "prometheus":
+            data = self.to_prometheus()
+        else:
+            data = json.dumps(self.stats(), indent=2)
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as dump_file:
+            dump_file.write(data)
+        os.replace(temp_path, path)
+
+    def start_dump(self, path, interval=DUMP_INTERVAL, format="json"):
+        # Dump every interval seconds from a daemon thread until stop_dump()
+        self.stop_dump()
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                self.dump(path, format)
+
+        self._dump_stop = stop
+        self._dump_thread = threading.Thread(target=run, name="metrics-dump", daemon=True)
+        self._dump_thread.start()
+
+    def stop_dump(self):
+        if self._dump_thread is not None:
+            self._dump_stop.set()
+            self._dump_thread.join()
+            self._dump_thread = None
+
+
+class CountingDecipher:
+    # Stands in for a client decipher and counts its decrypt calls
+    def __init__(self, decipher, metrics, backend_name):
+        self.decipher = decipher
+        self.metrics = metrics
+        self.backend_name = backend_name
+
+    def decrypt(self, encrypted_word):
+        self.metrics.count("decrypt_calls")
+        if self.backend_name == "rsa-oaep":
+            self.metrics.count("rsa_decrypt_calls")
+        return self.decipher.decrypt(encrypted_word)
+
+
+def wrap_method(obj, name, wrapper, owner):
+    # Set wrapper as obj.<name> on this instance only. It must call
+    # wrapper._wrapped, the callable it replaces (the class method or an
+    # earlier wrapper), so unwrap_methods can later take it out of a chain of
+    # wrappers set by different owners, in any order
+    wrapper._wrapped = getattr(obj, name)
+    wrapper._wrapper_owner = owner
+    setattr(obj, name, wrapper)
+    return wrapper
+
+
+def unwrap_methods(obj, owner):
+    # Remove every wrapper owner set on obj with wrap_method
+    for name in list(vars(obj)):
+        while _unwrap_one(obj, name, owner):
+            pass
+
+
+def _unwrap_one(obj, name, owner):
+    # Remove the outermost of owner's wrappers of obj.<name>; False if none is left
+    outer = None
+    value = vars(obj).get(name)
+    while getattr(value, "_wrapper_owner", None) is not None:
+        inner = value._wrapped
+        if value._wrapper_owner is owner:
+            if outer is not None:
+                outer._wrapped = inner  # Splice it out of the chain
+            elif getattr(inner, "__self__", None) is obj and \
+                    getattr(inner, "__func__", None) is getattr(type(obj), name, None):
+                delattr(obj, name)  # The class method shows through again
+            else:
+                setattr(obj, name, inner)
+            return True
+        outer, value = value, inner
+    return False
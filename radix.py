@@ -0,0 +1,130 @@
+# Radix (Patricia) trie engine: Trie and EncryptedTrie with path compression
+#
+# Every edge holds a whole string instead of one character, so a chain of
+# single-child nodes such as the tail of "information" is one node. Nodes are
+# keyed in their parent's children dict by the first character of their
+# label. Word nodes keep their identity when edges are split or merged, so
+# the frequency index and the cached top-k lists stay valid.
+from search import EncryptedTrie, Trie, TrieNode
+
+
+class RadixNode(TrieNode):
+    __slots__ = ("label",)
+
+    def __init__(self, label=""):
+        super().__init__()
+        self.label = label  # Edge label from the parent to this node
+
+
+class RadixTrie(Trie):
+    node_class = RadixNode
+
+    def search(self, prefix):
+        # Node whose subtree holds every word starting with prefix. When prefix
+        # ends inside an edge this is the node below it, so use _path to test
+        # whether a whole word is stored
+        node, _ = self._locate(prefix)
+        return node
+
+    def _edge_label(self, char, child):
+        return child.label
+
+    def _insert_path(self, word):
+        node = self.root
+        path = [node]
+        i = 0
+        while i < len(word):
+            child = node.children.get(word[i])
+            if child is None:
+                # No edge starts with this character: hang the rest of the word off node
+                child = self.node_class(word[i:])
+                node.children[word[i]] = child
+                path.append(child)
+                return path
+            label = child.label
+            common = _common_prefix_length(label, word, i)
+            if common < len(label):
+                # The word leaves the edge part-way: split it at the divergence
+                middle = self.node_class(label[:common])
+                middle.top_k = child.top_k  # Same subtree, same ranking
+                child.label = label[common:]
+                middle.children[child.label[0]] = child
+                node.children[word[i]] = middle
+                child = middle
+            node = child
+            path.append(node)
+            i += common
+        return path
+
+    def _path(self, word):
+        node = self.root
+        path = [node]
+        i = 0
+        while i < len(word):
+            child = node.children.get(word[i])
+            if child is None or not word.startswith(child.label, i):
+                return None
+            node = child
+            path.append(node)
+            i += len(child.label)
+        return path
+
+    def _locate(self, prefix):
+        return self._descend(self.root, "", prefix)
+
+    def _descend(self, node, key, tail):
+        i = 0
+        while i < len(tail):
+            child = node.children.get(tail[i])
+            if child is None:
+                return None, None
+            label = child.label
+            if tail.startswith(label, i):
+                node = child
+                i += len(label)
+            elif label.startswith(tail[i:]):
+                # tail ends inside this edge: the child's subtree is the answer
+                return child, key + tail + label[len(tail) - i:]
+            else:
+                return None, None
+        return node, key + tail
+
+    def _delete_path(self, word, path):
+        # Clear the word at the end of path and merge edges around it. Returns
+        # the remaining nodes of path whose subtrees lost the word
+        node = path[-1]
+        node.is_end_of_word = False
+        node.encrypted_word = None
+        node.frequency = 0
+        if len(path) == 1:
+            return path  # The empty word lives on the root, which is never removed
+        parent = path[-2]
+        if not node.children:
+            del parent.children[node.label[0]]
+            path = path[:-1]
+            # The parent may now be a plain pass-through node
+            if len(path) > 1 and not parent.is_end_of_word and len(parent.children) == 1:
+                self._merge_with_child(path[-2], parent)
+                path = path[:-1]
+        elif len(node.children) == 1:
+            self._merge_with_child(parent, node)
+            path = path[:-1]
+        return path
+
+    def _merge_with_child(self, parent, node):
+        # Replace node by its only child, folding node's label into the child's
+        (child,) = node.children.values()
+        child.label = node.label + child.label
+        parent.children[child.label[0]] = child
+
+
+class EncryptedRadixTrie(RadixTrie, EncryptedTrie):
+    pass
+
+
+def _common_prefix_length(label, word, start):
+    length = 0
+    limit = min(len(label), len(word) - start)
+    while length < limit and label[length] == word[start + length]:
+        length += 1
+    return length
@@ -0,0 +1,124 @@
+# Bounded cache of ranked autocomplete results
+#
+# A few one- and two-character prefixes make up most lookups, and they are
+# the ones with the largest subtrees. Up to top_k_size suggestions a prefix
+# is served from its node's cached top-k list; past that (a larger k, or
+# every word) the subtree is walked and ranked. PrefixResultCache keeps
+# those ranked results keyed by (prefix, k), least recently used evicted
+# first, within a byte budget.
+#
+# A change to a word can only change the results of the prefixes of that
+# word, so an insert, frequency increase or delete drops exactly the entries
+# of the word's len(word) + 1 prefixes and leaves every other entry in
+# place. Results are tuples of the ciphertexts the trie holds; the bytes are
+# shared with the nodes, so an entry's size counts the tuple, the key and
+# the bookkeeping, not the ciphertexts.
+import sys
+import threading
+from collections import OrderedDict
+
+# Default byte budget of a PrefixResultCache
+RESULT_CACHE_BYTES = 16 * 1024 * 1024
+
+# Estimated bytes per entry besides the result tuple and the prefix: the
+# OrderedDict slot, the (prefix, k) key and the per-prefix index
+ENTRY_OVERHEAD = 240
+
+
+class PrefixResultCache:
+    # hits and misses count lookups, so the budget can be tuned by hit rate.
+    # Safe to share between threads; put() drops a result if an invalidation
+    # ran while it was computed, so a reader racing a writer never stores a
+    # stale result
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES, max_entry_bytes=None):
+        self.max_bytes = max_bytes
+        # One very long result (every word under "a") may not push out all the others
+        self.max_entry_bytes = max_entry_bytes if max_entry_bytes is not None else max_bytes // 4
+        self.entries = OrderedDict()  # (prefix, k) -> (result, size), least recently used first
+        self.prefixes = {}  # prefix -> set of k cached for it
+        self.bytes = 0
+        self.version = 0  # Bumped by every invalidation
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0  # Entries dropped because a word changed
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, prefix, k):
+        # The cached tuple of ciphertexts, or None
+        key = (prefix, k)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, prefix, k, result, version):
+        # Store result, computed after reading self.version into version
+        size = sys.getsizeof(result) + sys.getsizeof(prefix) + ENTRY_OVERHEAD
+        if size > self.max_entry_bytes:
+            return False
+        key = (prefix, k)
+        with self.lock:
+            if version != self.version or key in self.entries:
+                return False
+            self.entries[key] = (result, size)
+            self.prefixes.setdefault(prefix, set()).add(k)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+        return True
+
+    def invalidate(self, word):
+        # Drop the results of every prefix of word, "" included
+        with self.lock:
+            self.version += 1
+            if not self.entries:
+                return 0
+            dropped = 0
+            for end in range(len(word) + 1):
+                prefix = word[:end]
+                for k in list(self.prefixes.get(prefix, ())):
+                    self._drop((prefix, k))
+                    dropped += 1
+            self.invalidations += dropped
+            return dropped
+
+    def clear(self):
+        # For changes that touch words wholesale, like a corpus load
+        with self.lock:
+            self.version += 1
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+            self.prefixes.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _drop(self, key):
+        _, size = self.entries.pop(key)
+        self.bytes -= size
+        prefix, k = key
+        ks = self.prefixes[prefix]
+        ks.discard(k)
+        if not ks:
+            del self.prefixes[prefix]
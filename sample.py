@@ -1,6 +1,10 @@
-import curses
+import curses, os
 
 class TrieNode:
+    # Fixed slots instead of a per-node __dict__: a node is a small fixed-size
+    # object, which matters at millions of nodes
+    __slots__ = ("children", "is_end_of_word", "encrypted_word", "frequency")
+
     def __init__(self):
         self.children = {}
         self.is_end_of_word = False
@@ -44,25 +48,34 @@ class Trie:
 
 
 # Import necessary cryptographic libraries
-from Crypto.PublicKey import RSA
-from Crypto.Cipher import PKCS1_OAEP
+from ciphers import AESGCMBackend, ClientDecryptor, RSAOAEPBackend, encrypt_chunks
+from keys import default_keys
+
+# Words handed to a bulk-load worker process at a time
+INSERT_CHUNK_SIZE = 256
+
+# RSA key pair for encryption and decryption. It is generated (or loaded from
+# the file named by TRIE_KEY_FILE) on first use, not at import
+keys = default_keys
 
-# Generate RSA key pair for encryption and decryption
-key = RSA.generate(2048)
-public_key = key.publickey()
-cipher = PKCS1_OAEP.new(public_key)
-decipher = PKCS1_OAEP.new(key)
+def __getattr__(name):
+    # Keep key, public_key, cipher and decipher readable as module attributes
+    if name in ("key", "public_key", "cipher", "decipher"):
+        return getattr(keys, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class EncryptedTrie(Trie):
-    def __init__(self, public_key, decipher):
+    def __init__(self, public_key, decipher, backend=None):
         super().__init__()
         self.public_key = public_key
-        self.decipher = decipher
+        # Per-word RSA-OAEP unless another cipher backend is given
+        self.backend = backend if backend is not None else RSAOAEPBackend(public_key)
+        self.decipher = self.backend.client_decipher(decipher)
 
     def encrypt_word(self, word):
-        # Encrypt the entire word using RSA encryption
-        encrypted_word = cipher.encrypt(word.encode())
+        # Encrypt the entire word with the configured cipher backend
+        encrypted_word = self.backend.encrypt(word.encode())
         return encrypted_word
 
     def decrypt_word(self, encrypted_word):
@@ -71,6 +84,41 @@ class EncryptedTrie(Trie):
         return decrypted_word
 
     def insert_encrypted(self, word):
+        # A word that is already stored keeps its ciphertext and frequency
+        if self._contains(word):
+            return
+        self._store_encrypted(word, self.encrypt_word(word))
+
+    def insert_many_encrypted(self, words, workers=None, chunk_size=INSERT_CHUNK_SIZE):
+        # Bulk load: words are encrypted in a pool of `workers` processes and the
+        # trie is built here. Repeated words and words already in the trie are
+        # skipped before encryption. Returns the number of words inserted
+        inserted = 0
+        for chunk, encrypted_words in encrypt_chunks(self.backend, self._new_word_chunks(words, chunk_size), workers):
+            for word, encrypted_word in zip(chunk, encrypted_words):
+                self._store_encrypted(word, encrypted_word)
+            inserted += len(chunk)
+        return inserted
+
+    def _new_word_chunks(self, words, chunk_size):
+        seen = set()
+        chunk = []
+        for word in words:
+            if word in seen or self._contains(word):
+                continue
+            seen.add(word)
+            chunk.append(word)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _contains(self, word):
+        node = self.search(word)
+        return node is not None and node.is_end_of_word
+
+    def _store_encrypted(self, word, encrypted_word):
         node = self.root
         for char in word:
             if char not in node.children:
@@ -78,7 +126,7 @@ class EncryptedTrie(Trie):
             node = node.children[char]
         # At the leaf node, store the encrypted word
         node.is_end_of_word = True
-        node.encrypted_word = self.encrypt_word(word)
+        node.encrypted_word = encrypted_word
         node.frequency = 0  # Initialize frequency to 0
 
     def autocomplete_encrypted(self, prefix):
@@ -106,6 +154,9 @@ class EncryptedTrie(Trie):
 
 # Client-side decryption function
 def client_decrypt_suggestions(suggestions, decipher):
+    if isinstance(decipher, ClientDecryptor):
+        # Cached (and possibly pooled) decryption
+        return decipher.decrypt_many(suggestions)
     decrypted_suggestions = []
     for suggestion in suggestions:
         decrypted_word = decipher.decrypt(suggestion).decode()
@@ -139,12 +190,15 @@ def main():
     stdscr.refresh()
     stdscr.keypad(True)
 
-    # Create an encrypted trie
-    encrypted_trie = EncryptedTrie(public_key, decipher)
+    # Create an encrypted trie: words are encrypted with AES-GCM under a data
+    # key that is wrapped once by the RSA public key
+    encrypted_trie = EncryptedTrie(keys.public_key, keys.decipher, backend=AESGCMBackend(keys.public_key))
+    # Client-side decryption goes through a bounded cache of decrypted words
+    decryptor = ClientDecryptor(encrypted_trie.backend.client_decipher(keys.decipher))
 
-    # Insert predefined words into the Trie (stored as encrypted)
-    for word in predefined_words:
-        encrypted_trie.insert_encrypted(word)
+    # Insert predefined words into the Trie (stored as encrypted), encrypting
+    # them in one worker process per CPU
+    encrypted_trie.insert_many_encrypted(predefined_words, workers=os.cpu_count())
 
     stdscr.addstr(1, 2, f"{len(predefined_words)} predefined words have been inserted into the Trie.")
     stdscr.getch()
@@ -154,7 +208,7 @@ def main():
         curses.curs_set(1)
 
         # User inputs a prefix to search for auto-complete suggestions
-        prefix = inputStr(stdscr, encrypted_trie, decipher)
+        prefix = inputStr(stdscr, encrypted_trie, decryptor)
         stdscr.addstr(3, 3, f"\nPrefix: {prefix}")
 
         if prefix.lower() == 'exit':
@@ -167,14 +221,14 @@ def main():
             stdscr.addstr(3, 2, f"No suggestions found for prefix '{prefix}'")
             continue
 
-        # Client decrypts the suggestions
-        decrypted_suggestions = client_decrypt_suggestions(encrypted_suggestions, decipher)
+        # Client decrypts the suggestions lazily: only the rows menu_select shows
+        decrypted_suggestions = decryptor.lazy(encrypted_suggestions)
         selected_word = menu_select(stdscr, decrypted_suggestions)
         curses.curs_set(1)
 
         # User can choose a word from suggestions, which increases the frequency of that word
         stdscr.clear()
-        if selected_word in decrypted_suggestions:
+        if selected_word is not None:
             encrypted_trie.increase_word_frequency(selected_word)
             stdscr.addstr(1, 2, f"Frequency of '{selected_word}' increased.")
             stdscr.getch()
@@ -185,7 +239,7 @@ def main():
             stdscr.clear()
 
 
-def inputStr(stdscr, encrypted_trie, decipher):
+def inputStr(stdscr, encrypted_trie, decryptor):
     input_str = []  # List to store input characters
     cursor_x = 0  # Position of cursor within the input
     suggestions = []  # Store suggestions for autocomplete
@@ -219,13 +273,12 @@ def inputStr(stdscr, encrypted_trie, decipher):
         elif key == ord('\t'):  # Tab key for autocomplete
             prefix = "".join(input_str)
             encrypted_suggestions = encrypted_trie.autocomplete_encrypted(prefix)
-            if encrypted_suggestions:
-                decrypted_suggestions = client_decrypt_suggestions(encrypted_suggestions, decipher)
-                if decrypted_suggestions:
-                    # Autocomplete with the most frequent suggestion (first one in sorted list)
-                    most_frequent_suggestion = decrypted_suggestions[0]
-                    input_str = list(most_frequent_suggestion)
-                    cursor_x = len(input_str)
+            # Autocomplete with the most frequent suggestion (first one in sorted
+            # list); nothing after it is decrypted
+            most_frequent_suggestion = next(decryptor.iter_decrypt(encrypted_suggestions), None)
+            if most_frequent_suggestion is not None:
+                input_str = list(most_frequent_suggestion)
+                cursor_x = len(input_str)
         elif 32 <= key <= 126:  # Printable characters (ASCII range for simplicity)
             input_str.insert(cursor_x, chr(key))  # Insert character at cursor position
             cursor_x += 1
@@ -237,17 +290,25 @@ def menu_select(stdscr, items):
     # Initial setup
     curses.curs_set(0)              # Hide the cursor
     current_row = 0                 # Track which row is selected
+    top_row = 0                     # First item shown, scrolled to keep the selection visible
 
     while True:
         # Clear and refresh the screen for a new display
         stdscr.clear()
 
-        # Display all menu items with highlighting
-        for idx, item in enumerate(items):
+        # Display only the items that fit on the screen, so a lazily decrypted
+        # list is decrypted one visible page at a time
+        page_size = max(1, stdscr.getmaxyx()[0] - 2)
+        if current_row < top_row:
+            top_row = current_row
+        elif current_row >= top_row + page_size:
+            top_row = current_row - page_size + 1
+        for idx in range(top_row, min(len(items), top_row + page_size)):
+            item = items[idx]
             if idx == current_row:
-                stdscr.addstr(idx + 1, 2, item, curses.A_REVERSE)  # Highlighted selection
+                stdscr.addstr(idx - top_row + 1, 2, item, curses.A_REVERSE)  # Highlighted selection
             else:
-                stdscr.addstr(idx + 1, 2, item)
+                stdscr.addstr(idx - top_row + 1, 2, item)
 
         stdscr.refresh()
 
@@ -259,9 +320,9 @@ def menu_select(stdscr, items):
         elif key == curses.KEY_DOWN and current_row < len(items) - 1:
             current_row += 1
         elif key == ord('\n'):  # Enter key
-            return items[current_row]  # Return the index of the selected item
+            return items[current_row]  # Return the selected item
         elif key == 27:  # ESC key to cancel
-            break
+            return None
 
 if __name__ == "__main__":
     curses.wrapper(main())
@@ -0,0 +1,74 @@
+# Curses drawing helpers for the autocomplete UI
+#
+# Redrawing the whole screen on every key (stdscr.clear() + refresh) repaints
+# every cell, which flickers and costs bandwidth on a remote terminal. Here
+# each row remembers what was last drawn on it and only rows that changed are
+# rewritten; updates go out in one batch through noutrefresh/doupdate.
+import curses
+
+# Suggestion rows shown under the input line
+SUGGESTION_PANE_SIZE = 8
+
+# Milliseconds without a key press before the suggestion pane is refreshed
+SUGGEST_DELAY_MS = 80
+
+
+class ScreenLines:
+    def __init__(self, window):
+        self.window = window
+        self.lines = {}  # row -> (col, text, attr) last drawn there
+
+    def draw(self, row, text, attr=0, col=0):
+        # Replace the contents of row with text at col, unless it is already shown
+        line = (col, text, attr)
+        if self.lines.get(row) == line:
+            return
+        height, width = self.window.getmaxyx()
+        if row >= height:
+            return
+        self.window.move(row, 0)
+        self.window.clrtoeol()
+        if col < width - 1:
+            # The last column is skipped: writing there would scroll the window
+            self.window.addnstr(row, col, text, width - 1 - col, attr)
+        self.lines[row] = line
+
+    def clear_from(self, row):
+        # Blank every row from row down that still holds something
+        for drawn_row in sorted(self.lines):
+            if drawn_row >= row and self.lines[drawn_row][1]:
+                self.draw(drawn_row, "")
+
+    def invalidate(self):
+        # Forget what is on screen, e.g. after a resize; everything is redrawn
+        self.window.erase()
+        self.lines.clear()
+
+    def refresh(self, cursor=None):
+        # Send the changed rows to the terminal in one update
+        if cursor is not None:
+            self.window.move(*cursor)
+        self.window.noutrefresh()
+        curses.doupdate()
+
+
+class SuggestionPane:
+    # Rows of decrypted suggestions under the input line. Only the rows shown
+    # are decrypted, and a row is rewritten only when its suggestion changed
+    def __init__(self, lines, top, size, decryptor):
+        self.lines = lines
+        self.top = top  # First row of the pane
+        self.size = size
+        self.decryptor = decryptor
+
+    @property
+    def height(self):
+        # Rows that fit on the screen, at most size
+        return max(0, min(self.size, self.lines.window.getmaxyx()[0] - self.top))
+
+    def show(self, encrypted_suggestions):
+        row = self.top
+        for word in self.decryptor.iter_decrypt(encrypted_suggestions[:self.height]):
+            self.lines.draw(row, word, col=4)
+            row += 1
+        self.lines.clear_from(row)
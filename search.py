@@ -1,23 +1,45 @@
-import curses, heapq
+import curses, gc, heapq, os
+from collections import deque
+from itertools import count, islice
 
 class TrieNode:
+    # Fixed slots instead of a per-node __dict__: a node is a small fixed-size
+    # object, which matters at millions of nodes
+    __slots__ = ("children", "is_end_of_word", "encrypted_word", "frequency", "top_k")
+
     def __init__(self):
         self.children = {}
         self.is_end_of_word = False
         self.encrypted_word = None  # To store the encrypted word at leaf nodes
         self.frequency = 0  # To track search frequency for this word
+        self.top_k = ()  # Highest-frequency word nodes in this subtree, best first
 
 class Trie:
+    node_class = TrieNode  # Node layout used by this trie
+    # Operations timed by enable_metrics
+    timed_operations = ("insert", "delete", "autocomplete", "autocomplete_fuzzy")
+
     def __init__(self):
-        self.root = TrieNode()
+        self.root = self.node_class()
+        self.generation = 0  # Bumped on every change, so cursors know their cache is stale
+        self.metrics = None  # Set by enable_metrics
 
     def insert(self, word):
-        node = self.root
-        for char in word:
-            if char not in node.children:
-                node.children[char] = TrieNode()
-            node = node.children[char]
-        node.is_end_of_word = True
+        self._insert_path(word)[-1].is_end_of_word = True
+        self.generation += 1
+
+    def delete(self, word):
+        # Remove word and the nodes only it needed. Returns whether it was stored
+        path = self._path(word)
+        if path is None or not path[-1].is_end_of_word:
+            return False
+        self._delete_path(word, path)
+        self.generation += 1
+        return True
+
+    def delete_many(self, words):
+        # Returns the number of words that were stored and are now removed
+        return sum(1 for word in words if self.delete(word))
 
     def search(self, prefix):
         node = self.root
@@ -28,40 +50,521 @@ class Trie:
         return node
 
     def autocomplete(self, prefix):
-        node = self.search(prefix)
+        return list(self.iter_autocomplete(prefix))
+
+    def iter_autocomplete(self, prefix):
+        # Lazily yield (word, frequency) for every word starting with prefix, so
+        # a caller can stop after the first few. Words are joined from a shared
+        # buffer of edge labels only when they are yielded
+        node, key = self._locate(prefix)
         if not node:
+            return
+        yield from self._iter_words(node, key)
+
+    def autocomplete_fuzzy(self, prefix, max_edits=1, k=None):
+        # (word, frequency) for words that start with something within
+        # max_edits edits of prefix, closest first, then by frequency
+        seen = set()
+        result = []
+        for _, roots in self._fuzzy_levels(prefix, max_edits):
+            words = [(word, frequency) for node, key in roots
+                     for word, frequency in self._iter_words(node, key) if word not in seen]
+            if k is not None:
+                words = heapq.nlargest(k - len(result), words, key=lambda x: x[1])
+            else:
+                words.sort(key=lambda x: x[1], reverse=True)
+            result.extend(words)
+            seen.update(word for word, _ in words)
+            if k is not None and len(result) >= k:
+                break
+        return result
+
+    def enable_metrics(self, metrics=None):
+        # Start recording latency, nodes visited and cipher calls into metrics
+        # (a new Metrics by default). Until this is called nothing is recorded
+        # and the operations run uninstrumented
+        if self.metrics is not None:
+            self.disable_metrics()
+        return (metrics or Metrics()).instrument(self).metrics
+
+    def disable_metrics(self):
+        if self.metrics is not None:
+            self.metrics.uninstrument(self)
+
+    def stats(self):
+        # Snapshot of the recorded metrics; empty while metrics are disabled
+        return self.metrics.stats() if self.metrics is not None else {}
+
+    def cursor(self, prefix=""):
+        # Stateful lookup for text typed one character at a time
+        return PrefixCursor(self, prefix)
+
+    def _suggestions(self, node, key, k=None):
+        # Suggestions for a PrefixCursor: (word, frequency) under node, whose key is key
+        words = self._iter_words(node, key)
+        return list(words if k is None else islice(words, k))
+
+    def _iter_words(self, node, key):
+        buffer = [key]
+        for node in self._walk(node, buffer):
+            if node.is_end_of_word:
+                yield "".join(buffer), node.frequency
+
+    def _walk(self, node, buffer=None):
+        # Yield every node of node's subtree in depth-first order, children in
+        # insertion order. An explicit stack replaces recursion, so very long
+        # keys cannot hit the recursion limit. If buffer is given, it holds the
+        # edge labels from the starting node while each node is yielded
+        stack = [(node, None if buffer is None else len(buffer), None)]
+        while stack:
+            node, depth, label = stack.pop()
+            if buffer is not None:
+                del buffer[depth:]
+                if label is not None:
+                    buffer.append(label)
+                depth = len(buffer)
+            yield node
+            # Pushed in reverse so they are popped in insertion order
+            for char, child in reversed(node.children.items()):
+                stack.append((child, depth, self._edge_label(char, child)))
+
+    def _edge_label(self, char, child):
+        # Characters spelled by the edge into child
+        return char
+
+    # Structural primitives. The EncryptedTrie operations are written in terms
+    # of these, so another node layout (see radix.py) only has to replace them
+
+    def _insert_path(self, word):
+        # Return the nodes from the root down to the end of word, creating missing ones
+        node = self.root
+        path = [node]
+        for char in word:
+            if char not in node.children:
+                node.children[char] = self.node_class()
+            node = node.children[char]
+            path.append(node)
+        return path
+
+    def _path(self, word):
+        # Return the nodes from the root down to the end of word, or None
+        node = self.root
+        path = [node]
+        for char in word:
+            if char not in node.children:
+                return None
+            node = node.children[char]
+            path.append(node)
+        return path
+
+    def _delete_path(self, word, path):
+        # Clear the word at the end of path (the nodes from the root to word)
+        # and unlink the chain of nodes above it left with no word and no
+        # children. Returns the nodes of path still in the trie
+        node = path[-1]
+        node.is_end_of_word = False
+        node.encrypted_word = None
+        node.frequency = 0
+        depth = len(path) - 1
+        while depth > 0 and not path[depth].children and not path[depth].is_end_of_word:
+            del path[depth - 1].children[word[depth - 1]]
+            depth -= 1
+        return path[:depth + 1]
+
+    def _locate(self, prefix):
+        # Return the node whose subtree holds every word starting with prefix,
+        # and that node's full key (in this trie, the prefix itself)
+        return self.search(prefix), prefix
+
+    def _descend(self, node, key, tail):
+        # _locate(key + tail), starting from node, whose full key is key
+        for char in tail:
+            node = node.children.get(char)
+            if node is None:
+                return None, None
+        return node, key + tail
+
+    def _fuzzy_levels(self, prefix, max_edits):
+        # Yield (distance, [(node, key), ...]) for distance 0 to max_edits:
+        # the subtrees whose words are fuzzy completions of prefix at that
+        # distance. A node's key matches when the whole prefix is within
+        # max_edits of it; the row-by-row Levenshtein DP of each key against
+        # prefix is extended one edge character at a time, and a subtree is
+        # skipped once min(row) leaves no key below it able to match closer
+        # than the nearest match above it (or within max_edits, when there is
+        # none). Once min(row) leaves no edit to spend, a closer match has to
+        # spell the rest of the prefix exactly from one of the cheapest
+        # positions, which plain child lookups follow without rows.
+        #
+        # It is one pass over the trie, in order of min(row): min(row) never
+        # falls further down, and nothing below a row matches closer than its
+        # minimum, so a distance is complete, and yielded, once every row
+        # with that minimum is done. Only the children spelling a prefix
+        # character at a position of cost min(row) keep that minimum; the
+        # others of the node wait until the next distance. A caller that
+        # stops at the close matches never pays for the far ones
+        letters = set(prefix)
+        exact = {}  # Row with no edit left to spend -> its tails; rows recur all over the trie
+        levels = [[] for _ in range(max_edits + 1)]
+        # (node, key, row, best, chars) by distance; chars is None for a node
+        # whose min(row) is that distance, else the first characters of the
+        # children it already had expanded at the distance before
+        pending = [[] for _ in range(max_edits + 1)]
+        first_row = list(range(len(prefix) + 1))
+        if first_row[-1] <= max_edits:
+            levels[first_row[-1]].append((self.root, ""))
+        if prefix:  # The empty prefix matches at the root, and nothing is closer
+            pending[0].append((self.root, "", first_row, min(first_row[-1], max_edits + 1), None))
+        for distance in range(max_edits + 1):
+            stack = pending[distance]
+            while stack:
+                node, key, row, best, chars = stack.pop()
+                if chars is not None:
+                    children = [(char, child) for char, child in node.children.items() if char not in chars]
+                elif distance == best - 1:
+                    # No edit left to spend
+                    signature = tuple(row)
+                    tails = exact.get(signature)
+                    if tails is None:
+                        tails = exact[signature] = _exact_tails(prefix, row, distance)
+                    levels[distance].extend(self._spell_tails(node, key, tails))
+                    continue
+                else:
+                    chars = {prefix[j] for j in range(len(prefix)) if row[j] == distance}
+                    children = node.children  # Read once: a concurrent writer may swap it
+                    children = [(char, children[char]) for char in chars if char in children]
+                    pending[distance + 1].append((node, key, row, best, chars))
+                # Row after one more letter, with its minimum. Every letter
+                # missing from prefix gives the same row, so it is worked out once
+                steps = {}
+                for char, child in children:
+                    label = self._edge_label(char, child)
+                    letter = label[0] if label[0] in letters else None
+                    step = steps.get(letter)
+                    if step is None:
+                        step = steps[letter] = _levenshtein_step(prefix, row, label[0])
+                    edge_row, low = step
+                    match = edge_row[-1] if edge_row[-1] < best else best
+                    for letter in label[1:]:
+                        if low >= match:
+                            break  # Nothing deeper can match closer
+                        edge_row, low = _levenshtein_step(prefix, edge_row, letter)
+                        if edge_row[-1] < match:
+                            match = edge_row[-1]
+                    if match < best:
+                        # Closer than any match above: words below child are this close
+                        levels[match].append((child, key + label))
+                    if low < match:
+                        pending[low].append((child, key + label, edge_row, match, None))
+            if levels[distance]:
+                yield distance, levels[distance]
+
+    def _spell_tails(self, node, key, tails):
+        # (node, key) reached by spelling each of tails below node, whose key is key
+        found = []
+        for tail in tails:
+            if tail[0] in node.children:  # Most tails stop here
+                reached = self._descend(node, key, tail)
+                if reached[0] is not None:
+                    found.append(reached)
+        return found
+
+    def _step(self, node, key, depth, char):
+        # One character further than _locate(prefix) == (node, key), where
+        # depth == len(prefix). When key is longer than the prefix, the prefix
+        # ends inside the edge into node and the next character must follow it
+        if len(key) > depth:
+            return (node, key) if key[depth] == char else (None, None)
+        child = node.children.get(char)
+        if child is None:
+            return None, None
+        return child, key + self._edge_label(char, child)
+
+
+def _levenshtein_step(prefix, previous, letter):
+    # (next row, its smallest entry) of the Levenshtein DP of a key against
+    # prefix, when the key whose row is previous is extended by letter
+    low = left = previous[0] + 1
+    row = [left]
+    for j, expected in enumerate(prefix):
+        cost = previous[j] if expected == letter else previous[j] + 1
+        if previous[j + 1] < cost:
+            cost = previous[j + 1] + 1
+        if left < cost:
+            cost = left + 1
+        row.append(cost)
+        left = cost
+        if cost < low:
+            low = cost
+    return row, low
+
+
+def _exact_tails(prefix, row, budget):
+    # What is left of prefix to spell from a key whose row has no edit
+    # beyond budget to spend: the rest after each position at that cost.
+    # Shortest first, and one that extends a shorter one is dropped, since
+    # its node is missing or lies below the shorter one's
+    tails = []
+    for tail in sorted((prefix[j:] for j in range(len(prefix)) if row[j] == budget), key=len):
+        if not any(tail.startswith(shorter) for shorter in tails):
+            tails.append(tail)
+    return tails
+
+
+class PrefixCursor:
+    # Incremental prefix lookup. The located node and the suggestions already
+    # computed are kept for every depth of the prefix, so push(char) costs one
+    # child lookup and pop() or move_to() back to a shorter prefix costs
+    # nothing. Positions past the current depth are kept as well, until a
+    # different character is pushed there, so moving forward again over the
+    # same text is free. The trie's generation is checked on every query; a
+    # change to the trie relocates the prefix and drops cached suggestions
+    def __init__(self, trie, prefix=""):
+        self.trie = trie
+        self.text = ""  # Longest text located so far; the prefix is text[:depth]
+        self.depth = 0
+        self._reset()
+        self.set_prefix(prefix)
+
+    @property
+    def prefix(self):
+        return self.text[:self.depth]
+
+    @property
+    def node(self):
+        # Node whose subtree holds every word starting with prefix, or None
+        self._check_generation()
+        return self.states[self.depth][0]
+
+    def push(self, char):
+        self._check_generation()
+        depth = self.depth
+        if depth < len(self.text) and self.text[depth] == char:
+            self.depth += 1  # Already located on an earlier pass
+            return self.states[self.depth][0]
+        del self.states[depth + 1:]
+        del self.cache[depth + 1:]
+        self.text = self.text[:depth] + char
+        node, key = self.states[depth]
+        self.states.append((None, None) if node is None else self.trie._step(node, key, depth, char))
+        self.cache.append({})
+        self.depth += 1
+        return self.states[self.depth][0]
+
+    def pop(self):
+        # Remove the last character of the prefix and return it
+        if self.depth == 0:
+            raise IndexError("pop from an empty prefix")
+        self.depth -= 1
+        return self.text[self.depth]
+
+    def move_to(self, offset):
+        # Shorten the prefix to its first offset characters, or lengthen it
+        # again up to the text already located
+        if not 0 <= offset <= len(self.text):
+            raise IndexError(f"offset {offset} outside 0..{len(self.text)}")
+        self.depth = offset
+
+    def set_prefix(self, prefix):
+        # Move to the longest shared start of the current text and push the rest
+        shared = 0
+        limit = min(len(prefix), len(self.text))
+        while shared < limit and prefix[shared] == self.text[shared]:
+            shared += 1
+        self.move_to(shared)
+        for char in prefix[shared:]:
+            self.push(char)
+
+    def suggestions(self, k=None):
+        # Ranked suggestions for the current prefix, as the trie's autocomplete
+        # would return them; computed once per depth and k
+        self._check_generation()
+        node, key = self.states[self.depth]
+        if node is None:
             return []
-        suggestions = []
-        self._dfs(node, prefix, suggestions)
-        return suggestions
+        cache = self.cache[self.depth]
+        if k not in cache:
+            cache[k] = self.trie._suggestions(node, key, k)
+        return cache[k]
+
+    def _reset(self):
+        self.states = [(self.trie.root, "")]  # (node, key) of text[:depth] for every depth
+        self.cache = [{}]  # k -> suggestions, for every depth
+        self.generation = self.trie.generation
 
-    def _dfs(self, node, prefix, suggestions):
-        if node.is_end_of_word:
-            suggestions.append((prefix, node.frequency))  # Append word with frequency
-        for char, child in node.children.items():
-            self._dfs(child, prefix + char, suggestions)
+    def _check_generation(self):
+        if self.generation != self.trie.generation:
+            text, depth = self.text, self.depth
+            self.text, self.depth = "", 0
+            self._reset()
+            self.set_prefix(text)
+            self.depth = depth
 
 
 # Import necessary cryptographic libraries
-from Crypto.PublicKey import RSA
-from Crypto.Cipher import PKCS1_OAEP
+from ciphers import AESGCMBackend, ClientDecryptor, RSAOAEPBackend, encrypt_chunks
+from keys import default_keys
+from corpus import CORPUS_FILE_ENV, read_corpus
+from journal import DATA_DIR_ENV, data_dir_keys, open_journaled
+from metrics import METRICS_FILE_ENV, Metrics
+from result_cache import RESULT_CACHE_BYTES, PrefixResultCache
+from substring import SubstringIndex
+from screen import SUGGEST_DELAY_MS, SUGGESTION_PANE_SIZE, ScreenLines, SuggestionPane
+from snapshot import MappedEncryptedTrie, load_trie, write_snapshot
+
+# RSA key pair for encryption and decryption. It is generated (or loaded from
+# the file named by TRIE_KEY_FILE) on first use, not at import
+keys = default_keys
+
+def __getattr__(name):
+    # Keep key, public_key, cipher and decipher readable as module attributes
+    if name in ("key", "public_key", "cipher", "decipher"):
+        return getattr(keys, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+class FrequencyIndex:
+    # Indexed max-heap of word nodes ordered by frequency. Every word has exactly
+    # one entry and its position is tracked, so a frequency change moves the
+    # entry in place instead of pushing a new one: the heap never holds stale
+    # entries and its size is bounded by the number of words
+    def __init__(self):
+        self.heap = []
+        self.position = {}  # node -> index in self.heap
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, node):
+        return node in self.position
+
+    def update(self, node):
+        # Add node, or restore heap order after its frequency changed
+        index = self.position.get(node)
+        if index is None:
+            index = len(self.heap)
+            self.heap.append(node)
+            self.position[node] = index
+        index = self._sift_up(index)
+        self._sift_down(index)
+
+    def rebuild(self, nodes):
+        # Replace the contents with nodes; a list sorted by descending frequency
+        # is already a valid max-heap
+        self.heap = sorted(nodes, key=lambda n: n.frequency, reverse=True)
+        self.position = {node: index for index, node in enumerate(self.heap)}
+
+    def remove(self, node):
+        # Drop node's entry: the last entry takes its place and is re-sifted
+        index = self.position.pop(node)
+        last = self.heap.pop()
+        if index < len(self.heap):
+            self.heap[index] = last
+            self.position[last] = index
+            index = self._sift_up(index)
+            self._sift_down(index)
 
-# Generate RSA key pair for encryption and decryption
-key = RSA.generate(2048)
-public_key = key.publickey()
-cipher = PKCS1_OAEP.new(public_key)
-decipher = PKCS1_OAEP.new(key)
+    def top_k(self, k):
+        # Best-first walk from the root of the heap: only the k results and
+        # their children are looked at, the heap itself is not modified
+        heap = self.heap
+        result = []
+        candidates = [(-heap[0].frequency, 0)] if heap else []
+        while candidates and len(result) < k:
+            _, index = heapq.heappop(candidates)
+            result.append(heap[index])
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < len(heap):
+                    heapq.heappush(candidates, (-heap[child].frequency, child))
+        return result
+
+    def _swap(self, i, j):
+        heap = self.heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self.position[heap[i]] = i
+        self.position[heap[j]] = j
+
+    def _sift_up(self, index):
+        heap = self.heap
+        while index > 0:
+            parent = (index - 1) // 2
+            if heap[parent].frequency >= heap[index].frequency:
+                break
+            self._swap(index, parent)
+            index = parent
+        return index
+
+    def _sift_down(self, index):
+        heap = self.heap
+        size = len(heap)
+        while True:
+            largest = index
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < size and heap[child].frequency > heap[largest].frequency:
+                    largest = child
+            if largest == index:
+                return index
+            self._swap(index, largest)
+            index = largest
+
+# Number of ranked suggestions kept on every node for autocomplete_encrypted(prefix, k)
+TOP_K_CACHE_SIZE = 10
+
+# Words handed to a bulk-load worker process at a time
+INSERT_CHUNK_SIZE = 256
 
 class EncryptedTrie(Trie):
-    def __init__(self, public_key, decipher):
+    timed_operations = ("insert_encrypted", "insert_many_encrypted", "delete", "autocomplete_encrypted",
+                        "autocomplete_fuzzy", "autocomplete_substring", "top_k", "increase_word_frequency",
+                        "decrypt_word")
+
+    def __init__(self, public_key, decipher, top_k_size=TOP_K_CACHE_SIZE, backend=None):
         super().__init__()
         self.public_key = public_key
-        self.decipher = decipher
-        self.max_heap = []  # A list to store the max-heap of (frequency, word)
+        # Per-word RSA-OAEP unless another cipher backend is given
+        self.backend = backend if backend is not None else RSAOAEPBackend(public_key)
+        self._private_decipher = decipher
+        self._decipher = None
+        self.frequency_index = FrequencyIndex()  # Global ranking of every word by frequency
+        self.top_k_size = top_k_size
+        self.result_cache = None  # Set by enable_result_cache
+        self.substring_index = None  # Built by the first autocomplete_substring
+
+    @property
+    def decipher(self):
+        # Made on first use: for AES-GCM it costs one RSA operation to unwrap the data key
+        if self._decipher is None:
+            self._decipher = self.backend.client_decipher(self._private_decipher)
+        return self._decipher
+
+    def save(self, path):
+        # Write a snapshot of the words, ciphertexts, frequencies and top-k lists
+        write_snapshot(self, path)
+
+    @classmethod
+    def load(cls, path, mmap=False, decipher=None, writable=False):
+        # Open a snapshot without re-encrypting anything. With mmap=True the
+        # result is a MappedEncryptedTrie that queries the mapped file in place
+        # (writable=True writes frequency changes back to it); otherwise the
+        # whole trie is rebuilt in memory. decipher defaults to the key manager's;
+        # one that cannot read the snapshot raises ValueError
+        if mmap:
+            return MappedEncryptedTrie(path, decipher, writable)
+        if cls._edge_label is not Trie._edge_label:
+            raise TypeError("snapshots store one character per edge; radix tries are not supported")
+        return load_trie(cls, path, decipher)
+
+    def enable_result_cache(self, max_bytes=RESULT_CACHE_BYTES):
+        # Remember the ranked results autocomplete_encrypted has to walk a
+        # subtree for (k past top_k_size, or every word), within max_bytes
+        self.result_cache = PrefixResultCache(max_bytes)
+        return self.result_cache
+
+    def disable_result_cache(self):
+        self.result_cache = None
 
     def encrypt_word(self, word):
-        # Encrypt the entire word using RSA encryption
-        encrypted_word = cipher.encrypt(word.encode())
+        # Encrypt the entire word with the configured cipher backend
+        encrypted_word = self.backend.encrypt(word.encode())
         return encrypted_word
 
     def decrypt_word(self, encrypted_word):
@@ -69,59 +572,377 @@ class EncryptedTrie(Trie):
         decrypted_word = self.decipher.decrypt(encrypted_word).decode()
         return decrypted_word
 
+    def insert(self, word):
+        # Trie.insert would mark a word with no ciphertext and no heap entry,
+        # which delete and the rankings cannot handle: store it encrypted
+        self.insert_encrypted(word)
+
     def insert_encrypted(self, word):
-        node = self.root
-        for char in word:
-            if char not in node.children:
-                node.children[char] = TrieNode()
-            node = node.children[char]
+        # A word that is already stored keeps its ciphertext and frequency
+        if self._contains(word):
+            return
+        self._store_encrypted(word, self.encrypt_word(word))
+
+    def insert_many_encrypted(self, words, workers=None, chunk_size=INSERT_CHUNK_SIZE):
+        # Bulk load: words are encrypted in a pool of `workers` processes and the
+        # trie is built here. Repeated words and words already in the trie are
+        # skipped before encryption. Returns the number of words inserted
+        inserted = 0
+        for chunk, encrypted_words in encrypt_chunks(self.backend, self._new_word_chunks(words, chunk_size), workers):
+            for word, encrypted_word in zip(chunk, encrypted_words):
+                self._store_encrypted(word, encrypted_word)
+            inserted += len(chunk)
+        return inserted
+
+    def _new_word_chunks(self, words, chunk_size):
+        seen = set()
+        chunk = []
+        for word in words:
+            if word in seen or self._contains(word):
+                continue
+            seen.add(word)
+            chunk.append(word)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def insert_corpus(self, pairs, workers=None, chunk_size=INSERT_CHUNK_SIZE):
+        # Bulk load (word, count) pairs, e.g. from corpus.read_corpus, seeding
+        # each new word's frequency with its count; counts of words already
+        # stored are added to them. The path to the previous word is kept and
+        # a word only descends from where it leaves that path, so sorted input
+        # builds the trie in one linear pass; the rankings are computed once
+        # at the end instead of per word. Memory stays bounded whatever the
+        # input size. Returns the number of words inserted
+        if "_store_encrypted" in vars(self) or "increase_word_frequency" in vars(self):
+            # A journal or metrics wraps these on this instance: they must see every word
+            return self._insert_corpus_words(pairs, workers, chunk_size)
+        # Nodes form no reference cycles, so the cycle collector would only
+        # rescan the growing trie again and again; it is paused for the load
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            inserted = self._build_corpus(pairs, workers, chunk_size)
+            self._rebuild_rankings()
+        finally:
+            if collecting:
+                gc.enable()
+        self.generation += 1
+        return inserted
+
+    def _insert_corpus_words(self, pairs, workers, chunk_size):
+        # insert_corpus one word at a time, through _store_encrypted and
+        # increase_word_frequency
+        counts = deque()
+        inserted = 0
+        for chunk, encrypted_words in encrypt_chunks(self.backend, self._corpus_chunks(pairs, chunk_size, counts),
+                                                     workers):
+            for word, encrypted_word, frequency in zip(chunk, encrypted_words, counts.popleft()):
+                if not self._contains(word):
+                    self._store_encrypted(word, encrypted_word)
+                    inserted += 1
+                if frequency:
+                    self.increase_word_frequency(word, frequency)
+        return inserted
+
+    def _build_corpus(self, pairs, workers, chunk_size):
+        counts = deque()  # Counts of the chunks handed to encrypt_chunks, in order
+        chunks = self._corpus_chunks(pairs, chunk_size, counts)
+        linear = type(self)._edge_label is Trie._edge_label
+        path = [self.root]  # Root to the previous word
+        previous = ""
+        inserted = 0
+        for chunk, encrypted_words in encrypt_chunks(self.backend, chunks, workers):
+            for word, encrypted_word, frequency in zip(chunk, encrypted_words, counts.popleft()):
+                if linear:
+                    common = 0
+                    limit = min(len(word), len(previous))
+                    while common < limit and word[common] == previous[common]:
+                        common += 1
+                    del path[common + 1:]
+                    node = path[-1]
+                    for char in word[common:]:
+                        child = node.children.get(char)
+                        if child is None:
+                            child = node.children[char] = self.node_class()
+                        node = child
+                        path.append(node)
+                    previous = word
+                else:
+                    # Edges longer than a character may be split by the next word
+                    node = self._insert_path(word)[-1]
+                if node.is_end_of_word:
+                    node.frequency += frequency  # A repeat further apart in the input
+                    continue
+                node.is_end_of_word = True
+                node.encrypted_word = encrypted_word
+                node.frequency = frequency
+                inserted += 1
+        return inserted
+
+    def _corpus_chunks(self, pairs, chunk_size, counts):
+        # Chunks of words to encrypt; each chunk's counts are appended to counts
+        chunk, chunk_counts = [], []
+        loaded = len(self.frequency_index) > 0  # Only then can a word be stored already
+        for word, frequency in pairs:
+            if loaded and self._contains(word):
+                self.increase_word_frequency(word, frequency)
+                continue
+            chunk.append(word)
+            chunk_counts.append(frequency)
+            if len(chunk) == chunk_size:
+                counts.append(chunk_counts)
+                yield chunk
+                chunk, chunk_counts = [], []
+        if chunk:
+            counts.append(chunk_counts)
+            yield chunk
+
+    def _rebuild_rankings(self):
+        # Recompute the frequency index and every cached list from scratch;
+        # reversed pre-order visits every node after its children
+        nodes = list(self._walk(self.root))
+        self.frequency_index.rebuild([node for node in nodes if node.is_end_of_word])
+        self._rebuild_top_k(nodes)
+        if self.result_cache is not None:
+            self.result_cache.clear()
+        self.substring_index = None  # Rebuilt when next needed
+
+    def _contains(self, word):
+        path = self._path(word)
+        return path is not None and path[-1].is_end_of_word
+
+    def _store_encrypted(self, word, encrypted_word):
+        path = self._insert_path(word)
+        node = path[-1]
         # At the leaf node, store the encrypted word
         node.is_end_of_word = True
-        node.encrypted_word = self.encrypt_word(word)
+        node.encrypted_word = encrypted_word
         node.frequency = 0  # Initialize frequency to 0
+        self.frequency_index.update(node)
+        self._promote_top_k(path, node)
+        self.generation += 1
+        self._invalidate(word)
+        if self.substring_index is not None:
+            self.substring_index.add(word, node)
+
+    def delete(self, word):
+        # Also drops the word's heap entry and its place in the cached lists,
+        # so a trie with catalogue churn does not keep growing
+        path = self._path(word)
+        if path is None or not path[-1].is_end_of_word:
+            return False
+        word_node = path[-1]
+        self.frequency_index.remove(word_node)
+        path = self._delete_path(word, path)
+        # Only lists that held the word change; they are the top of the path,
+        # since a list can hold a word only if the list below it does
+        self._rebuild_top_k([node for node in path if word_node in node.top_k])
+        self.generation += 1
+        self._invalidate(word)
+        if self.substring_index is not None:
+            self.substring_index.remove(word)
+        return True
+
+    def _invalidate(self, word):
+        # Called after word changed: only the results of its prefixes can differ
+        if self.result_cache is not None:
+            self.result_cache.invalidate(word)
+
+    def _promote_top_k(self, path, word_node):
+        # word_node was added or its frequency went up: walk the path bottom-up
+        # and move it into every cached top-k list it now qualifies for
+        frequency = word_node.frequency
+        for node in reversed(path):
+            ranked = node.top_k
+            if word_node in ranked:
+                ranked = list(ranked)
+            elif len(ranked) < self.top_k_size:
+                ranked = list(ranked) + [word_node]
+            elif ranked and frequency > ranked[-1].frequency:
+                ranked = list(ranked[:-1]) + [word_node]
+            else:
+                # A larger subtree has a higher k-th frequency, so no ancestor
+                # list can take this word either
+                break
+            ranked.sort(key=lambda n: n.frequency, reverse=True)
+            # Stored as a tuple: nodes without words share the empty tuple
+            node.top_k = tuple(ranked)
 
-    def autocomplete_encrypted(self, prefix):
-        node = self.search(prefix)  # Search using the plaintext prefix
+    def _rebuild_top_k(self, path):
+        # Recompute the cached lists along path from the children's lists, for
+        # when a word leaves a subtree and a word outside a list may replace it
+        for node in reversed(path):
+            if len(node.children) == 1 and not node.is_end_of_word:
+                # A pass-through node ranks exactly what its child does
+                for child in node.children.values():
+                    node.top_k = child.top_k
+                continue
+            candidates = [node] if node.is_end_of_word else []
+            for child in node.children.values():
+                candidates.extend(child.top_k)
+            node.top_k = tuple(heapq.nlargest(self.top_k_size, candidates, key=lambda n: n.frequency))
+
+    def autocomplete_encrypted(self, prefix, k=None):
+        cache = self.result_cache
+        if cache is None or (k is not None and k <= self.top_k_size):
+            node, _ = self._locate(prefix)  # Search using the plaintext prefix
+            if not node:
+                return []
+            return self._ranked_encrypted(node, k)
+        # A walk of the whole subtree: look in the result cache first
+        cached = cache.get(prefix, k)
+        if cached is not None:
+            return list(cached)
+        version = cache.version
+        node, _ = self._locate(prefix)
         if not node:
             return []
-        
-        # Clear the heap before starting the new search to avoid duplicates
-        self.max_heap = []
-
-        suggestions = []
-        self._dfs_encrypted(node, suggestions)
-        
-        # Sort suggestions using the max-heap, returning in order of highest frequency
-        sorted_suggestions = heapq.nlargest(len(suggestions), self.max_heap, key=lambda x: -x[0])
-        
-        # Return only the unique encrypted words
-        unique_encrypted_words = []
-        seen_words = set()
-        for _, encrypted_word in sorted_suggestions:
-            if encrypted_word not in seen_words:
-                unique_encrypted_words.append(encrypted_word)
-                seen_words.add(encrypted_word)
-        
-        return unique_encrypted_words
-
-    def _dfs_encrypted(self, node, suggestions):
-        if node.is_end_of_word:
-        # Append the encrypted word and its frequency
-            suggestions.append((node.encrypted_word, node.frequency))
-        # Add the word and its frequency to the heap (simulating a max-heap)
-            heapq.heappush(self.max_heap, (-node.frequency, node.encrypted_word))
-        for char, child in node.children.items():
-            self._dfs_encrypted(child, suggestions)
-
-    def increase_word_frequency(self, word):
-        node = self.search(word)
-        if node and node.is_end_of_word:
-            node.frequency += 1  # Increment the frequency count
-            # Add the updated frequency to the heap
-            heapq.heappush(self.max_heap, (-node.frequency, node.encrypted_word))
+        ranked = self._ranked_encrypted(node, k)
+        cache.put(prefix, k, tuple(ranked), version)
+        return ranked
+
+    def _suggestions(self, node, key, k=None):
+        # A cursor over an encrypted trie serves what autocomplete_encrypted would
+        return self._ranked_encrypted(node, k)
+
+    def _ranked_encrypted(self, node, k):
+        if k is not None and k <= self.top_k_size:
+            # Served from the per-node cache: cost is the prefix walk plus k
+            return [n.encrypted_word for n in node.top_k[:k]]
+
+        suggestions = [(n.encrypted_word, n.frequency) for n in self._walk(node) if n.is_end_of_word]
+
+        # Every word node is visited once, so there is nothing to deduplicate
+        if k is not None:
+            ranked = heapq.nlargest(k, suggestions, key=lambda x: x[1])
+        else:
+            ranked = sorted(suggestions, key=lambda x: x[1], reverse=True)
+        return [encrypted_word for encrypted_word, _ in ranked]
+
+    def autocomplete_substring(self, fragment, k=None):
+        # Encrypted words containing fragment anywhere, most frequent first.
+        # Served by a suffix array over the vocabulary, built on first use and
+        # kept up to date by inserts and deletes from then on
+        return [node.encrypted_word for node in self._substring_index().search(fragment, k)]
+
+    def _substring_index(self):
+        index = self.substring_index
+        if index is None:
+            index = self.substring_index = SubstringIndex(self)
+        return index
+
+    def iter_ranked_encrypted(self, prefix):
+        # Lazily yield the encrypted words starting with prefix, most frequent
+        # first. Best-first search: the head of a node's cached top-k list is
+        # the best word in its subtree, so a subtree is opened only when that
+        # word is the best candidate left, and taking the first n words costs
+        # about n times the branching along their paths, not the subtree size
+        node, _ = self._locate(prefix)
+        if not node:
+            return
+        for node in self._iter_ranked([node]):
+            yield node.encrypted_word
+
+    def autocomplete_fuzzy(self, prefix, max_edits=1, k=None):
+        # Encrypted words that start with something within max_edits edits of
+        # prefix, closest first, then by frequency. Each distance level is read
+        # best-first through the cached top-k lists, so only about k words are
+        # ranked however large the matching subtrees are
+        seen = set()
+        result = []
+        for _, roots in self._fuzzy_levels(prefix, max_edits):
+            for node in self._iter_ranked([node for node, _ in roots]):
+                if k is not None and len(result) >= k:
+                    return result
+                if node not in seen:  # Already listed at a smaller distance
+                    seen.add(node)
+                    result.append(node.encrypted_word)
+        return result
+
+    def _iter_ranked(self, roots):
+        # Word nodes of the subtrees under roots, most frequent first. The
+        # cached top-k lists are merged first; only when a full list runs out
+        # is its node opened and its children's lists merged in, so taking
+        # the first few words costs about that many heap steps
+        if not self.top_k_size:
+            # No cached lists to bound subtrees with
+            words = [node for root in roots for node in self._walk(root) if node.is_end_of_word]
+            yield from sorted(words, key=lambda n: n.frequency, reverse=True)
+            return
+        # Entries are (-bound, tie-breaker, node, index): index -1 is the word
+        # at node, an index into node.top_k is the next word of that list, and
+        # index == len(node.top_k) opens node for the words past its list
+        order = count()
+        candidates = [(-node.top_k[0].frequency, next(order), node, 0) for node in roots if node.top_k]
+        heapq.heapify(candidates)
+        yielded = set()  # A list and the node it was opened into share words
+        while candidates:
+            _, _, node, index = heapq.heappop(candidates)
+            ranked = node.top_k
+            if index == -1 or index < len(ranked):
+                word = node if index == -1 else ranked[index]
+                if word not in yielded:
+                    yielded.add(word)
+                    yield word
+                if index == -1:
+                    continue
+                index += 1
+                if index < len(ranked):
+                    heapq.heappush(candidates, (-ranked[index].frequency, next(order), node, index))
+                elif len(ranked) == self.top_k_size:
+                    # The list may have been cut off: the rest rank below its last word
+                    heapq.heappush(candidates, (-ranked[-1].frequency, next(order), node, index))
+                continue
+            # Pushed before the children, so it wins ties with words below it
+            if node.is_end_of_word:
+                heapq.heappush(candidates, (-node.frequency, next(order), node, -1))
+            for child in node.children.values():
+                if child.top_k:
+                    heapq.heappush(candidates, (-child.top_k[0].frequency, next(order), child, 0))
+
+    def sizes(self):
+        # Word and node counts; the nodes are counted with one walk
+        nodes = 0
+        stack = [self.root]
+        while stack:
+            nodes += 1
+            stack.extend(stack.pop().children.values())
+        return {"words": len(self.frequency_index), "nodes": nodes}
+
+    def top_k(self, k):
+        # Global top k words by frequency, without walking the trie
+        return [node.encrypted_word for node in self.frequency_index.top_k(k)]
+
+    def iter_autocomplete_encrypted(self, prefix):
+        # Lazily yield (encrypted_word, frequency) for every word starting with
+        # prefix, unranked, in the same order as iter_autocomplete
+        node, _ = self._locate(prefix)
+        if not node:
+            return
+        for node in self._walk(node):
+            if node.is_end_of_word:
+                yield node.encrypted_word, node.frequency
+
+    def increase_word_frequency(self, word, amount=1):
+        # amount > 1 applies a batch of selections of the same word at once
+        path = self._path(word)
+        if path and path[-1].is_end_of_word:
+            node = path[-1]
+            node.frequency += amount  # Increment the frequency count
+            # Move the word's single heap entry up to its new position
+            self.frequency_index.update(node)
+            self._promote_top_k(path, node)
+            self.generation += 1
+            self._invalidate(word)
 
 # Client-side decryption function
 def client_decrypt_suggestions(suggestions, decipher):
+    if isinstance(decipher, ClientDecryptor):
+        # Cached (and possibly pooled) decryption
+        return decipher.decrypt_many(suggestions)
     decrypted_suggestions = []
     for encrypted_word in suggestions:  # Only decrypt the word
         decrypted_word = decipher.decrypt(encrypted_word).decode()
@@ -134,19 +955,51 @@ predefined_words = ["the", "of", "and", "to", "in", "for", "is", "on", "that", "
 # Main function to handle user input
 def main():
     stdscr = curses.initscr()
-    curses.echo()
+    curses.noecho()  # inputStr draws the typed text itself
     stdscr.clear()
     stdscr.refresh()
     stdscr.keypad(True)
 
-    # Create an encrypted trie
-    encrypted_trie = EncryptedTrie(public_key, decipher)
+    # With TRIE_DATA_DIR set, learned frequencies survive restarts: the trie
+    # is loaded from the directory and every change is journaled there. Its
+    # snapshots only open with the key that wrote them, which is kept in the
+    # directory unless TRIE_KEY_FILE names one
+    data_dir = os.environ.get(DATA_DIR_ENV)
+    trie_keys = data_dir_keys(data_dir) if data_dir else keys
+
+    def build_trie():
+        # Create an encrypted trie: words are encrypted with AES-GCM under a data
+        # key that is wrapped once by the RSA public key
+        trie = EncryptedTrie(trie_keys.public_key, trie_keys.decipher, backend=AESGCMBackend(trie_keys.public_key))
+        # Insert the corpus named by TRIE_CORPUS_FILE, or else the predefined
+        # words, into the Trie (stored as encrypted), encrypting them in one
+        # worker process per CPU
+        corpus_file = os.environ.get(CORPUS_FILE_ENV)
+        if corpus_file:
+            trie.insert_corpus(read_corpus(corpus_file), workers=os.cpu_count())
+        else:
+            trie.insert_many_encrypted(predefined_words, workers=os.cpu_count())
+        return trie
+
+    journal = None
+    if data_dir:
+        encrypted_trie, journal = open_journaled(data_dir, build_trie, EncryptedTrie, trie_keys.decipher)
+    else:
+        encrypted_trie = build_trie()
+    # Client-side decryption goes through a bounded cache of decrypted words
+    decryptor = ClientDecryptor(encrypted_trie.backend.client_decipher(trie_keys.decipher))
 
-    # Insert predefined words into the Trie (stored as encrypted)
-    for word in predefined_words:
-        encrypted_trie.insert_encrypted(word)
+    # Opt-in metrics, written periodically to the file named by TRIE_METRICS_FILE
+    metrics_file = os.environ.get(METRICS_FILE_ENV)
+    if metrics_file:
+        metrics = encrypted_trie.enable_metrics()
+        metrics.instrument_decryptor(decryptor, encrypted_trie.backend.name)
+        metrics.start_dump(metrics_file, format="prometheus" if metrics_file.endswith(".prom") else "json")
 
-    stdscr.addstr(1, 2, f"{len(predefined_words)} predefined words have been inserted into the Trie.")
+    if journal is None:
+        stdscr.addstr(1, 2, f"{len(encrypted_trie.frequency_index)} words have been inserted into the Trie.")
+    else:
+        stdscr.addstr(1, 2, f"Loaded {len(encrypted_trie.frequency_index)} words from {data_dir}.")
     stdscr.getch()
 
     while True:
@@ -154,27 +1007,29 @@ def main():
         curses.curs_set(1)
 
         # User inputs a prefix to search for auto-complete suggestions
-        prefix = inputStr(stdscr, encrypted_trie, decipher)
+        prefix = inputStr(stdscr, encrypted_trie, decryptor)
         stdscr.addstr(3, 3, f"\nPrefix: {prefix}")
 
         if prefix.lower() == 'exit':
+            if journal is not None:
+                journal.close()  # Writes the last group of changes
             break
 
-        encrypted_suggestions = encrypted_trie.autocomplete_encrypted(prefix)
+        # Suggestions are read from the trie in ranked order only as far as the
+        # menu scrolls, and the client decrypts only the rows menu_select shows
+        decrypted_suggestions = decryptor.paged(encrypted_trie.iter_ranked_encrypted(prefix))
 
         # If no suggestions found
-        if not encrypted_suggestions:
+        if not decrypted_suggestions.load(1):
             stdscr.addstr(3, 2, f"No suggestions found for prefix '{prefix}'")
             continue
 
-        # Client decrypts the suggestions
-        decrypted_suggestions = client_decrypt_suggestions(encrypted_suggestions, decipher)
         selected_word = menu_select(stdscr, decrypted_suggestions)
         curses.curs_set(1)
 
         # User can choose a word from suggestions, which increases the frequency of that word
         stdscr.clear()
-        if selected_word in decrypted_suggestions:
+        if selected_word is not None:
             encrypted_trie.increase_word_frequency(selected_word)
             stdscr.addstr(1, 2, f"Frequency of '{selected_word}' increased.")
             stdscr.getch()
@@ -185,82 +1040,132 @@ def main():
             stdscr.clear()
 
 
-def inputStr(stdscr, encrypted_trie, decipher):
+def inputStr(stdscr, encrypted_trie, decryptor):
     input_str = []  # List to store input characters
     cursor_x = 0  # Position of cursor within the input
-    suggestions = []  # Store suggestions for autocomplete
+    # Follows the text as it is typed, so a lookup only walks the characters
+    # that changed instead of the whole prefix from the root
+    prefix_cursor = encrypted_trie.cursor()
+    # Only rows that changed are redrawn, so typing does not repaint the screen
+    lines = ScreenLines(stdscr)
+    lines.invalidate()
+    pane = SuggestionPane(lines, 4, SUGGESTION_PANE_SIZE, decryptor)
+    stale = True  # The pane does not match the input yet
 
-    while True:
-        # Display the input field
-        stdscr.clear()
-        stdscr.addstr(1, 2, "Enter text (Press Enter to finish, ESC to cancel, Tab for autocomplete):")
-        stdscr.addstr(2, 2, "> ")
-        stdscr.addstr(2, 4, "".join(input_str) + " ")  # Clear the last character position
-        stdscr.move(2, cursor_x + 4)  # Move cursor to current position
-        stdscr.refresh()
+    # getch gives up after SUGGEST_DELAY_MS, which is when the pane is updated:
+    # while keys keep arriving faster than that no lookup is made at all, so
+    # stale lookups never queue up behind the typing
+    stdscr.timeout(SUGGEST_DELAY_MS)
+    try:
+        while True:
+            # Display the input field
+            lines.draw(1, "Enter text (Press Enter to finish, ESC to cancel, Tab for autocomplete):", col=2)
+            lines.draw(2, "> " + "".join(input_str), col=2)
+            lines.refresh((2, cursor_x + 4))  # Move cursor to current position
 
-        # Get user input
-        key = stdscr.getch()
+            # Get user input
+            key = stdscr.getch()
+            text = "".join(input_str)
 
-        if key == 27:  # ESC key to cancel
-            return ""
-        elif key in (curses.KEY_BACKSPACE, 127):  # Handle backspace
-            if cursor_x > 0:
-                cursor_x -= 1
-                input_str.pop(cursor_x)  # Remove character at cursor position
-        elif key == curses.KEY_LEFT:  # Move cursor left
-            if cursor_x > 0:
-                cursor_x -= 1
-        elif key == curses.KEY_RIGHT:  # Move cursor right
-            if cursor_x < len(input_str):
-                cursor_x += 1
-        elif key == ord('\n'):  # Enter key to submit
-            return "".join(input_str)
-        elif key == ord('\t'):  # Tab key for autocomplete
-            prefix = "".join(input_str)
-            encrypted_suggestions = encrypted_trie.autocomplete_encrypted(prefix)
-            if encrypted_suggestions:
-                decrypted_suggestions = client_decrypt_suggestions(encrypted_suggestions, decipher)
-                if decrypted_suggestions:
-                    # Autocomplete with the most frequent suggestion (first one in sorted list)
-                    most_frequent_suggestion = decrypted_suggestions[0]
+            if key == -1:  # Typing paused: bring the suggestion pane up to date
+                if stale:
+                    pane.show(prefix_cursor.suggestions(k=pane.height))
+                    stale = False
+                continue
+            elif key == 27:  # ESC key to cancel
+                return ""
+            elif key == curses.KEY_RESIZE:
+                lines.invalidate()
+                stale = True
+            elif key in (curses.KEY_BACKSPACE, 127):  # Handle backspace
+                if cursor_x > 0:
+                    cursor_x -= 1
+                    input_str.pop(cursor_x)  # Remove character at cursor position
+            elif key == curses.KEY_LEFT:  # Move cursor left
+                if cursor_x > 0:
+                    cursor_x -= 1
+            elif key == curses.KEY_RIGHT:  # Move cursor right
+                if cursor_x < len(input_str):
+                    cursor_x += 1
+            elif key == ord('\n'):  # Enter key to submit
+                return "".join(input_str)
+            elif key == ord('\t'):  # Tab key for autocomplete
+                # Only the best match is needed, so use the per-node top-k cache
+                encrypted_suggestions = prefix_cursor.suggestions(k=1)
+                # Autocomplete with the most frequent suggestion (first one in sorted
+                # list); nothing after it is decrypted
+                most_frequent_suggestion = next(decryptor.iter_decrypt(encrypted_suggestions), None)
+                if most_frequent_suggestion is not None:
                     input_str = list(most_frequent_suggestion)
                     cursor_x = len(input_str)
-        elif 32 <= key <= 126:  # Printable characters (ASCII range for simplicity)
-            input_str.insert(cursor_x, chr(key))  # Insert character at cursor position
-            cursor_x += 1
+            elif 32 <= key <= 126:  # Printable characters (ASCII range for simplicity)
+                input_str.insert(cursor_x, chr(key))  # Insert character at cursor position
+                cursor_x += 1
+
+            if "".join(input_str) != text:
+                # Typing at the end is one push and backspace at the end one pop;
+                # an edit in the middle re-walks only the characters after it
+                prefix_cursor.set_prefix("".join(input_str))
+                stale = True
+    finally:
+        stdscr.timeout(-1)
 
-    return ''.join(input_str)
+def menu_select(stdscr, items, page_size=None):
+    # items is a sequence of words; a PagedSuggestions is asked to load only
+    # the rows up to the end of the page being shown. page_size is the number
+    # of rows per page (PageUp/PageDown step) and defaults to the screen height
+    load = getattr(items, "load", None)
 
-def menu_select(stdscr, items):
     # Initial setup
     curses.curs_set(0)              # Hide the cursor
     current_row = 0                 # Track which row is selected
+    top_row = 0                     # First item shown, scrolled to keep the selection visible
+    lines = ScreenLines(stdscr)     # Moving the selection redraws only the two rows involved
+    lines.invalidate()
 
     while True:
-        # Clear and refresh the screen for a new display
-        stdscr.clear()
-
-        # Display all menu items with highlighting
-        for idx, item in enumerate(items):
+        # Display only the items that fit on the screen, so a lazily decrypted
+        # list is fetched and decrypted one visible page at a time
+        rows = max(1, min(page_size or stdscr.getmaxyx()[0], stdscr.getmaxyx()[0] - 2))
+        if load is not None:
+            load(max(current_row, top_row) + rows)
+        current_row = min(current_row, len(items) - 1)
+        top_row = min(top_row, max(0, len(items) - rows))
+        if current_row < top_row:
+            top_row = current_row
+        elif current_row >= top_row + rows:
+            top_row = current_row - rows + 1
+        end_row = min(len(items), top_row + rows)
+        for idx in range(top_row, end_row):
+            item = items[idx]
             if idx == current_row:
-                stdscr.addstr(idx + 1, 2, " "+item+" ", curses.A_REVERSE)  # Highlighted selection
+                lines.draw(idx - top_row + 1, " "+item+" ", curses.A_REVERSE, col=2)  # Highlighted selection
             else:
-                stdscr.addstr(idx + 1, 2, " "+item+" ")
+                lines.draw(idx - top_row + 1, " "+item+" ", col=2)
+        lines.clear_from(end_row - top_row + 1)
 
-        stdscr.refresh()
+        lines.refresh()
 
         # Get user input
         key = stdscr.getch()
 
-        if key == curses.KEY_UP and current_row > 0:
+        if key == curses.KEY_RESIZE:
+            lines.invalidate()
+        elif key == curses.KEY_UP and current_row > 0:
             current_row -= 1
-        elif key == curses.KEY_DOWN and current_row < len(items) - 1:
+        elif key == curses.KEY_DOWN:
+            # The next row may not be loaded yet; it is clamped on the next pass
             current_row += 1
+        elif key == curses.KEY_PPAGE:
+            current_row = max(0, current_row - rows)
+            top_row = max(0, top_row - rows)
+        elif key == curses.KEY_NPAGE:
+            current_row += rows
+            top_row += rows
         elif key == ord('\n'):  # Enter key
-            return items[current_row]  # Return the index of the selected item
+            return items[current_row]  # Return the selected item
         elif key == 27:  # ESC key to cancel
-            break
+            return None
 
 if __name__ == "__main__":
     curses.wrapper(main())
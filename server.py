@@ -0,0 +1,440 @@
+# Asyncio autocomplete server: one loaded EncryptedTrie shared by many clients
+#
+# Usage: python server.py serve (--socket PATH | --port N) [--host HOST]
+#                               [--snapshot FILE [--mmap [--mmap-writable]]]
+#        python server.py loadgen (--socket PATH | --port N) [--host HOST] [--clients N]
+#                                 [--requests N] [--k N] [--select-ratio R] [--decrypt]
+#
+# Protocol: every message is a frame of a 4-byte big-endian payload length
+# and the payload. A request payload is an opcode byte and its arguments, a
+# response payload is a status byte (0 ok, 1 error) and its body; an error
+# body is a UTF-8 message. Responses come back in request order on each
+# connection, so a client may send several requests before reading.
+#
+#   AUTOCOMPLETE  k:u16 (0 = all), prefix:UTF-8  ->  count:u32, count x (length:u16, ciphertext)
+#   TOP_K         k:u16                          ->  same as AUTOCOMPLETE
+#   SELECT        word:UTF-8                     ->  empty; frequency updates are applied in batches
+#   INFO                                         ->  JSON: backend name, wrapped data key, top-k size,
+#                                                    word and node counts
+#   STATS                                        ->  JSON: server counters
+#
+# The server never decrypts: suggestions leave as ciphertexts and the client
+# decrypts them with client_decrypt_suggestions.
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import struct
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from ciphers import AESGCMBackend, AESGCMDecipher, ClientDecryptor
+from corpus import read_corpus
+from journal import data_dir_keys, open_journaled
+from keys import default_keys as keys
+from search import EncryptedTrie, predefined_words
+
+AUTOCOMPLETE, TOP_K, SELECT, INFO, STATS = range(1, 6)
+OK, ERROR = 0, 1
+
+FRAME_HEADER = struct.Struct(">I")
+SHORT = struct.Struct(">H")
+
+# Largest request payload accepted; a longer frame closes the connection
+MAX_FRAME = 1 << 16
+
+# Lookups running at once across all connections; further requests wait
+MAX_PENDING = 64
+
+# Requests read ahead on one connection before its responses are written
+PIPELINE_DEPTH = 16
+
+# Seconds between frequency update batches, and the batch size that triggers
+# one early
+FLUSH_INTERVAL = 0.05
+UPDATE_BATCH_SIZE = 1024
+
+
+class ServerError(RuntimeError):
+    pass
+
+
+class AutocompleteServer:
+    def __init__(self, trie, max_pending=MAX_PENDING, flush_interval=FLUSH_INTERVAL,
+                 batch_size=UPDATE_BATCH_SIZE):
+        self.trie = trie
+        # Every trie access runs on this one thread: the trie is not
+        # thread-safe, and the event loop stays free while a lookup runs
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trie")
+        self.inflight = {}  # (opcode, k, prefix) -> future of the lookup in progress
+        self.pending = asyncio.Semaphore(max_pending)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.updates = Counter()  # word -> selections not applied yet
+        self.update_count = 0
+        self.flush_now = asyncio.Event()
+        self.counters = Counter()
+        self.server = None
+        self.flusher = None
+
+    async def start(self, path=None, host="127.0.0.1", port=None):
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self.handle, path=path)
+        else:
+            self.server = await asyncio.start_server(self.handle, host=host, port=port)
+        self.flusher = asyncio.create_task(self._flush_loop())
+        return self.server
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.flusher.cancel()
+        await self.flush()
+        self.executor.shutdown()
+
+    async def handle(self, reader, writer):
+        # Requests are read ahead into a bounded queue and answered in order.
+        # When the queue is full the reader stops, and TCP flow control pushes
+        # back on a client that sends faster than it is answered
+        responses = asyncio.Queue(maxsize=PIPELINE_DEPTH)
+        sender = asyncio.create_task(self._send_responses(responses, writer))
+        try:
+            while True:
+                try:
+                    (length,) = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+                    if length > MAX_FRAME:
+                        break
+                    payload = await reader.readexactly(length)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                await responses.put(asyncio.create_task(self.dispatch(payload)))
+        finally:
+            await responses.put(None)
+            await sender
+
+    async def _send_responses(self, responses, writer):
+        # Runs until the reader queues None; after the client goes away the
+        # remaining responses are still awaited, so the reader never blocks
+        # on a full queue
+        connected = True
+        while True:
+            task = await responses.get()
+            if task is None:
+                break
+            response = await task
+            if connected:
+                try:
+                    writer.write(FRAME_HEADER.pack(len(response)) + response)
+                    await writer.drain()
+                except ConnectionError:
+                    connected = False
+        writer.close()
+
+    async def dispatch(self, payload):
+        self.counters["requests"] += 1
+        try:
+            opcode = payload[0]
+            if opcode == AUTOCOMPLETE:
+                (k,) = SHORT.unpack_from(payload, 1)
+                prefix = payload[1 + SHORT.size:].decode()
+                body = await self.lookup((AUTOCOMPLETE, k, prefix), self._autocomplete, prefix, k or None)
+            elif opcode == TOP_K:
+                (k,) = SHORT.unpack_from(payload, 1)
+                body = await self.lookup((TOP_K, k, None), self._top_k, k)
+            elif opcode == SELECT:
+                self.select(payload[1:].decode())
+                body = b""
+            elif opcode == INFO:
+                body = json.dumps(await self.info()).encode()
+            elif opcode == STATS:
+                body = json.dumps(self.stats()).encode()
+            else:
+                raise ValueError(f"unknown opcode {opcode}")
+        except Exception as error:
+            self.counters["errors"] += 1
+            return bytes([ERROR]) + str(error).encode()
+        return bytes([OK]) + body
+
+    async def lookup(self, key, function, *args):
+        # Identical queries that arrive while one is running share its result
+        future = self.inflight.get(key)
+        if future is None:
+            async with self.pending:
+                future = self.inflight.get(key)  # It may have started while we waited
+                if future is None:
+                    self.counters["lookups"] += 1
+                    future = asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+                    self.inflight[key] = future
+                    future.add_done_callback(lambda _: self.inflight.pop(key, None))
+                    return await asyncio.shield(future)
+        self.counters["coalesced"] += 1
+        return await asyncio.shield(future)
+
+    def select(self, word):
+        # Queue one selection of word; it reaches the trie with the next batch
+        self.updates[word] += 1
+        self.update_count += 1
+        self.counters["selects"] += 1
+        if self.update_count >= self.batch_size:
+            self.flush_now.set()
+
+    async def flush(self):
+        # Apply the queued selections, one increase_word_frequency per word
+        if not self.updates:
+            return
+        batch, self.updates, self.update_count = self.updates, Counter(), 0
+        self.counters["flushes"] += 1
+        await asyncio.get_running_loop().run_in_executor(self.executor, self._apply_updates, batch)
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.flush_now.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_now.clear()
+            await self.flush()
+
+    async def info(self):
+        backend = self.trie.backend
+        # Counted on the trie thread, so no write is halfway through
+        sizes = await asyncio.get_running_loop().run_in_executor(self.executor, self.trie.sizes)
+        return {
+            "backend": backend.name,
+            "wrapped_key": base64.b64encode(backend.wrapped_key).decode() if backend.wrapped_key else None,
+            "top_k_size": self.trie.top_k_size,
+            **sizes,
+        }
+
+    def stats(self):
+        return dict(self.counters, inflight=len(self.inflight), queued_updates=self.update_count)
+
+    # Run on the trie thread
+
+    def _autocomplete(self, prefix, k):
+        return encode_suggestions(self.trie.autocomplete_encrypted(prefix, k))
+
+    def _top_k(self, k):
+        return encode_suggestions(self.trie.top_k(k))
+
+    def _apply_updates(self, batch):
+        for word, count in batch.items():
+            self.trie.increase_word_frequency(word, count)
+
+
+def encode_suggestions(suggestions):
+    parts = [struct.pack(">I", len(suggestions))]
+    for encrypted_word in suggestions:
+        parts.append(SHORT.pack(len(encrypted_word)))
+        parts.append(encrypted_word)
+    return b"".join(parts)
+
+
+def decode_suggestions(body):
+    (count,) = struct.unpack_from(">I", body)
+    offset = 4
+    suggestions = []
+    for _ in range(count):
+        (length,) = SHORT.unpack_from(body, offset)
+        offset += SHORT.size
+        suggestions.append(body[offset:offset + length])
+        offset += length
+    return suggestions
+
+
+class AutocompleteClient:
+    # Async client; requests may be issued concurrently on one connection and
+    # are matched to responses in order
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.waiting = deque()  # Futures of sent requests, oldest first
+        self.receiver = asyncio.create_task(self._receive())
+
+    @classmethod
+    async def connect(cls, path=None, host="127.0.0.1", port=None):
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def request(self, payload):
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.append(future)
+        self.writer.write(FRAME_HEADER.pack(len(payload)) + payload)
+        await self.writer.drain()
+        response = await future
+        if response[0] != OK:
+            raise ServerError(response[1:].decode())
+        return response[1:]
+
+    async def autocomplete(self, prefix, k=None):
+        body = await self.request(bytes([AUTOCOMPLETE]) + SHORT.pack(k or 0) + prefix.encode())
+        return decode_suggestions(body)
+
+    async def top_k(self, k):
+        return decode_suggestions(await self.request(bytes([TOP_K]) + SHORT.pack(k)))
+
+    async def select(self, word):
+        await self.request(bytes([SELECT]) + word.encode())
+
+    async def info(self):
+        return json.loads(await self.request(bytes([INFO])))
+
+    async def stats(self):
+        return json.loads(await self.request(bytes([STATS])))
+
+    async def client_decipher(self, decipher):
+        # Decipher for the server's ciphertexts, from the client's RSA private-key decipher
+        info = await self.info()
+        if info["backend"] == AESGCMBackend.name:
+            return AESGCMDecipher(decipher.decrypt(base64.b64decode(info["wrapped_key"])))
+        return decipher
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.receiver.cancel()
+
+    async def _receive(self):
+        try:
+            while True:
+                (length,) = FRAME_HEADER.unpack(await self.reader.readexactly(FRAME_HEADER.size))
+                response = await self.reader.readexactly(length)
+                self.waiting.popleft().set_result(response)
+        except (asyncio.IncompleteReadError, ConnectionError) as error:
+            while self.waiting:
+                self.waiting.popleft().set_exception(ConnectionError(f"server closed the connection: {error}"))
+
+
+async def load_test(connect, clients, requests, k, select_ratio, words, decrypt=False):
+    # Closed-loop load: each client sends its share of the requests one after
+    # another. Prefixes of 1 to 4 characters come from words, so popular
+    # prefixes repeat across clients the way real typing does
+    rng = random.Random(0)
+    latencies = []
+    decryptor = None
+    client = await AutocompleteClient.connect(**connect)
+    if decrypt:
+        decryptor = ClientDecryptor(await client.client_decipher(keys.decipher))
+    await client.close()
+
+    async def run_client(count):
+        client = await AutocompleteClient.connect(**connect)
+        try:
+            for _ in range(count):
+                word = rng.choice(words)
+                start = time.perf_counter()
+                if rng.random() < select_ratio:
+                    await client.select(word)
+                else:
+                    suggestions = await client.autocomplete(word[:rng.randint(1, 4)], k)
+                    if decryptor is not None:
+                        decryptor.decrypt_many(suggestions)
+                latencies.append(time.perf_counter() - start)
+        finally:
+            await client.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(requests // clients) for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+
+    client = await AutocompleteClient.connect(**connect)
+    server_stats = await client.stats()
+    await client.close()
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "requests_per_s": len(latencies) / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1e3,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1e3,
+        "server": server_stats,
+    }
+
+
+def build_trie(args, trie_keys=keys):
+    if args.snapshot:
+        return EncryptedTrie.load(args.snapshot, mmap=args.mmap, writable=args.mmap_writable)
+    trie = EncryptedTrie(trie_keys.public_key, trie_keys.decipher, backend=AESGCMBackend(trie_keys.public_key))
+    if args.corpus:
+        trie.insert_corpus(read_corpus(args.corpus), workers=os.cpu_count())
+    else:
+        trie.insert_many_encrypted(predefined_words, workers=os.cpu_count())
+    return trie
+
+
+async def serve(args):
+    journal = None
+    if args.data_dir:
+        # Selections are journaled, so the learned ranking survives restarts.
+        # The key stays with the data unless TRIE_KEY_FILE names one
+        trie_keys = data_dir_keys(args.data_dir)
+        trie, journal = open_journaled(args.data_dir, lambda: build_trie(args, trie_keys), EncryptedTrie,
+                                       trie_keys.decipher)
+    else:
+        trie = build_trie(args)
+    server = AutocompleteServer(trie, max_pending=args.max_pending)
+    await server.start(path=args.socket, host=args.host, port=args.port)
+    print(f"serving on {args.socket or f'{args.host}:{args.port}'}")
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.close()
+        if journal is not None:
+            journal.close()
+        if args.mmap_writable:
+            trie.flush()  # Selections made it into the mapping; make sure they reach the file
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encrypted trie autocomplete server")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name in ("serve", "loadgen"):
+        command = commands.add_parser(name)
+        address = command.add_mutually_exclusive_group(required=True)
+        address.add_argument("--socket", help="Unix socket path")
+        address.add_argument("--port", type=int, help="TCP port")
+        command.add_argument("--host", default="127.0.0.1")
+
+    serve_command = commands.choices["serve"]
+    serve_command.add_argument("--snapshot", help="serve a saved snapshot instead of the predefined words")
+    serve_command.add_argument("--corpus", help="serve a word list or word<TAB>count file (optionally .gz) "
+                                                "instead of the predefined words")
+    serve_command.add_argument("--mmap", action="store_true",
+                               help="map the snapshot instead of loading it; selections stay in memory")
+    serve_command.add_argument("--mmap-writable", action="store_true",
+                               help="with --mmap, write selections back into the snapshot file")
+    serve_command.add_argument("--data-dir", help="keep the trie in this directory, journaling every change "
+                                                   "(seeded from --snapshot, --corpus or the predefined words)")
+    serve_command.add_argument("--max-pending", type=int, default=MAX_PENDING)
+
+    loadgen = commands.choices["loadgen"]
+    loadgen.add_argument("--clients", type=int, default=32)
+    loadgen.add_argument("--requests", type=int, default=20000)
+    loadgen.add_argument("--k", type=int, default=10)
+    loadgen.add_argument("--select-ratio", type=float, default=0.1)
+    loadgen.add_argument("--decrypt", action="store_true", help="decrypt suggestions as a real client would")
+
+    args = parser.parse_args()
+    if args.command == "serve" and args.data_dir and args.mmap:
+        parser.error("--data-dir keeps the trie in memory and cannot be combined with --mmap")
+    if args.command == "serve" and args.mmap_writable and not args.mmap:
+        parser.error("--mmap-writable needs --mmap")
+    if args.command == "serve":
+        try:
+            asyncio.run(serve(args))
+        except KeyboardInterrupt:
+            pass
+    else:
+        connect = {"path": args.socket} if args.socket else {"host": args.host, "port": args.port}
+        result = asyncio.run(load_test(connect, args.clients, args.requests, args.k, args.select_ratio,
+                                       predefined_words, args.decrypt))
+        print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,478 @@
+# EncryptedTrie split across worker processes by key range
+#
+# One EncryptedTrie lives in one process, so the GIL holds its lookups and
+# its RSA encryption to one core. ShardedEncryptedTrie keeps the same API in
+# front of one worker process per shard, each owning an EncryptedTrie of the
+# words in its key range: shard i holds the words w with
+# bounds[i - 1] <= w < bounds[i]. The ranges start as even splits of the
+# leading character; rebalance() moves them to the quantiles of the stored
+# words when one shard grows much larger than the average.
+#
+# A word, and a prefix whose words all fall in one range, goes to one shard.
+# A short prefix that spans ranges is sent to every shard it spans; each
+# answers its own top k with frequencies and the lists are merged. Inserts
+# (encrypted in the worker), frequency increments and deletes are sent
+# without waiting for an answer, so the shards work through them in
+# parallel; a shard handles its messages in order, so a later lookup sees
+# them. All shards share one cipher backend, so one client decipher reads
+# every suggestion.
+#
+# The front end may be used from several threads: each shard's pipe has a
+# lock, and a fan-out takes the locks of its shards in shard order.
+import heapq
+import multiprocessing
+import os
+import string
+from bisect import bisect_left, bisect_right
+from collections import deque
+from itertools import islice
+from operator import itemgetter
+from threading import Lock
+
+from ciphers import RSAOAEPBackend, encrypt_chunks
+from search import INSERT_CHUNK_SIZE, TOP_K_CACHE_SIZE, EncryptedTrie
+
+# Inserts routed between two checks of the shard sizes
+REBALANCE_INTERVAL = 10000
+
+# A shard this many times the average size triggers a rebalance
+REBALANCE_RATIO = 2.0
+
+# Smallest largest-shard size worth rebalancing for
+REBALANCE_MIN_WORDS = 1000
+
+# Words each shard samples to place the new boundaries
+SAMPLE_SIZE = 1024
+
+# Prefixes of a batch sent before their answers are read; more could fill
+# the pipes both ways and leave the front end and a worker waiting on each other
+BATCH_WINDOW = 64
+
+# Characters the initial ranges split evenly
+INITIAL_ALPHABET = string.ascii_lowercase
+
+
+class ShardError(RuntimeError):
+    pass
+
+
+class ShardedEncryptedTrie:
+    def __init__(self, public_key, decipher, top_k_size=TOP_K_CACHE_SIZE, backend=None, shards=None,
+                 rebalance_interval=REBALANCE_INTERVAL):
+        self.public_key = public_key
+        self.backend = backend if backend is not None else RSAOAEPBackend(public_key)
+        self._private_decipher = decipher
+        self._decipher = None
+        self.top_k_size = top_k_size
+        self.rebalance_interval = rebalance_interval
+        self.routed = 0  # Inserts since the last size check
+        self.rebalances = 0
+        count = shards or os.cpu_count() or 1
+        self.bounds = [INITIAL_ALPHABET[len(INITIAL_ALPHABET) * i // count] for i in range(1, count)]
+        self.shards = []
+        for index in range(count):
+            connection, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_serve_shard, args=(child, public_key, self.backend, top_k_size),
+                                              name=f"trie-shard-{index}", daemon=True)
+            process.start()
+            child.close()
+            self.shards.append(Shard(process, connection))
+
+    @property
+    def decipher(self):
+        if self._decipher is None:
+            self._decipher = self.backend.client_decipher(self._private_decipher)
+        return self._decipher
+
+    def decrypt_word(self, encrypted_word):
+        return self.decipher.decrypt(encrypted_word).decode()
+
+    # Updates: sent without waiting
+
+    def insert_encrypted(self, word):
+        self._send_routed(word, "insert", [word])
+        self._routed(1)
+
+    def insert_many_encrypted(self, words, workers=None, chunk_size=INSERT_CHUNK_SIZE):
+        # Returns the number of words inserted
+        return self.insert_corpus(((word, 0) for word in words), workers, chunk_size)
+
+    def insert_corpus(self, pairs, workers=None, chunk_size=INSERT_CHUNK_SIZE):
+        # (word, count) pairs as for EncryptedTrie.insert_corpus, grouped per
+        # shard. By default every shard encrypts its own new words, so the
+        # shards encrypt at once; with workers, the words are encrypted here by
+        # that many processes (as EncryptedTrie does) and the shards only
+        # store them. Returns the number of words inserted
+        before = sum(self.sizes())
+        routed = 0
+        if workers is None:
+            pairs = iter(pairs)
+            while True:
+                block = list(islice(pairs, chunk_size * len(self.shards)))
+                if not block:
+                    break
+                self._send_grouped("corpus", block, chunk_size, key=itemgetter(0))
+                routed += len(block)
+        else:
+            counts = deque()
+            for chunk, encrypted_words in encrypt_chunks(self.backend, _corpus_chunks(pairs, chunk_size, counts),
+                                                         workers):
+                chunk_counts, repeats = counts.popleft()
+                items = list(zip(chunk, encrypted_words, chunk_counts))
+                items.extend((word, None, count) for word, count in repeats)
+                self._send_grouped("import", items, key=itemgetter(0))
+                routed += len(chunk)
+        inserted = sum(self.sizes()) - before  # Waits for every shard to finish
+        self._routed(routed)
+        return inserted
+
+    def increase_word_frequency(self, word, amount=1):
+        self._send_routed(word, "increase", word, amount)
+
+    def delete(self, word):
+        return self._send_routed(word, "delete", word, reply=True)
+
+    def delete_many(self, words):
+        # Returns the number of words that were stored and are now removed
+        return sum(self._send_grouped("delete_many", list(words), reply=True))
+
+    # Lookups
+
+    def autocomplete_encrypted(self, prefix, k=None):
+        return [encrypted_word for encrypted_word, _ in self._fan_out(prefix, "ranked", prefix, k)]
+
+    def autocomplete_encrypted_batch(self, prefixes, k=10):
+        # autocomplete_encrypted(prefix, k) for many prefixes. Requests are
+        # sent BATCH_WINDOW prefixes ahead of the answers, so all shards work at once
+        prefixes = list(prefixes)
+        results = []
+        with self._locked(range(len(self.shards))):
+            for start in range(0, len(prefixes), BATCH_WINDOW):
+                window = [(prefix, self._spanned(prefix, self.bounds)) for prefix in prefixes[start:start + BATCH_WINDOW]]
+                for prefix, span in window:
+                    for index in span:
+                        self.shards[index].send_locked("ranked", prefix, k, reply=True)
+                for _, span in window:
+                    lists = [self.shards[index].receive() for index in span]
+                    results.append([encrypted_word for encrypted_word, _ in _merge_ranked(lists, k)])
+        return results
+
+    def top_k(self, k):
+        return [encrypted_word for encrypted_word, _ in self._fan_out(None, "top_k", k)]
+
+    def sizes(self):
+        # Words stored in each shard, once its pending messages are handled
+        return self._call_all("size")
+
+    # Rebalancing
+
+    def rebalance(self):
+        # Move the boundaries to the quantiles of the stored words and ship
+        # the words that change shard, ciphertexts and frequencies included:
+        # nothing is re-encrypted. Returns the number of words moved
+        with self._locked(range(len(self.shards))):
+            samples = []
+            for shard in self.shards:
+                shard.send_locked("sample", SAMPLE_SIZE, reply=True)
+            for shard in self.shards:
+                size, sample = shard.receive()
+                weight = size / len(sample) if sample else 0
+                samples.extend((word, weight) for word in sample)
+            bounds = _quantile_bounds(sorted(samples), len(self.shards))
+            if bounds == self.bounds:
+                return 0
+            ranges = list(zip([None] + bounds, bounds + [None]))
+            for shard, (low, high) in zip(self.shards, ranges):
+                shard.send_locked("export", low, high, reply=True)
+            moving = [[] for _ in self.shards]
+            for shard in self.shards:
+                for item in shard.receive():
+                    moving[bisect_right(bounds, item[0])].append(item)
+            for shard, items in zip(self.shards, moving):
+                if items:
+                    shard.send_locked("import", items)
+            self.bounds = bounds
+            self.rebalances += 1
+            return sum(len(items) for items in moving)
+
+    def _routed(self, count):
+        # Check the sizes every rebalance_interval routed inserts
+        self.routed += count
+        if not self.rebalance_interval or self.routed < self.rebalance_interval:
+            return
+        self.routed = 0
+        sizes = self.sizes()
+        largest = max(sizes)
+        if largest >= REBALANCE_MIN_WORDS and largest > REBALANCE_RATIO * sum(sizes) / len(sizes):
+            self.rebalance()
+
+    # Lifetime
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+        self.shards = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Routing. rebalance() moves words and swaps in a new bounds list while
+    # holding every shard's lock, so a message routed by bounds that are
+    # still self.bounds once its shards' locks are held goes to the right
+    # shard; otherwise it is routed again
+
+    def _send_routed(self, word, operation, *args, reply=False):
+        while True:
+            bounds = self.bounds
+            shard = self.shards[bisect_right(bounds, word)]
+            with shard.lock:
+                if self.bounds is bounds:
+                    shard.send_locked(operation, *args, reply=reply)
+                    return shard.receive() if reply else None
+
+    def _send_grouped(self, operation, items, *args, key=None, reply=False):
+        # Send each shard its share of items in one message; with reply,
+        # returns the answers of the shards that got one
+        while True:
+            bounds = self.bounds
+            groups = [[] for _ in self.shards]
+            for item in items:
+                groups[bisect_right(bounds, item if key is None else key(item))].append(item)
+            span = [index for index, group in enumerate(groups) if group]
+            with self._locked(span):
+                if self.bounds is not bounds:
+                    continue
+                for index in span:
+                    self.shards[index].send_locked(operation, groups[index], *args, reply=reply)
+                return [self.shards[index].receive() for index in span] if reply else None
+
+    def _spanned(self, prefix, bounds):
+        # Shards holding words that start with prefix: from the prefix's own
+        # shard up to the shard of the last string starting with it
+        first = bisect_right(bounds, prefix)
+        successor = _successor(prefix)
+        last = len(self.shards) - 1 if successor is None else bisect_left(bounds, successor)
+        return range(first, last + 1)
+
+    def _fan_out(self, prefix, operation, *args):
+        # Ask every shard holding words under prefix (all of them for None),
+        # then merge their ranked (ciphertext, frequency) lists
+        k = args[-1]
+        while True:
+            bounds = self.bounds
+            span = range(len(self.shards)) if prefix is None else self._spanned(prefix, bounds)
+            with self._locked(span):
+                if self.bounds is not bounds:
+                    continue
+                for index in span:
+                    self.shards[index].send_locked(operation, *args, reply=True)
+                lists = [self.shards[index].receive() for index in span]
+            return _merge_ranked(lists, k)
+
+    def _call_all(self, operation, *args):
+        with self._locked(range(len(self.shards))):
+            for shard in self.shards:
+                shard.send_locked(operation, *args, reply=True)
+            return [shard.receive() for shard in self.shards]
+
+    def _locked(self, span):
+        return _Locks([self.shards[index].lock for index in span])
+
+
+class Shard:
+    # The front end's end of one worker's pipe
+    def __init__(self, process, connection):
+        self.process = process
+        self.connection = connection
+        self.lock = Lock()
+
+    def send_locked(self, operation, *args, reply=False):
+        self.connection.send((operation, args, reply))
+
+    def receive(self):
+        ok, value = self.connection.recv()
+        if not ok:
+            raise ShardError(f"{self.process.name}: {value}")
+        return value
+
+    def close(self):
+        with self.lock:
+            try:
+                self.connection.send(("close", (), False))
+            except (BrokenPipeError, OSError):
+                pass
+            self.connection.close()
+        self.process.join()
+
+
+class _Locks:
+    # Several locks taken in the given order and released together
+    def __init__(self, locks):
+        self.locks = locks
+
+    def __enter__(self):
+        for lock in self.locks:
+            lock.acquire()
+
+    def __exit__(self, *exc_info):
+        for lock in reversed(self.locks):
+            lock.release()
+
+
+def _merge_ranked(lists, k):
+    # Merge lists of (ciphertext, frequency), each most frequent first
+    if len(lists) == 1:
+        return lists[0]
+    merged = heapq.merge(*lists, key=lambda item: -item[1])
+    return list(merged if k is None else islice(merged, k))
+
+
+def _corpus_chunks(pairs, chunk_size, counts):
+    # Chunks of first-seen words to encrypt. For each chunk, counts gets the
+    # counts of its words and the (word, count) repeats met while it filled
+    seen = set()
+    chunk, chunk_counts, repeats = [], [], []
+    for word, count in pairs:
+        if word in seen:
+            repeats.append((word, count))
+            continue
+        seen.add(word)
+        chunk.append(word)
+        chunk_counts.append(count)
+        if len(chunk) == chunk_size:
+            counts.append((chunk_counts, repeats))
+            yield chunk
+            chunk, chunk_counts, repeats = [], [], []
+    if chunk or repeats:
+        counts.append((chunk_counts, repeats))
+        yield chunk
+
+
+def _successor(prefix):
+    # Smallest string above every string starting with prefix, or None
+    stem = prefix.rstrip(chr(0x10FFFF))
+    if not stem:
+        return None
+    return stem[:-1] + chr(ord(stem[-1]) + 1)
+
+
+def _quantile_bounds(samples, count):
+    # count - 1 boundaries splitting the weighted, sorted (word, weight)
+    # samples into equal weight. Each boundary is cut to the shortest prefix
+    # of its word that still sorts above the word before it
+    total = sum(weight for _, weight in samples)
+    if not samples or not total:
+        return [INITIAL_ALPHABET[len(INITIAL_ALPHABET) * i // count] for i in range(1, count)]
+    bounds = []
+    seen = 0
+    position = 0
+    for i in range(1, count):
+        target = total * i / count
+        while position < len(samples) - 1 and seen + samples[position][1] <= target:
+            seen += samples[position][1]
+            position += 1
+        word = samples[position][0]
+        previous = samples[position - 1][0] if position else ""
+        cut = 1
+        while word[:cut] <= previous:
+            cut += 1
+        bound = word[:cut]
+        if bounds and bound <= bounds[-1]:
+            bound = bounds[-1] + "\0"  # Keep the boundaries strictly increasing
+        bounds.append(bound)
+    return bounds
+
+
+# Worker side
+
+def _serve_shard(connection, public_key, backend, top_k_size):
+    # Worker process: apply messages to this shard's trie until "close". A
+    # failed one-way message is reported on the next answer
+    trie = EncryptedTrie(public_key, None, top_k_size, backend)
+    failure = None
+    while True:
+        try:
+            operation, args, reply = connection.recv()
+        except EOFError:
+            return
+        if operation == "close":
+            return
+        try:
+            result = SHARD_OPERATIONS[operation](trie, *args)
+        except Exception as error:
+            message = f"{operation}: {error!r}"
+            if reply:
+                connection.send((False, failure or message))
+                failure = None
+            else:
+                failure = failure or message
+            continue
+        if reply:
+            if failure is not None:
+                connection.send((False, failure))
+                failure = None
+            else:
+                connection.send((True, result))
+
+
+def _ranked(trie, prefix, k):
+    node, _ = trie._locate(prefix)
+    if not node:
+        return []
+    return _with_frequencies(trie._iter_ranked([node]), k)
+
+
+def _top_k(trie, k):
+    return _with_frequencies(trie._iter_ranked([trie.root]), k)
+
+
+def _with_frequencies(nodes, k):
+    return [(node.encrypted_word, node.frequency) for node in (nodes if k is None else islice(nodes, k))]
+
+
+def _sample(trie, size):
+    # (word count, every n-th word in sorted order)
+    words = sorted(word for word, _ in trie._iter_words(trie.root, ""))
+    step = max(1, len(words) // size)
+    return len(words), words[step // 2::step]
+
+
+def _export(trie, low, high):
+    # Remove and return (word, ciphertext, frequency) for the words outside
+    # [low, high); None is an open end
+    buffer = [""]
+    items = []
+    for node in trie._walk(trie.root, buffer):
+        if node.is_end_of_word:
+            word = "".join(buffer)
+            if (low is not None and word < low) or (high is not None and word >= high):
+                items.append((word, node.encrypted_word, node.frequency))
+    trie.delete_many(word for word, _, _ in items)
+    return items
+
+
+def _import(trie, items):
+    # (word, ciphertext, frequency); a ciphertext of None only adds the frequency
+    for word, encrypted_word, frequency in items:
+        if encrypted_word is not None and not trie._contains(word):
+            trie._store_encrypted(word, encrypted_word)
+        if frequency:
+            trie.increase_word_frequency(word, frequency)
+
+
+SHARD_OPERATIONS = {
+    "insert": lambda trie, words: trie.insert_many_encrypted(words),
+    "corpus": lambda trie, pairs, chunk_size: trie._insert_corpus_words(pairs, None, chunk_size),
+    "increase": lambda trie, word, amount: trie.increase_word_frequency(word, amount),
+    "delete": lambda trie, word: trie.delete(word),
+    "delete_many": lambda trie, words: trie.delete_many(words),
+    "ranked": _ranked,
+    "top_k": _top_k,
+    "size": lambda trie: len(trie.frequency_index),
+    "sample": _sample,
+    "export": _export,
+    "import": _import,
+}
@@ -0,0 +1,378 @@
+# Binary snapshot format for EncryptedTrie
+#
+# A snapshot holds the node table, the ciphertexts, the learned frequencies
+# and the cached top-k lists in flat arrays, so it can be memory-mapped and
+# used in place: opening it reads only the metadata, pages are loaded when a
+# query touches them, and processes mapping the same file share the page
+# cache. No word is re-encrypted.
+#
+# Layout:
+#   8 bytes   MAGIC
+#   4 bytes   metadata length (little-endian), then the metadata as UTF-8 JSON
+#   sections, 8-byte aligned, listed in metadata["sections"] as
+#   [name, typecode, offset from the end of the header, item count]:
+#       first_edge   I  nodes + 1  CSR offsets of each node's edges
+#       edge_char    I  edges      code point on each edge, ascending per node
+#       edge_child   I  edges      node each edge leads to
+#       node_word    i  nodes      word id ending at the node, or -1
+#       top_offset   I  nodes + 1  CSR offsets of each node's top-k list
+#       top_words    I  ...        cached top-k word ids, best first
+#       frequency    Q  words      learned frequency of each word
+#       ct_offset    Q  words + 1  offsets of each word's ciphertext
+#       ciphertexts  B  ...        concatenated ciphertexts
+# Arrays are in the writer's byte order, recorded in the metadata. Nodes are
+# numbered breadth-first, so node 0 is the root.
+import base64
+import heapq
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
+from Crypto.Cipher import PKCS1_OAEP
+from Crypto.PublicKey import RSA
+from Crypto.Random import get_random_bytes
+
+from ciphers import open_backend
+from keys import default_keys
+
+MAGIC = b"ETRIESN1"
+FORMAT_VERSION = 1
+ALIGNMENT = 8
+
+
+def write_snapshot(trie, path):
+    # Number nodes breadth-first, with each node's edges sorted by character
+    nodes = [trie.root]
+    first_edge = array("I", [0])
+    edge_char = array("I")
+    edge_child = array("I")
+    for node in nodes:  # nodes grows while it is walked
+        for char in sorted(node.children):
+            child = node.children[char]
+            if len(trie._edge_label(char, child)) != 1:
+                raise TypeError("snapshots store one character per edge; radix tries are not supported")
+            edge_char.append(ord(char))
+            edge_child.append(len(nodes))
+            nodes.append(child)
+        first_edge.append(len(edge_char))
+
+    word_ids = {}
+    node_word = array("i")
+    frequency = array("Q")
+    ct_offset = array("Q", [0])
+    ciphertexts = bytearray()
+    for node in nodes:
+        if node.is_end_of_word:
+            word_ids[node] = len(frequency)
+            node_word.append(len(frequency))
+            frequency.append(node.frequency)
+            ciphertexts += node.encrypted_word or b""
+            ct_offset.append(len(ciphertexts))
+        else:
+            node_word.append(-1)
+
+    top_offset = array("I", [0])
+    top_words = array("I")
+    for node in nodes:
+        top_words.extend(word_ids[word_node] for word_node in node.top_k)
+        top_offset.append(len(top_words))
+
+    sections = [
+        ("first_edge", first_edge), ("edge_char", edge_char), ("edge_child", edge_child),
+        ("node_word", node_word), ("top_offset", top_offset), ("top_words", top_words),
+        ("frequency", frequency), ("ct_offset", ct_offset), ("ciphertexts", array("B", ciphertexts)),
+    ]
+    table = []
+    offset = 0
+    for name, values in sections:
+        table.append([name, values.typecode, offset, len(values)])
+        offset = _align(offset + len(values) * values.itemsize)
+
+    backend = trie.backend
+    metadata = {
+        "version": FORMAT_VERSION,
+        "byteorder": sys.byteorder,
+        "node_count": len(nodes),
+        "word_count": len(frequency),
+        "top_k_size": trie.top_k_size,
+        "backend": backend.name,
+        "public_key": base64.b64encode(backend.public_key.export_key("DER")).decode(),
+        "wrapped_key": base64.b64encode(backend.wrapped_key).decode() if backend.wrapped_key else None,
+        "sections": table,
+    }
+    encoded = json.dumps(metadata).encode()
+    header = MAGIC + struct.pack("<I", len(encoded)) + encoded
+
+    # Write next to the target and rename, so readers never see a partial file
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as snapshot_file:
+        snapshot_file.write(header + bytes(_align(len(header)) - len(header)))
+        for name, values in sections:
+            data = values.tobytes()
+            snapshot_file.write(data + bytes(_align(len(data)) - len(data)))
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+    os.replace(temp_path, path)
+
+
+def read_snapshot(path, use_mmap=False, writable=False):
+    # Return (metadata, sections, mapping). sections maps each name to a typed
+    # memoryview; with use_mmap they point into the mapping instead of a copy.
+    # A writable mapping writes changes back to the file; otherwise changes
+    # stay private to this process
+    with open(path, "r+b" if writable else "rb") as snapshot_file:
+        if use_mmap:
+            access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_COPY
+            mapping = mmap.mmap(snapshot_file.fileno(), 0, access=access)
+            data = memoryview(mapping)
+        else:
+            mapping = None
+            data = memoryview(bytearray(snapshot_file.read()))
+
+    if bytes(data[:len(MAGIC)]) != MAGIC:
+        raise ValueError(f"{path} is not an EncryptedTrie snapshot")
+    (length,) = struct.unpack_from("<I", data, len(MAGIC))
+    start = len(MAGIC) + 4
+    metadata = json.loads(bytes(data[start:start + length]))
+    if metadata["version"] != FORMAT_VERSION:
+        raise ValueError(f"unsupported snapshot version {metadata['version']}")
+    if metadata["byteorder"] != sys.byteorder:
+        raise ValueError(f"snapshot was written on a {metadata['byteorder']}-endian machine")
+
+    base = _align(start + length)
+    sections = {}
+    for name, typecode, offset, count in metadata["sections"]:
+        itemsize = array(typecode).itemsize
+        sections[name] = data[base + offset:base + offset + count * itemsize].cast(typecode)
+    return metadata, sections, mapping
+
+
+def open_snapshot_backend(metadata, decipher):
+    public_key = RSA.import_key(base64.b64decode(metadata["public_key"]))
+    wrapped_key = metadata["wrapped_key"]
+    wrapped_key = base64.b64decode(wrapped_key) if wrapped_key else None
+    return open_backend(metadata["backend"], public_key, wrapped_key, decipher)
+
+
+def check_snapshot_key(metadata, decipher):
+    # The data key (or, for RSA-OAEP, every word) was encrypted for the RSA
+    # key that wrote the snapshot, and another key fails with an opaque OAEP
+    # error much later. A probe encrypted for the snapshot's public key tells
+    # the two apart up front
+    probe = get_random_bytes(16)
+    public_key = RSA.import_key(base64.b64decode(metadata["public_key"]))
+    try:
+        matches = decipher.decrypt(PKCS1_OAEP.new(public_key).encrypt(probe)) == probe
+    except ValueError:
+        matches = False
+    if not matches:
+        raise ValueError("snapshot was written with a different key; open it with the key that wrote it "
+                         "(the TRIE_KEY_FILE file, or the decipher passed in)")
+
+
+def load_trie(trie_class, path, decipher=None):
+    # Rebuild a regular, fully mutable trie of trie_class from a snapshot
+    if decipher is None:
+        decipher = default_keys.decipher
+    metadata, sections, _ = read_snapshot(path)
+    check_snapshot_key(metadata, decipher)
+    backend = open_snapshot_backend(metadata, decipher)
+    trie = trie_class(backend.public_key, decipher, top_k_size=metadata["top_k_size"], backend=backend)
+
+    nodes = [trie.root] + [trie.node_class() for _ in range(metadata["node_count"] - 1)]
+    first_edge = sections["first_edge"]
+    edge_char = sections["edge_char"]
+    edge_child = sections["edge_child"]
+    for index, node in enumerate(nodes):
+        for edge in range(first_edge[index], first_edge[index + 1]):
+            node.children[chr(edge_char[edge])] = nodes[edge_child[edge]]
+
+    word_nodes = [None] * metadata["word_count"]
+    frequency = sections["frequency"]
+    ct_offset = sections["ct_offset"]
+    ciphertexts = sections["ciphertexts"]
+    for node, word in zip(nodes, sections["node_word"]):
+        if word >= 0:
+            node.is_end_of_word = True
+            node.encrypted_word = bytes(ciphertexts[ct_offset[word]:ct_offset[word + 1]])
+            node.frequency = frequency[word]
+            word_nodes[word] = node
+
+    top_offset = sections["top_offset"]
+    top_words = sections["top_words"]
+    for index, node in enumerate(nodes):
+        node.top_k = tuple(word_nodes[word] for word in top_words[top_offset[index]:top_offset[index + 1]])
+    trie.frequency_index.rebuild(word_nodes)
+    return trie
+
+
+class MappedEncryptedTrie:
+    # EncryptedTrie query API served straight from a memory-mapped snapshot.
+    # Nodes are integers into the flat arrays. Frequencies and top-k lists are
+    # updated in place; the shape of the trie is fixed, so words cannot be
+    # added or removed (load with mmap=False for that)
+    def __init__(self, path, decipher=None, writable=False):
+        self.path = path
+        self.metadata, self.sections, self.mapping = read_snapshot(path, use_mmap=True, writable=writable)
+        self.top_k_size = self.metadata["top_k_size"]
+        self._private_decipher = decipher
+        self._decipher = None
+        self.backend = open_snapshot_backend(self.metadata, decipher)
+        self.public_key = self.backend.public_key
+        for name, section in self.sections.items():
+            setattr(self, name, section)
+
+    @property
+    def decipher(self):
+        if self._decipher is None:
+            private_decipher = self._private_decipher
+            if private_decipher is None:
+                private_decipher = default_keys.decipher
+            check_snapshot_key(self.metadata, private_decipher)
+            self._decipher = self.backend.client_decipher(private_decipher)
+        return self._decipher
+
+    def decrypt_word(self, encrypted_word):
+        return self.decipher.decrypt(encrypted_word).decode()
+
+    def search(self, prefix):
+        node = 0
+        for char in prefix:
+            node = self._child(node, char)
+            if node is None:
+                return None
+        return node
+
+    def autocomplete(self, prefix):
+        return list(self.iter_autocomplete(prefix))
+
+    def iter_autocomplete(self, prefix):
+        node = self.search(prefix)
+        if node is None:
+            return
+        buffer = [prefix]
+        for node in self._walk(node, buffer):
+            word = self.node_word[node]
+            if word >= 0:
+                yield "".join(buffer), self.frequency[word]
+
+    def iter_autocomplete_encrypted(self, prefix):
+        node = self.search(prefix)
+        if node is None:
+            return
+        for node in self._walk(node):
+            word = self.node_word[node]
+            if word >= 0:
+                yield self._ciphertext(word), self.frequency[word]
+
+    def autocomplete_encrypted(self, prefix, k=None):
+        node = self.search(prefix)
+        if node is None:
+            return []
+        if k is not None and k <= self.top_k_size:
+            start = self.top_offset[node]
+            end = min(self.top_offset[node + 1], start + k)
+            return [self._ciphertext(word) for word in self.top_words[start:end]]
+
+        words = [self.node_word[n] for n in self._walk(node) if self.node_word[n] >= 0]
+        if k is not None:
+            words = heapq.nlargest(k, words, key=self.frequency.__getitem__)
+        else:
+            words.sort(key=self.frequency.__getitem__, reverse=True)
+        return [self._ciphertext(word) for word in words]
+
+    def sizes(self):
+        # Fixed at write time: the shape of a mapped trie never changes
+        return {"words": self.metadata["word_count"], "nodes": self.metadata["node_count"]}
+
+    def top_k(self, k):
+        if k <= self.top_k_size:
+            return self.autocomplete_encrypted("", k)
+        words = heapq.nlargest(k, range(len(self.frequency)), key=self.frequency.__getitem__)
+        return [self._ciphertext(word) for word in words]
+
+    def increase_word_frequency(self, word, amount=1):
+        path = self._path(word)
+        if path is None or self.node_word[path[-1]] < 0:
+            return
+        word_id = self.node_word[path[-1]]
+        self.frequency[word_id] += amount
+        frequency = self.frequency
+        for node in reversed(path):
+            start, end = self.top_offset[node], self.top_offset[node + 1]
+            ranked = list(self.top_words[start:end])
+            if word_id not in ranked:
+                # A list shorter than top_k_size already holds its whole subtree,
+                # so the word can only take the place of the last entry
+                if not ranked or frequency[word_id] <= frequency[ranked[-1]]:
+                    break
+                ranked[-1] = word_id
+            ranked.sort(key=frequency.__getitem__, reverse=True)
+            self.top_words[start:end] = array("I", ranked)
+
+    def insert_encrypted(self, word):
+        raise TypeError("a memory-mapped snapshot has a fixed shape; load it with mmap=False to insert words")
+
+    def delete(self, word):
+        raise TypeError("a memory-mapped snapshot has a fixed shape; load it with mmap=False to delete words")
+
+    def flush(self):
+        # Write frequency changes of a writable mapping back to the file
+        self.mapping.flush()
+
+    def close(self):
+        for name in list(self.sections):
+            delattr(self, name)
+            self.sections[name].release()
+        self.sections = {}
+        self.mapping.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _child(self, node, char):
+        start, end = self.first_edge[node], self.first_edge[node + 1]
+        code = ord(char)
+        edge = bisect_left(self.edge_char, code, start, end)
+        if edge < end and self.edge_char[edge] == code:
+            return self.edge_child[edge]
+        return None
+
+    def _path(self, word):
+        node = 0
+        path = [node]
+        for char in word:
+            node = self._child(node, char)
+            if node is None:
+                return None
+            path.append(node)
+        return path
+
+    def _walk(self, node, buffer=None):
+        # Same traversal as Trie._walk, over node numbers
+        first_edge, edge_char, edge_child = self.first_edge, self.edge_char, self.edge_child
+        stack = [(node, None if buffer is None else len(buffer), None)]
+        while stack:
+            node, depth, label = stack.pop()
+            if buffer is not None:
+                del buffer[depth:]
+                if label is not None:
+                    buffer.append(label)
+                depth = len(buffer)
+            yield node
+            for edge in range(first_edge[node + 1] - 1, first_edge[node] - 1, -1):
+                stack.append((edge_child[edge], depth, chr(edge_char[edge])))
+
+    def _ciphertext(self, word):
+        return bytes(self.ciphertexts[self.ct_offset[word]:self.ct_offset[word + 1]])
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
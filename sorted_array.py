@@ -0,0 +1,235 @@
+# Sorted-array autocomplete engine for read-mostly workloads
+#
+# The trie engines follow one pointer per prefix character and then walk a
+# subtree, touching objects spread all over the heap. Here the vocabulary is
+# a single lexicographically sorted list: the words starting with a prefix
+# are one contiguous range, found with two binary searches, and their
+# frequencies are one slice of a NumPy array, so the top k of the range is
+# picked by a vectorized argpartition instead of a walk. Ciphertexts sit in
+# a list parallel to the words.
+#
+# Lookups are the fast path. Inserted words wait in a small pending dict and
+# are merged into the sorted arrays in one pass before the next lookup, so a
+# run of inserts costs one merge; a delete rewrites the arrays. Frequency
+# increments are in place.
+from bisect import bisect_left
+from itertools import compress
+
+import numpy as np
+
+from ciphers import RSAOAEPBackend, encrypt_chunks
+from search import INSERT_CHUNK_SIZE
+
+# Ranges up to this size are fully sorted: for short ranges one argsort is
+# cheaper than argpartition followed by sorting the k it picked
+PARTITION_THRESHOLD = 256
+
+# Largest code point; a prefix made only of it has no successor string
+MAX_CHAR = chr(0x10FFFF)
+
+
+class SortedArrayTrie:
+    def __init__(self):
+        self.words = []  # Sorted
+        self.frequency = np.zeros(0, dtype=np.int64)  # frequency[i] belongs to words[i]
+        self.ciphertexts = []  # ciphertexts[i] belongs to words[i]; None for plain inserts
+        self.pending = {}  # word -> [frequency, ciphertext], inserted since the last merge
+        self.generation = 0  # Bumped on every change, like Trie.generation
+
+    def __len__(self):
+        return len(self.words) + len(self.pending)
+
+    def insert(self, word):
+        if not self._contains(word):
+            self.pending[word] = [0, None]
+            self.generation += 1
+
+    def delete(self, word):
+        return self.delete_many([word]) == 1
+
+    def delete_many(self, words):
+        # One pass over the arrays however many words go. Returns the number removed
+        words = set(words)
+        removed = sum(1 for word in words if self.pending.pop(word, None) is not None)
+        self._merge()
+        drop = [index for index in map(self._index, words) if index is not None]
+        if drop:
+            keep = np.ones(len(self.words), dtype=bool)
+            keep[drop] = False
+            mask = keep.tolist()
+            self.words = list(compress(self.words, mask))
+            self.ciphertexts = list(compress(self.ciphertexts, mask))
+            self.frequency = self.frequency[keep]
+        if removed or drop:
+            self.generation += 1
+        return removed + len(drop)
+
+    def autocomplete(self, prefix):
+        return list(self.iter_autocomplete(prefix))
+
+    def iter_autocomplete(self, prefix):
+        # (word, frequency) for every word starting with prefix, in sorted order
+        lo, hi = self._range(prefix)
+        yield from zip(self.words[lo:hi], self.frequency[lo:hi].tolist())
+
+    def autocomplete_batch(self, prefixes, k=10):
+        # The k most frequent (word, frequency) for each prefix, in one call.
+        # Repeated prefixes are answered once
+        self._merge()
+        words = self.words
+        frequency = self.frequency
+        answers = {}
+        for prefix in prefixes:
+            if prefix not in answers:
+                indices = self._ranked(*self._range(prefix), k).tolist()
+                answers[prefix] = list(zip([words[i] for i in indices], frequency[indices].tolist()))
+        return [answers[prefix] for prefix in prefixes]
+
+    def increase_word_frequency(self, word, amount=1):
+        entry = self.pending.get(word)
+        if entry is not None:
+            entry[0] += amount
+        else:
+            index = self._index(word)
+            if index is None:
+                return
+            self.frequency[index] += amount
+        self.generation += 1
+
+    def _range(self, prefix):
+        # [lo, hi) of the words starting with prefix
+        self._merge()
+        words = self.words
+        lo = bisect_left(words, prefix)
+        # Every word with the prefix sorts below the prefix's successor: the
+        # prefix with its last character not MAX_CHAR bumped by one
+        stem = prefix.rstrip(MAX_CHAR)
+        if not stem:
+            return lo, len(words)
+        return lo, bisect_left(words, stem[:-1] + chr(ord(stem[-1]) + 1), lo)
+
+    def _ranked(self, lo, hi, k=None):
+        # Indices of words[lo:hi], most frequent first (ties in word order);
+        # in a long range only the best k are sorted
+        if k is not None and k <= 0:
+            return np.zeros(0, dtype=np.intp)
+        frequency = self.frequency[lo:hi]
+        if k is not None and k < hi - lo and hi - lo > PARTITION_THRESHOLD:
+            # argpartition picks an arbitrary k among words tied with the k-th
+            # frequency: keep every word above it and the first tied ones
+            kth = -np.partition(-frequency, k - 1)[k - 1]
+            above = np.flatnonzero(frequency > kth)
+            tied = np.flatnonzero(frequency == kth)[:k - len(above)]
+            best = np.concatenate((above, tied))
+            order = best[np.lexsort((best, -frequency[best]))]
+        else:
+            order = np.argsort(-frequency, kind="stable")[:k]
+        return order + lo
+
+    def _index(self, word):
+        # Position of word in the merged arrays, or None
+        index = bisect_left(self.words, word)
+        if index < len(self.words) and self.words[index] == word:
+            return index
+        return None
+
+    def _contains(self, word):
+        return word in self.pending or self._index(word) is not None
+
+    def _merge(self):
+        # Merge the pending words into the sorted arrays in one pass
+        if not self.pending:
+            return
+        new = sorted(self.pending)
+        positions = [bisect_left(self.words, word) for word in new]  # Nondecreasing
+        words = []
+        ciphertexts = []
+        start = 0
+        for position, word in zip(positions, new):
+            words.extend(self.words[start:position])
+            ciphertexts.extend(self.ciphertexts[start:position])
+            words.append(word)
+            ciphertexts.append(self.pending[word][1])
+            start = position
+        words.extend(self.words[start:])
+        ciphertexts.extend(self.ciphertexts[start:])
+        self.frequency = np.insert(self.frequency, positions, [self.pending[word][0] for word in new])
+        self.words = words
+        self.ciphertexts = ciphertexts
+        self.pending = {}
+
+
+class SortedArrayEncryptedTrie(SortedArrayTrie):
+    # The EncryptedTrie API over the sorted arrays
+    def __init__(self, public_key, decipher, backend=None):
+        super().__init__()
+        self.public_key = public_key
+        self.backend = backend if backend is not None else RSAOAEPBackend(public_key)
+        self._private_decipher = decipher
+        self._decipher = None
+
+    @property
+    def decipher(self):
+        if self._decipher is None:
+            self._decipher = self.backend.client_decipher(self._private_decipher)
+        return self._decipher
+
+    def encrypt_word(self, word):
+        return self.backend.encrypt(word.encode())
+
+    def decrypt_word(self, encrypted_word):
+        return self.decipher.decrypt(encrypted_word).decode()
+
+    def insert_encrypted(self, word):
+        if not self._contains(word):
+            self.pending[word] = [0, self.encrypt_word(word)]
+            self.generation += 1
+
+    def insert_many_encrypted(self, words, workers=None, chunk_size=INSERT_CHUNK_SIZE):
+        return self.insert_corpus(((word, 0) for word in words), workers, chunk_size)
+
+    def insert_corpus(self, pairs, workers=None, chunk_size=INSERT_CHUNK_SIZE):
+        # (word, count) pairs as for EncryptedTrie.insert_corpus; the arrays
+        # are sorted once at the end, whatever the input order
+        counts = {}  # New word -> count, until its ciphertext is back
+        inserted = 0
+        for chunk, encrypted_words in encrypt_chunks(self.backend, self._new_word_chunks(pairs, chunk_size, counts),
+                                                     workers):
+            for word, encrypted_word in zip(chunk, encrypted_words):
+                self.pending[word] = [counts.pop(word), encrypted_word]
+            inserted += len(chunk)
+        self._merge()
+        self.generation += 1
+        return inserted
+
+    def _new_word_chunks(self, pairs, chunk_size, counts):
+        chunk = []
+        for word, count in pairs:
+            if word in counts:
+                counts[word] += count  # Still being encrypted
+            elif self._contains(word):
+                self.increase_word_frequency(word, count)
+            else:
+                counts[word] = count
+                chunk.append(word)
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+
+    def autocomplete_encrypted(self, prefix, k=None):
+        return [self.ciphertexts[i] for i in self._ranked(*self._range(prefix), k).tolist()]
+
+    def autocomplete_encrypted_batch(self, prefixes, k=10):
+        # autocomplete_encrypted(prefix, k) for each prefix, in one call
+        self._merge()
+        answers = {}
+        for prefix in prefixes:
+            if prefix not in answers:
+                answers[prefix] = [self.ciphertexts[i] for i in self._ranked(*self._range(prefix), k).tolist()]
+        return [answers[prefix] for prefix in prefixes]
+
+    def top_k(self, k):
+        self._merge()
+        return [self.ciphertexts[i] for i in self._ranked(0, len(self.words), k).tolist()]
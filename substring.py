@@ -0,0 +1,209 @@
+# Suffix array over the vocabulary for contains-matching
+#
+# The trie only finds words by their start, so "phone" never reaches
+# "smartphone". A SuffixArray joins words, sorted, into one string with a
+# separator after each word, and sorts the positions of every character of
+# every word by the rest of their word. The words containing a fragment are
+# then the owners of one contiguous run of positions, found with two binary
+# searches of O(len(fragment) log n) character comparisons each; they are
+# ranked by the frequency on their trie nodes, read at lookup time, so
+# frequency changes need no update.
+#
+# Memory: the joined text (one byte per character for Latin-1 words), and
+# two 4-byte arrays per character (suffix positions and the word each one
+# belongs to), plus each word's start and a pointer to its node.
+# nbytes() reports it.
+#
+# SubstringIndex keeps the vocabulary as a few suffix arrays (segments),
+# largest first. Words inserted after the build wait in a pending dict,
+# matched by scanning, until PENDING_LIMIT of them are indexed as a new
+# segment; a segment at least half the size of the one before it is merged
+# into it, so there are O(log n) segments and a word is re-indexed O(log n)
+# times. A deleted word is marked in its segment and dropped at the next
+# merge; once deleted words reach REBUILD_FRACTION of the indexed ones, the
+# index is rebuilt from the trie. Changes take the index's lock; a lookup
+# takes it only to read the segment list and scan the pending words, so it
+# sees one consistent state, even against a ConcurrentEncryptedTrie writer.
+import heapq
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+
+# Follows every word in the joined text. It sorts below every other
+# character, so a word sorts before the longer words it starts; words that
+# contain it are not indexed
+SEPARATOR = "\0"
+
+# Words inserted since the last segment was built, matched by scanning
+PENDING_LIMIT = 64
+
+# Deleted words, as a share of the indexed ones, that trigger a rebuild
+REBUILD_FRACTION = 0.1
+
+# Deleted words always tolerated before a rebuild, however small the vocabulary
+REBUILD_MIN = 256
+
+
+class SuffixArray:
+    # The immutable part of a SubstringIndex, built once from (word, node) pairs
+    def __init__(self, pairs):
+        pairs = sorted((word, node) for word, node in pairs if SEPARATOR not in word)
+        words = [word for word, _ in pairs]
+        self.nodes = [node for _, node in pairs]  # Word id -> node
+        text = self.text = SEPARATOR.join(words) + SEPARATOR
+        self.starts = array("i")  # starts[i] is where word i begins in text
+        position = 0
+        for word in words:
+            self.starts.append(position)
+            position += len(word) + 1
+        # Sorted one first character at a time, so only one bucket's sort
+        # keys (a copy of each suffix) are alive at once
+        buckets = {}
+        for start, word in zip(self.starts, words):
+            for position in range(start, start + len(word)):
+                buckets.setdefault(text[position], array("i")).append(position)
+        def suffix(position):
+            return text[position:text.index(SEPARATOR, position)]
+
+        suffixes = self.suffixes = array("i")
+        for char in sorted(buckets):
+            suffixes.extend(sorted(buckets.pop(char), key=suffix))
+        owner = array("i")  # Word id at every position of text
+        for word_id, word in enumerate(words):
+            owner.extend([word_id] * (len(word) + 1))
+        self.owners = array("i", map(owner.__getitem__, suffixes))
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def matches(self, fragment):
+        # Ids of the words containing fragment, in word order
+        if not fragment:
+            return range(len(self.nodes))  # The empty word too, which has no suffixes
+        length = len(fragment)
+        text = self.text
+
+        def key(position):
+            return text[position:position + length]
+
+        lo = bisect_left(self.suffixes, fragment, key=key)
+        hi = bisect_right(self.suffixes, fragment, lo, key=key)
+        # A word holding fragment more than once owns several positions
+        return sorted(set(self.owners[lo:hi]))
+
+    def word(self, word_id):
+        start = self.starts[word_id]
+        return self.text[start:self.text.index(SEPARATOR, start)]
+
+    def word_id(self, word):
+        # Word ids follow the sorted order of the words
+        index = bisect_left(range(len(self.nodes)), word, key=self.word)
+        if index < len(self.nodes) and self.word(index) == word:
+            return index
+        return None
+
+    def nbytes(self):
+        return sum(map(sys.getsizeof, (self.text, self.nodes, self.starts, self.suffixes, self.owners)))
+
+
+class SubstringIndex:
+    def __init__(self, trie):
+        self.trie = trie
+        self.lock = threading.Lock()
+        self.rebuilds = 0
+        self.merges = 0
+        self.rebuild()
+
+    def rebuild(self):
+        # Index every word of the trie from scratch
+        with self.lock:
+            self._rebuild()
+
+    def add(self, word, node):
+        # word was inserted as node
+        if SEPARATOR in word:
+            return
+        with self.lock:
+            self._discard(word)  # A word deleted and inserted again has a new node
+            self.pending[word] = node
+            if len(self.pending) >= PENDING_LIMIT:
+                self._index_pending()
+
+    def remove(self, word):
+        with self.lock:
+            self._discard(word)
+            if self.deleted > max(REBUILD_MIN, REBUILD_FRACTION * sum(len(segment) for segment, _ in self.segments)):
+                self._rebuild()
+
+    def search(self, fragment, k=None):
+        # Word nodes containing fragment, most frequent first (ties in word order)
+        with self.lock:
+            # The list is replaced, never changed; a segment's deleted ids only grow
+            segments = self.segments
+            pending = [node for word, node in self.pending.items() if fragment in word]
+        nodes = []
+        for segment, deleted in segments:
+            nodes.extend(segment.nodes[word_id] for word_id in segment.matches(fragment) if word_id not in deleted)
+        nodes.extend(pending)
+        if k is not None:
+            return heapq.nlargest(k, nodes, key=lambda n: n.frequency)
+        return sorted(nodes, key=lambda n: n.frequency, reverse=True)
+
+    def nbytes(self):
+        # Bytes held by the index itself; the nodes and ciphertexts belong to the trie
+        with self.lock:
+            return (sum(segment.nbytes() + sys.getsizeof(deleted) for segment, deleted in self.segments)
+                    + sys.getsizeof(self.pending))
+
+    def stats(self):
+        with self.lock:
+            indexed = sum(len(segment) for segment, _ in self.segments)
+            stats = {
+                "words": indexed - self.deleted + len(self.pending),
+                "suffixes": sum(len(segment.suffixes) for segment, _ in self.segments),
+                "segments": len(self.segments),
+                "pending": len(self.pending),
+                "deleted": self.deleted,
+                "merges": self.merges,
+                "rebuilds": self.rebuilds,
+            }
+        stats["bytes"] = self.nbytes()
+        return stats
+
+    # Callers hold self.lock
+
+    def _rebuild(self):
+        buffer = [""]
+        pairs = [("".join(buffer), node) for node in self.trie._walk(self.trie.root, buffer) if node.is_end_of_word]
+        self.segments = [(SuffixArray(pairs), set())]  # (suffix array, deleted word ids)
+        self.pending = {}  # Word -> node
+        self.deleted = 0
+        self.rebuilds += 1
+
+    def _discard(self, word):
+        # Drop word's entry, wherever it is
+        if self.pending.pop(word, None) is not None:
+            return
+        for segment, deleted in self.segments:
+            word_id = segment.word_id(word)
+            if word_id is not None and word_id not in deleted:
+                deleted.add(word_id)
+                self.deleted += 1
+                return
+
+    def _index_pending(self):
+        segments = self.segments + [(SuffixArray(self.pending.items()), set())]
+        self.pending = {}
+        while len(segments) > 1 and 2 * len(segments[-1][0]) >= len(segments[-2][0]):
+            older, newer = segments[-2], segments[-1]
+            self.deleted -= len(older[1]) + len(newer[1])
+            segments[-2:] = [(SuffixArray(_live(older) + _live(newer)), set())]
+            self.merges += 1
+        self.segments = segments
+
+
+def _live(entry):
+    # The (word, node) pairs of a segment that are not deleted
+    segment, deleted = entry
+    return [(segment.word(word_id), segment.nodes[word_id]) for word_id in range(len(segment)) if word_id not in deleted]
@@ -0,0 +1,27 @@
+# Test doubles shared by the test modules, so they do not import benchmark.py
+import random
+import string
+
+
+class PlainBackend:
+    # Stores words unencrypted, for tests of the data structure alone
+    name = "none"
+    wrapped_key = None
+
+    def __init__(self, public_key=None):
+        self.public_key = public_key
+
+    def encrypt(self, plaintext):
+        return plaintext
+
+    def client_decipher(self, decipher):
+        return self
+
+
+def synthetic_words(count, seed=0):
+    # Distinct lowercase words of 3 to 12 letters
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 12))))
+    return sorted(words)
@@ -0,0 +1,153 @@
+import heapq
+import random
+import sys
+import threading
+from collections import Counter
+
+from ciphers import AESGCMBackend
+from concurrent_trie import ConcurrentEncryptedTrie
+from helpers import PlainBackend, synthetic_words
+from keys import default_keys as keys
+from search import EncryptedTrie
+
+
+def make_trie(words=()):
+    trie = ConcurrentEncryptedTrie(keys.public_key, keys.decipher, backend=PlainBackend(keys.public_key))
+    trie.insert_many_encrypted(words)
+    return trie
+
+
+def run_threads(count, target):
+    threads = [threading.Thread(target=target, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_writer_threads_use_different_shards():
+    trie = make_trie(["alpha", "beta"])
+    trie.batch_size = 10 ** 9  # Nothing is merged, so the shards keep what each thread wrote
+    start = threading.Barrier(4)
+
+    def write(_):
+        start.wait()  # All four threads are alive at once
+        for _ in range(100):
+            trie.increase_word_frequency("alpha")
+
+    run_threads(4, write)
+    used = [shard for shard in trie.shards if shard.pending]
+    assert len(used) == 4
+    assert sum(shard.counts["alpha"] for shard in used) == 400
+    trie.flush()
+    assert dict(trie.autocomplete("")) == {"alpha": 400, "beta": 0}
+
+
+def test_readers_and_writers_keep_the_trie_consistent():
+    # A fixed amount of work per thread, with a short switch interval so the
+    # threads interleave inside the operations; the checks are exact
+    words = synthetic_words(3000, seed=7)
+    initial, fresh = words[:2000], words[2000:]
+    trie = make_trie(initial)
+    trie.start_flusher(interval=0.001)
+    increments = [Counter() for _ in range(4)]
+    errors = []
+
+    def reader(index):
+        rng = random.Random(index)
+        try:
+            for count in range(300):
+                prefix = rng.choice(initial)[:2 + count % 2]
+                found = [encrypted_word.decode() for encrypted_word in trie.autocomplete_encrypted(prefix, 10)]
+                assert all(word.startswith(prefix) for word in found) and len(set(found)) == len(found)
+                assert len(trie.top_k(20)) == 20
+                assert all(prefix in encrypted_word.decode() for encrypted_word in trie.autocomplete_substring(prefix, 5))
+                trie.autocomplete_fuzzy(prefix, 1, k=5)
+        except Exception as error:
+            errors.append(error)
+
+    def writer(index):
+        rng = random.Random(100 + index)
+        mine = fresh[index * 250:(index + 1) * 250]
+        try:
+            for position, word in enumerate(mine):
+                trie.insert_encrypted(word)
+                if position % 2:
+                    trie.delete(mine[position - 1])
+                for _ in range(5):
+                    selected = rng.choice(initial)
+                    trie.increase_word_frequency(selected)
+                    increments[index][selected] += 1
+        except Exception as error:
+            errors.append(error)
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    try:
+        threads = [threading.Thread(target=reader, args=(index,)) for index in range(3)]
+        threads += [threading.Thread(target=writer, args=(index,)) for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+        trie.stop_flusher()
+
+    assert errors == []
+    expected = sum(increments, Counter())
+    assert all(trie._path(word)[-1].frequency == expected[word] for word in initial)
+    kept = set(fresh[1::2])  # Each writer deletes the word before every odd one
+    assert all(trie._contains(word) == (word in kept) for word in fresh)
+    stored = [node for node in trie._walk(trie.root) if node.is_end_of_word]
+    assert len(trie.frequency_index) == len(stored) == len(initial) + len(kept)
+    for node in trie._walk(trie.root):
+        below = heapq.nlargest(trie.top_k_size, (n for n in trie._walk(node) if n.is_end_of_word),
+                               key=lambda n: n.frequency)
+        assert [n.frequency for n in node.top_k] == [n.frequency for n in below]
+    assert sorted(encrypted_word.decode() for encrypted_word in trie.autocomplete_substring("")) == \
+        sorted(initial + list(kept))
+
+
+def test_increments_are_merged_in_batches():
+    trie = make_trie(["alpha", "beta"])
+    trie.batch_size = 3
+    trie.increase_word_frequency("alpha")
+    trie.increase_word_frequency("beta", 2)
+    assert dict(trie.autocomplete("")) == {"alpha": 0, "beta": 0}
+    trie.increase_word_frequency("alpha")
+    assert dict(trie.autocomplete("")) == {"alpha": 2, "beta": 2}
+
+
+def test_answers_match_an_encrypted_trie():
+    words = synthetic_words(500, seed=3)
+    rng = random.Random(3)
+    selections = rng.choices(words, k=2000)
+    gone = rng.sample(words, 50)
+    tries = [make_trie(words), EncryptedTrie(keys.public_key, keys.decipher, backend=PlainBackend(keys.public_key))]
+    tries[1].insert_many_encrypted(words)
+    for trie in tries:
+        for word in selections:
+            trie.increase_word_frequency(word)
+        for word in gone:
+            trie.delete(word)
+    tries[0].flush()
+    frequency = dict(tries[1].autocomplete(""))
+
+    def ranking(encrypted_words):
+        # Ties may come out in either order: compare the frequencies
+        return [frequency[encrypted_word.decode()] for encrypted_word in encrypted_words]
+
+    for prefix in ("", "a", "mo", "zz"):
+        assert tries[0].autocomplete(prefix) == tries[1].autocomplete(prefix)
+        assert ranking(tries[0].autocomplete_encrypted(prefix, 10)) == ranking(tries[1].autocomplete_encrypted(prefix, 10))
+    assert ranking(tries[0].top_k(100)) == ranking(tries[1].top_k(100))
+
+
+def test_save_merges_pending_increments(tmp_path):
+    trie = ConcurrentEncryptedTrie(keys.public_key, keys.decipher, backend=AESGCMBackend(keys.public_key))
+    trie.insert_many_encrypted(["alpha", "beta"])
+    trie.increase_word_frequency("beta", 5)
+    path = str(tmp_path / "trie.snapshot")
+    trie.save(path)
+    assert dict(EncryptedTrie.load(path).autocomplete("")) == {"alpha": 0, "beta": 5}
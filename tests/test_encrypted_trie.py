@@ -0,0 +1,15 @@
+from ciphers import AESGCMBackend
+from keys import default_keys as keys
+from radix import EncryptedRadixTrie
+from search import EncryptedTrie
+
+
+def test_plain_insert_stores_an_encrypted_word():
+    for trie_class in (EncryptedTrie, EncryptedRadixTrie):
+        trie = trie_class(keys.public_key, keys.decipher, backend=AESGCMBackend(keys.public_key))
+        trie.insert("abc")
+        trie.insert("abd")
+        assert sorted(map(trie.decrypt_word, trie.autocomplete_encrypted("ab"))) == ["abc", "abd"]
+        assert trie.delete("abc")
+        assert not trie.delete("abc")
+        assert list(map(trie.decrypt_word, trie.top_k(5))) == ["abd"]
@@ -0,0 +1,55 @@
+import random
+
+from helpers import PlainBackend
+from keys import default_keys as keys
+from radix import RadixTrie
+from search import EncryptedTrie, Trie
+
+
+def distance(prefix, word):
+    # Edit distance from prefix to the closest prefix of word
+    row = list(range(len(prefix) + 1))
+    best = row[-1]
+    for letter in word:
+        previous, row = row, [row[0] + 1]
+        for j, expected in enumerate(prefix):
+            row.append(min(previous[j] + (expected != letter), previous[j + 1] + 1, row[j] + 1))
+        best = min(best, row[-1])
+    return best
+
+
+def vocabulary():
+    rng = random.Random(2)
+    return sorted({"".join(rng.choice("abcd") for _ in range(rng.randint(1, 7))) for _ in range(400)})
+
+
+def queries():
+    rng = random.Random(3)
+    return ["", "a", "dd", "abca", "bbbbbb"] + ["".join(rng.choice("abcde") for _ in range(rng.randint(1, 6)))
+                                                for _ in range(40)]
+
+
+def check(trie, suggest):
+    words = vocabulary()
+    for prefix in queries():
+        for max_edits in (0, 1, 2):
+            found = suggest(trie, prefix, max_edits)
+            assert sorted(found) == sorted(word for word in words if distance(prefix, word) <= max_edits)
+            distances = [distance(prefix, word) for word in found]
+            assert distances == sorted(distances)  # Closest first
+
+
+def test_fuzzy_matches_brute_force():
+    for trie_class in (Trie, RadixTrie):
+        trie = trie_class()
+        for word in vocabulary():
+            trie.insert(word)
+        check(trie, lambda trie, prefix, max_edits: [word for word, _ in trie.autocomplete_fuzzy(prefix, max_edits)])
+
+
+def test_encrypted_fuzzy_matches_brute_force():
+    trie = EncryptedTrie(keys.public_key, keys.decipher, backend=PlainBackend(keys.public_key))
+    trie.insert_many_encrypted(vocabulary())
+    check(trie, lambda trie, prefix, max_edits: [encrypted_word.decode()  # Plain backend
+                                                 for encrypted_word in trie.autocomplete_fuzzy(prefix, max_edits)])
+
@@ -0,0 +1,142 @@
+import os
+
+from ciphers import AESGCMBackend
+from journal import SEGMENT_NAME, data_dir_keys, detach, open_journaled
+from keys import KeyManager, default_keys as keys
+from search import EncryptedTrie
+
+
+def build():
+    trie = EncryptedTrie(keys.public_key, keys.decipher, backend=AESGCMBackend(keys.public_key))
+    trie.insert_many_encrypted(["alpha", "beta"])
+    return trie
+
+
+def reopen(directory):
+    trie, journal = open_journaled(directory, build, EncryptedTrie, keys.decipher, interval=0)
+    journal.close()
+    return dict(trie.autocomplete(""))
+
+
+def test_journal_survives_metrics_toggle(tmp_path):
+    trie, journal = open_journaled(str(tmp_path), build, EncryptedTrie, keys.decipher, interval=0)
+    trie.enable_metrics()
+    trie.insert_encrypted("gamma")
+    trie.disable_metrics()
+    trie.insert_encrypted("delta")
+    trie.increase_word_frequency("delta", 3)
+    trie.delete("alpha")
+    journal.close()
+    assert reopen(str(tmp_path)) == {"beta": 0, "gamma": 0, "delta": 3}
+
+
+def test_metrics_enabled_before_the_journal(tmp_path):
+    trie = build()
+    metrics = trie.enable_metrics()
+    trie, journal = open_journaled(str(tmp_path), lambda: trie, EncryptedTrie, keys.decipher, interval=0)
+    trie.disable_metrics()  # Metrics sit below the journal's wrappers here
+    trie.insert_encrypted("gamma")
+    trie.increase_word_frequency("gamma", 2)
+    assert "encrypt_calls" not in metrics.stats()["counters"]
+    journal.close()
+    assert reopen(str(tmp_path)) == {"alpha": 0, "beta": 0, "gamma": 2}
+
+
+def test_detach_stops_journaling(tmp_path):
+    trie, journal = open_journaled(str(tmp_path), build, EncryptedTrie, keys.decipher, interval=0)
+    trie.enable_metrics()
+    assert detach(trie) is journal
+    trie.insert_encrypted("gamma")
+    assert trie.stats()["counters"]["encrypt_calls"] == 1
+    journal.close()
+    assert reopen(str(tmp_path)) == {"alpha": 0, "beta": 0}
+
+
+def test_corpus_load_is_journaled(tmp_path):
+    trie, journal = open_journaled(str(tmp_path), build, EncryptedTrie, keys.decipher, interval=0)
+    assert trie.insert_corpus([("gamma", 4), ("alpha", 2), ("delta", 1), ("gamma", 1)]) == 2
+    expected = {"alpha": 2, "beta": 0, "gamma": 5, "delta": 1}
+    assert dict(trie.autocomplete("")) == expected
+    journal.close()
+    assert reopen(str(tmp_path)) == expected
+
+
+def test_corpus_load_counts_encryptions():
+    trie = build()
+    trie.enable_metrics()
+    trie.insert_corpus([("gamma", 4), ("delta", 1)])
+    assert trie.stats()["counters"]["encrypt_calls"] == 2
+    assert [trie.decrypt_word(word) for word in trie.top_k(2)] == ["gamma", "delta"]
+
+
+def test_data_dir_keeps_its_key(tmp_path):
+    # Two starts without a key file, each with a new KeyManager as a new
+    # process would have: the second must still read the first's snapshot
+    directory = str(tmp_path)
+    for start in range(2):
+        trie_keys = data_dir_keys(directory, KeyManager(bits=1024))
+
+        def build_with_keys():
+            trie = EncryptedTrie(trie_keys.public_key, trie_keys.decipher,
+                                 backend=AESGCMBackend(trie_keys.public_key))
+            trie.insert_many_encrypted(["alpha", "beta"])
+            return trie
+
+        trie, journal = open_journaled(directory, build_with_keys, EncryptedTrie, trie_keys.decipher, interval=0)
+        trie.increase_word_frequency("beta")
+        journal.close()
+        assert dict(trie.autocomplete("")) == {"alpha": 0, "beta": start + 1}
+        assert trie.decrypt_word(trie.top_k(1)[0]) == "beta"  # Unwraps the stored data key
+
+
+def test_long_word_is_journaled(tmp_path):
+    word = "é" * 40000  # 80000 UTF-8 bytes
+    trie, journal = open_journaled(str(tmp_path), build, EncryptedTrie, keys.decipher, interval=0)
+    trie.insert_encrypted(word)
+    journal.close()
+    assert reopen(str(tmp_path)) == {"alpha": 0, "beta": 0, word: 0}
+
+
+def test_increments_of_a_word_share_a_record(tmp_path):
+    trie, journal = open_journaled(str(tmp_path), build, EncryptedTrie, keys.decipher, interval=0)
+    for _ in range(5):
+        trie.increase_word_frequency("alpha")
+    trie.increase_word_frequency("beta", 2)
+    assert journal.stats()["pending_records"] == 2
+    journal.commit()
+    assert journal.stats()["commits"] == 1
+    journal.close()
+    assert reopen(str(tmp_path)) == {"alpha": 5, "beta": 2}
+
+
+def test_crash_loses_only_the_uncommitted_group(tmp_path):
+    trie, journal = open_journaled(str(tmp_path), build, EncryptedTrie, keys.decipher, interval=0)
+    trie.increase_word_frequency("alpha", 2)
+    journal.commit()
+    trie.increase_word_frequency("beta", 3)  # Never written: the process "dies" here
+    assert reopen(str(tmp_path)) == {"alpha": 2, "beta": 0}
+    journal.segment.close()
+
+
+def test_torn_tail_is_cut_off(tmp_path):
+    trie, journal = open_journaled(str(tmp_path), build, EncryptedTrie, keys.decipher, interval=0)
+    trie.increase_word_frequency("alpha", 2)
+    journal.close()
+    segment = journal._path(SEGMENT_NAME, journal.segment_seq)
+    size = os.path.getsize(segment)
+    with open(segment, "ab") as segment_file:
+        segment_file.write(b"\x07\x00\x00\x00\x20\x00\x00\x00torn")
+    assert reopen(str(tmp_path)) == {"alpha": 2, "beta": 0}
+    assert os.path.getsize(segment) == size
+
+
+def test_compaction_folds_the_journal_into_a_snapshot(tmp_path):
+    trie, journal = open_journaled(str(tmp_path), build, EncryptedTrie, keys.decipher, interval=0)
+    trie.insert_encrypted("gamma")
+    trie.increase_word_frequency("gamma", 4)
+    trie.delete("alpha")
+    assert journal.compact(wait=True)
+    trie.increase_word_frequency("beta")
+    journal.close()
+    assert sorted(os.listdir(tmp_path)) == ["journal.00000002", "snapshot.00000001"]
+    assert reopen(str(tmp_path)) == {"beta": 1, "gamma": 4}
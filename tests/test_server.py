@@ -0,0 +1,61 @@
+import argparse
+import asyncio
+
+from ciphers import AESGCMBackend
+from keys import default_keys as keys
+from search import EncryptedTrie
+from server import AutocompleteClient, AutocompleteServer, build_trie
+
+
+def snapshot(tmp_path):
+    trie = EncryptedTrie(keys.public_key, keys.decipher, backend=AESGCMBackend(keys.public_key))
+    trie.insert_many_encrypted(["alpha", "beta"])
+    path = str(tmp_path / "trie.snapshot")
+    trie.save(path)
+    return path
+
+
+def serve_args(path, writable):
+    return argparse.Namespace(snapshot=path, mmap=True, mmap_writable=writable, corpus=None)
+
+
+def select_and_reopen(path, writable):
+    trie = build_trie(serve_args(path, writable))
+    trie.increase_word_frequency("beta", 3)
+    assert dict(trie.autocomplete("")) == {"alpha": 0, "beta": 3}
+    trie.close()
+    with EncryptedTrie.load(path, mmap=True) as reopened:
+        return dict(reopened.autocomplete(""))
+
+
+def test_mapped_snapshot_is_read_only_by_default(tmp_path):
+    path = snapshot(tmp_path)
+    with open(path, "rb") as snapshot_file:
+        before = snapshot_file.read()
+    assert select_and_reopen(path, False) == {"alpha": 0, "beta": 0}
+    with open(path, "rb") as snapshot_file:
+        assert snapshot_file.read() == before
+
+
+def test_mmap_writable_writes_selections_back(tmp_path):
+    assert select_and_reopen(snapshot(tmp_path), True) == {"alpha": 0, "beta": 3}
+
+
+async def info(trie, path):
+    server = AutocompleteServer(trie)
+    await server.start(path=path)
+    client = await AutocompleteClient.connect(path=path)
+    try:
+        return await client.info()
+    finally:
+        await client.close()
+        await server.close()
+
+
+def test_info_counts_words_and_nodes(tmp_path):
+    path = snapshot(tmp_path)
+    socket_path = str(tmp_path / "socket")
+    for mmap in (False, True):
+        trie = build_trie(argparse.Namespace(snapshot=path, mmap=mmap, mmap_writable=False, corpus=None))
+        sizes = asyncio.run(info(trie, socket_path))
+        assert (sizes["words"], sizes["nodes"]) == (2, 10)  # The root and one node per letter
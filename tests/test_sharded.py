@@ -0,0 +1,83 @@
+import threading
+
+from ciphers import AESGCMBackend
+from keys import default_keys as keys
+from search import EncryptedTrie
+from sharded import ShardedEncryptedTrie
+
+PAIRS = [("apple", 3), ("banana", 1), ("apple", 2), ("cherry", 0), ("kiwi", 4), ("zebra", 1), ("kiwi", 1)]
+
+
+def make_sharded(shards=3):
+    return ShardedEncryptedTrie(keys.public_key, keys.decipher, backend=AESGCMBackend(keys.public_key),
+                                shards=shards, rebalance_interval=0)
+
+
+def frequencies(trie):
+    return {trie.decrypt_word(encrypted_word): frequency for encrypted_word, frequency in trie._fan_out(None, "top_k", None)}
+
+
+def test_corpus_matches_a_single_trie():
+    single = EncryptedTrie(keys.public_key, keys.decipher, backend=AESGCMBackend(keys.public_key))
+    single.insert_corpus(PAIRS)
+    for workers in (None, 1):
+        with make_sharded() as trie:
+            assert trie.insert_corpus(PAIRS, workers, 2) == 5
+            assert frequencies(trie) == dict(single.autocomplete(""))
+
+
+def test_insert_many_takes_workers_before_chunk_size():
+    with make_sharded() as trie:
+        assert trie.insert_many_encrypted(["apple", "kiwi", "apple"], 1) == 2
+        assert trie.delete_many(["apple", "apple", "melon"]) == 1
+        assert frequencies(trie) == {"kiwi": 0}
+
+
+def test_inserts_racing_a_rebalance_reach_the_right_shard():
+    words = ["%s%04d" % (letter, number) for letter in "mz" for number in range(300)]
+    with make_sharded(4) as trie:
+        trie.insert_many_encrypted(words[:300])
+        done = threading.Event()
+
+        def rebalance():
+            while not done.is_set():
+                trie.rebalance()
+
+        thread = threading.Thread(target=rebalance)
+        thread.start()
+        for word in words[300:]:
+            trie.insert_encrypted(word)
+            trie.increase_word_frequency(word)
+        done.set()
+        thread.join()
+        assert sum(trie.sizes()) == len(words)
+        assert all(trie.autocomplete_encrypted(word) for word in words)
+        assert frequencies(trie) == {word: int(word >= "z") for word in words}
+
+
+def test_lookups_match_a_single_trie():
+    words = ["%s%s%02d" % (first, second, number) for first in "akz" for second in "bm" for number in range(20)]
+    single = EncryptedTrie(keys.public_key, keys.decipher, backend=AESGCMBackend(keys.public_key))
+    with make_sharded() as trie:
+        for target in (single, trie):
+            target.insert_many_encrypted(words)
+            for frequency, word in enumerate(words):  # Distinct frequencies: no ties to order
+                target.increase_word_frequency(word, frequency)
+        prefixes = ["", "a", "k", "zm", "zm1", "q"]
+        for prefix, batch in zip(prefixes, trie.autocomplete_encrypted_batch(prefixes, 7)):
+            expected = list(map(single.decrypt_word, single.autocomplete_encrypted(prefix, 7)))
+            assert list(map(trie.decrypt_word, trie.autocomplete_encrypted(prefix, 7))) == expected
+            assert list(map(trie.decrypt_word, batch)) == expected
+        assert list(map(trie.decrypt_word, trie.top_k(30))) == list(map(single.decrypt_word, single.top_k(30)))
+
+
+def test_rebalance_evens_out_skewed_shards():
+    words = ["z%04d" % number for number in range(1200)] + ["apple", "kiwi"]
+    with make_sharded(4) as trie:
+        trie.insert_many_encrypted(words)
+        trie.increase_word_frequency("z0042", 5)
+        assert max(trie.sizes()) == 1200
+        assert trie.rebalance() > 0
+        assert sum(trie.sizes()) == len(words) and max(trie.sizes()) < 600
+        assert frequencies(trie) == dict.fromkeys(words, 0) | {"z0042": 5}
+        assert list(map(trie.decrypt_word, trie.autocomplete_encrypted("z004", 2))) == ["z0042", "z0040"]
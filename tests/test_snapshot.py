@@ -0,0 +1,32 @@
+import pytest
+
+from ciphers import AESGCMBackend
+from keys import KeyManager
+from search import EncryptedTrie
+
+
+def snapshot(tmp_path, trie_keys):
+    trie = EncryptedTrie(trie_keys.public_key, trie_keys.decipher, backend=AESGCMBackend(trie_keys.public_key))
+    trie.insert_many_encrypted(["alpha", "beta"])
+    path = str(tmp_path / "trie.snapshot")
+    trie.save(path)
+    return path
+
+
+def test_snapshot_opens_with_its_key(tmp_path):
+    trie_keys = KeyManager(bits=1024)
+    path = snapshot(tmp_path, trie_keys)
+    trie = EncryptedTrie.load(path, decipher=trie_keys.decipher)
+    assert sorted(map(trie.decrypt_word, trie.autocomplete_encrypted(""))) == ["alpha", "beta"]
+    with EncryptedTrie.load(path, mmap=True, decipher=trie_keys.decipher) as mapped:
+        assert sorted(map(mapped.decrypt_word, mapped.autocomplete_encrypted(""))) == ["alpha", "beta"]
+
+
+def test_another_key_is_refused_by_name(tmp_path):
+    path = snapshot(tmp_path, KeyManager(bits=1024))
+    other = KeyManager(bits=1024)
+    with pytest.raises(ValueError, match="different key"):
+        EncryptedTrie.load(path, decipher=other.decipher)
+    with EncryptedTrie.load(path, mmap=True, decipher=other.decipher) as mapped:
+        with pytest.raises(ValueError, match="different key"):
+            mapped.decrypt_word(mapped.top_k(1)[0])
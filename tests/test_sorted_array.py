@@ -0,0 +1,15 @@
+from sorted_array import PARTITION_THRESHOLD, SortedArrayTrie
+
+
+def test_long_range_breaks_ties_in_word_order():
+    trie = SortedArrayTrie()
+    words = [f"w{i:05d}" for i in range(4 * PARTITION_THRESHOLD)]
+    for word in words:
+        trie.insert(word)
+    for word in words[::7]:
+        trie.increase_word_frequency(word, 2)
+    for word in words[::5]:
+        trie.increase_word_frequency(word, 1)
+    ranked = sorted(trie.autocomplete("w"), key=lambda pair: (-pair[1], pair[0]))
+    for k in (1, 10, 100, 300, 600):
+        assert trie.autocomplete_batch(["w"], k) == [ranked[:k]]
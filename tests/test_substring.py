@@ -0,0 +1,72 @@
+import random
+import threading
+
+from ciphers import AESGCMBackend
+from concurrent_trie import ConcurrentEncryptedTrie
+from helpers import PlainBackend
+from keys import default_keys as keys
+from search import EncryptedTrie
+from substring import PENDING_LIMIT
+
+
+def matching(trie, fragment):
+    return sorted(encrypted_word.decode() for encrypted_word in trie.autocomplete_substring(fragment))  # Plain backend
+
+
+def test_index_follows_inserts_and_deletes():
+    rng = random.Random(1)
+    trie = EncryptedTrie(keys.public_key, keys.decipher, backend=PlainBackend(keys.public_key))
+    words = {"".join(rng.choice("abc") for _ in range(rng.randint(1, 6))) for _ in range(200)}
+    trie.insert_many_encrypted(words)
+    trie.autocomplete_substring("a")  # Builds the index
+    for _ in range(20 * PENDING_LIMIT):
+        word = "".join(rng.choice("abcd") for _ in range(rng.randint(1, 6)))
+        if word in words and rng.random() < 0.5:
+            trie.delete(word)
+            words.discard(word)
+        else:
+            trie.insert_encrypted(word)
+            words.add(word)
+    stats = trie.substring_index.stats()
+    assert stats["merges"] and stats["pending"] < PENDING_LIMIT and stats["words"] == len(words)
+    for fragment in ("", "a", "cd", "bad", "dd", "abcd"):
+        assert matching(trie, fragment) == sorted(word for word in words if fragment in word)
+
+
+def test_words_stored_during_the_build_are_indexed():
+    trie = ConcurrentEncryptedTrie(keys.public_key, keys.decipher, backend=PlainBackend(keys.public_key))
+    trie.insert_many_encrypted("w%05d" % number for number in range(5000))
+    added = ["x%05d" % number for number in range(2000)]
+
+    def write():
+        for word in added:
+            trie.insert_encrypted(word)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    trie.autocomplete_substring("w", 1)  # Builds the index while the writer runs
+    writer.join()
+    assert matching(trie, "x") == added
+
+
+def test_matches_anywhere_ranked_by_frequency():
+    trie = EncryptedTrie(keys.public_key, keys.decipher, backend=AESGCMBackend(keys.public_key))
+    trie.insert_many_encrypted(["phone", "smartphone", "headphones", "telephony", "phantom", "honey"])
+    trie.increase_word_frequency("headphones", 3)
+    trie.increase_word_frequency("smartphone", 2)
+    trie.increase_word_frequency("phone", 1)
+    found = trie.autocomplete_substring("phone")
+    assert list(map(trie.decrypt_word, found)) == ["headphones", "smartphone", "phone"]
+    assert found == trie.autocomplete_encrypted("", 3)  # The trie's own ciphertexts
+    trie.increase_word_frequency("phone", 5)  # Frequencies are read from the trie's nodes
+    assert list(map(trie.decrypt_word, trie.autocomplete_substring("phone", 2))) == ["phone", "headphones"]
+    assert trie.autocomplete_substring("xyz") == []
+
+
+def test_memory_is_measured():
+    trie = EncryptedTrie(keys.public_key, keys.decipher, backend=PlainBackend(keys.public_key))
+    trie.insert_many_encrypted("w%05d" % number for number in range(1000))
+    trie.autocomplete_substring("w")
+    stats = trie.substring_index.stats()
+    assert stats["words"] == 1000 and stats["suffixes"] >= 1000
+    assert stats["bytes"] == trie.substring_index.nbytes() > 0